@@ -0,0 +1,153 @@
+"""
+Static UI assets
+Builds content-hashed, precompressed copies of static/ for long-lived caching
+and serves them (and the index page) with the best encoding the client accepts
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import stat
+from pathlib import Path
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SOURCE_DIR = Path(__file__).resolve().parent / "static"
+
+# Built files; hashed names make every file here safe to cache forever
+BUILD_DIR = Path(os.environ.get(
+    "SANDBOX_ASSET_DIR",
+    str(Path(os.environ.get("SANDBOX_HOME", "/home/sandbox")) / ".assets")
+))
+
+# Assets referenced from index.html as {{name}}
+HASHED_ASSETS = ('app.css', 'app.js')
+
+COMPRESSIBLE = {'.css', '.js', '.html', '.svg', '.json', '.txt'}
+
+# Preferred first; br only when the optional brotli module is installed
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')] if brotli else [('gzip', '.gz')]
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# Logical name -> hashed file name
+manifest = {}
+
+# Rendered index page: ETag plus the body per encoding
+index_page = {'etag': None, 'bodies': {}}
+
+def _compress(data):
+    """Precompressed variants of data, keeping only ones that are smaller"""
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli:
+        variants['br'] = brotli.compress(data, quality=11)
+    return {encoding: body for encoding, body in variants.items() if len(body) < len(data)}
+
+def _write(path, data):
+    # Names carry the content hash, so an existing file is already up to date
+    if path.exists():
+        return
+    # Every server worker builds at startup, so each writes its own temp file
+    tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+def build():
+    """Write hashed and precompressed assets and render the index page"""
+    BUILD_DIR.mkdir(parents=True, exist_ok=True)
+    for name in HASHED_ASSETS:
+        data = (SOURCE_DIR / name).read_bytes()
+        stem, suffix = os.path.splitext(name)
+        hashed = f"{stem}.{hashlib.blake2b(data, digest_size=6).hexdigest()}{suffix}"
+        _write(BUILD_DIR / hashed, data)
+        if suffix in COMPRESSIBLE:
+            for encoding, body in _compress(data).items():
+                _write(BUILD_DIR / (hashed + dict(ENCODINGS)[encoding]), body)
+        manifest[name] = hashed
+
+    # Drop builds of older asset versions
+    current = set(manifest.values())
+    for path in BUILD_DIR.iterdir():
+        if path.suffix != '.tmp' and path.name.removesuffix('.gz').removesuffix('.br') not in current:
+            path.unlink(missing_ok=True)
+
+    html = (SOURCE_DIR / "index.html").read_text()
+    for name, hashed in manifest.items():
+        html = html.replace("{{" + name + "}}", hashed)
+    body = html.encode()
+    index_page['bodies'] = {'identity': body, **_compress(body)}
+    index_page['etag'] = '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+    return manifest
+
+def choose_encoding(accept_encoding, available):
+    """Best of the available encodings allowed by an Accept-Encoding header"""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        token, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[token.strip().lower()] = quality
+    for encoding, _ in ENCODINGS:
+        if encoding in available and accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+def index_response(request):
+    """The index page, revalidated on every load so unchanged pages cost a 304"""
+    if index_page['etag'] is None:
+        build()
+    headers = {'ETag': index_page['etag'], 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+    if_none_match = request.headers.get('if-none-match') or ''
+    if index_page['etag'] in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]:
+        return Response(status_code=304, headers=headers)
+    encoding = choose_encoding(request.headers.get('accept-encoding'), index_page['bodies'])
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return Response(index_page['bodies'][encoding or 'identity'], media_type="text/html", headers=headers)
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves prebuilt .br/.gz siblings and marks hashed files immutable"""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        request_headers = Headers(scope=scope)
+        variants = {}
+        for name, suffix in ENCODINGS:
+            try:
+                variant_stat = os.stat(str(full_path) + suffix)
+            except OSError:
+                continue
+            if stat.S_ISREG(variant_stat.st_mode):
+                variants[name] = (str(full_path) + suffix, variant_stat)
+        encoding = choose_encoding(request_headers.get('accept-encoding'), variants)
+
+        if encoding:
+            path, variant_stat = variants[encoding]
+            media_type = mimetypes.guess_type(str(full_path))[0] or 'application/octet-stream'
+            response = FileResponse(path, status_code=status_code, stat_result=variant_stat,
+                                    method=scope["method"], media_type=media_type)
+            response.headers['content-encoding'] = encoding
+        else:
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result,
+                                    method=scope["method"])
+        if variants:
+            response.headers['vary'] = 'Accept-Encoding'
+        response.headers['cache-control'] = IMMUTABLE if os.path.basename(full_path) in manifest.values() else 'no-cache'
+
+        if self.is_not_modified(response.headers, request_headers):
+            return Response(status_code=304, headers={
+                name: value for name, value in response.headers.items()
+                if name in ('etag', 'cache-control', 'vary', 'content-encoding')
+            })
+        return response
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Benchmark: /health latency while N slow commands run through /api/command
+
+Usage: python3 benchmarks/bench_command_concurrency.py [--slow 32] [--sleep 2]
+"""
+
+import argparse
+import json
+import threading
+import time
+
+from common import ServerThread, request, summarize
+
+def measure_health(base_url, duration, interval=0.02):
+    """Poll /health for `duration` seconds and collect latencies"""
+    latencies = []
+    end = time.time() + duration
+    while time.time() < end:
+        elapsed, _, _ = request(base_url + "/health")
+        latencies.append(elapsed)
+        time.sleep(interval)
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--slow", type=int, default=32, help="number of concurrent slow commands")
+    parser.add_argument("--sleep", type=float, default=2.0, help="seconds each slow command sleeps")
+    args = parser.parse_args()
+
+    from startup import app
+
+    with ServerThread(app) as server:
+        baseline = measure_health(server.url, 1.0)
+
+        results = []
+        def slow_command():
+            elapsed, _, body = request(server.url + "/api/command", {'command': f"sleep {args.sleep}"})
+            results.append((elapsed, json.loads(body)))
+
+        started = time.perf_counter()
+        workers = [threading.Thread(target=slow_command) for _ in range(args.slow)]
+        for worker in workers:
+            worker.start()
+        loaded = measure_health(server.url, args.sleep)
+        for worker in workers:
+            worker.join()
+        wall = time.perf_counter() - started
+
+    report = {
+        'slow_commands': args.slow,
+        'sleep_seconds': args.sleep,
+        'wall_seconds': round(wall, 3),
+        'command_errors': sum(1 for _, body in results if 'error' in body),
+        'health_idle': summarize(baseline),
+        'health_under_load': summarize(loaded)
+    }
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
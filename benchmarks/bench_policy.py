@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Benchmark: compiled command policy against the old substring blacklist scan
+
+Generates rule sets of increasing size (exact programs with flag/argument
+patterns plus some program globs) and times, per command line:
+- the substring scan the server used before (lowercase + `in` per rule)
+- the policy engine without its cache (parse + indexed match)
+- the policy engine with a warm decision cache
+
+Usage: python3 benchmarks/bench_policy.py [--rules 10,1000,10000] [--repeat 50]
+"""
+
+import argparse
+import json
+import random
+import time
+
+import common  # noqa: F401  puts the sandbox modules on sys.path
+
+import policy
+
+COMMANDS = [
+    'ls -la /home/sandbox/projects',
+    'python3 analyze_data.py --window M',
+    'cat data.csv | grep Product | sort | uniq -c',
+    'pip3 install requests pandas',
+    'git status && git diff --stat',
+    'cd projects/sample-project && npm start',
+    'rm -rf /tmp/build',
+    'sudo rm /etc/hosts',
+    'bash -c "echo hi; rm -fr /var/tmp/x"',
+    'find . -name "*.pyc" | xargs rm -f',
+    'echo "$(date) $(whoami)"',
+    'tool42 --force -xv target',
+    'bash -lc "rm -rf /"',
+    'sh -ec "rm -rf /"',
+    'rm --recursive --force /',
+    'busybox rm -rf /',
+]
+
+# Evasions the default rules must still deny; checked before timing
+MUST_DENY = [
+    'bash -lc "rm -rf /"',
+    'sh -ec "rm -rf /"',
+    'bash -o pipefail -c "rm -fr /tmp"',
+    'rm --recursive --force /',
+    'rm --rec --force /',
+    'rm -r --force /',
+    'busybox rm -rf /',
+    'env bash -ec "sudo rm /etc/hosts"',
+    'find / -exec rm -rf {} \\;',
+    'find / -execdir rm -rf {} +',
+    'find /tmp -name x -ok rm -fr {} \\; -print',
+    'watch rm -rf /',
+    'watch -n 1 "rm -rf /"',
+    'parallel rm -rf ::: /a /b',
+    'strace -f rm -rf /',
+    'flock /tmp/lock rm -rf /',
+    'flock /tmp/lock -c "rm -rf /"',
+    'systemctl reboot',
+    'systemctl poweroff',
+    'systemctl halt',
+    'systemctl kexec',
+    'init 0',
+    'init 6',
+]
+
+def rule_set(count, seed=0):
+    rng = random.Random(seed)
+    deny = list(policy.DEFAULT_RULES['deny'])
+    while len(deny) < count:
+        i = len(deny)
+        kind = rng.random()
+        if kind < 0.6:
+            deny.append(f"tool{i} -{rng.choice('abcdefx')}{rng.choice('ghijklv')}")
+        elif kind < 0.9:
+            deny.append(f"tool{i} --{rng.choice(['force', 'all', 'recursive'])} target{rng.randrange(100)}")
+        else:
+            deny.append(f"gen{i}*")
+    return {'default': 'allow', 'deny': deny[:count], 'allow': []}
+
+def substring_scan(rules):
+    """The pre-policy check, with the rule texts as substrings"""
+    patterns = [rule.lower() for rule in rules['deny']]
+    def check(command):
+        return not any(pattern in command.lower() for pattern in patterns)
+    return check
+
+def mean_microseconds(check, commands, repeat):
+    """Average time per check, timed over whole batches to keep timer overhead out"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for command in commands:
+            check(command)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best / len(commands) * 1e6, 2)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rules", default="10,1000,10000", help="comma-separated rule counts")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    allowed = [command for command in MUST_DENY if policy.Policy().check(command).allowed]
+    if allowed:
+        raise SystemExit(f"❌ Default rules allow: {allowed}")
+
+    results = []
+    for count in (int(value) for value in args.rules.split(',')):
+        rules = rule_set(count)
+        start = time.perf_counter()
+        compiled = policy.Policy(rules)
+        compile_seconds = time.perf_counter() - start
+
+        results.append({
+            'rules': count,
+            'compile_ms': round(compile_seconds * 1000, 2),
+            'substring_scan_us': mean_microseconds(substring_scan(rules), COMMANDS, args.repeat),
+            # _check bypasses the decision cache, so every call parses and matches
+            'policy_uncached_us': mean_microseconds(compiled._check, COMMANDS, args.repeat),
+            'policy_cached_us': mean_microseconds(compiled.check, COMMANDS, args.repeat),
+            'denied': sum(not compiled.check(command).allowed for command in COMMANDS)
+        })
+
+    print(json.dumps({'commands': len(COMMANDS), 'results': results}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Benchmark: /proxy/{port}/ against hitting a local service directly
+
+Starts a stand-in upstream service (small JSON responses, a large streamed
+download, a WebSocket echo) and the sandbox server as separate processes,
+with the upstream's port declared in sandbox.yml, then measures both ways
+of reaching it:
+- sequential small-request latency over one keep-alive client connection
+- requests/s with concurrent clients
+- large download throughput
+- WebSocket echo round trips
+
+Usage: python3 benchmarks/bench_proxy.py [--requests 2000] [--clients 16] [--mb 256]
+"""
+
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import yaml
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route, WebSocketRoute
+from websockets.asyncio.client import connect
+
+from common import ROOT, free_port, summarize
+from bench_workers import wait_ready
+
+CHUNK = b'x' * 65536
+
+async def small(request):
+    return JSONResponse({'status': 'running', 'port': 3000})
+
+async def large(request):
+    mb = int(request.query_params.get('mb', '1'))
+
+    async def body():
+        for _ in range(mb * 16):
+            yield CHUNK
+    return StreamingResponse(body(), media_type='application/octet-stream',
+                             headers={'Content-Length': str(mb * 16 * len(CHUNK))})
+
+async def echo(websocket):
+    await websocket.accept()
+    try:
+        while True:
+            await websocket.send_text(await websocket.receive_text())
+    except Exception:
+        pass
+
+upstream_app = Starlette(routes=[
+    Route('/small', small),
+    Route('/large', large),
+    WebSocketRoute('/ws', echo)
+])
+
+def sequential(port, prefix, count):
+    """Latencies of small GETs over one keep-alive connection"""
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        connection.request('GET', prefix + '/small')
+        connection.getresponse().read()
+        latencies.append(time.perf_counter() - start)
+    connection.close()
+    return latencies
+
+def concurrent(port, prefix, count, clients):
+    """Requests per second with `clients` threads sharing `count` requests"""
+    def client():
+        sequential(port, prefix, count // clients)
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return round(count // clients * clients / (time.perf_counter() - start), 1)
+
+def download(port, prefix, mb):
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    start = time.perf_counter()
+    connection.request('GET', f'{prefix}/large?mb={mb}')
+    response = connection.getresponse()
+    received = 0
+    while True:
+        chunk = response.read(1 << 20)
+        if not chunk:
+            break
+        received += len(chunk)
+    elapsed = time.perf_counter() - start
+    connection.close()
+    return round(received / elapsed / 1e6, 1)
+
+async def websocket_round_trips(port, prefix, count):
+    latencies = []
+    async with connect(f'ws://127.0.0.1:{port}{prefix}/ws', proxy=None) as websocket:
+        for i in range(count):
+            start = time.perf_counter()
+            await websocket.send(f'message {i}')
+            await websocket.recv()
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+def measure(port, prefix, args):
+    sequential(port, prefix, 50)  # warm up connections and the upstream pool
+    return {
+        'sequential': summarize(sequential(port, prefix, args.requests)),
+        'requests_per_second': concurrent(port, prefix, args.requests, args.clients),
+        'download_mb_per_s': download(port, prefix, args.mb),
+        'websocket': summarize(asyncio.run(websocket_round_trips(port, prefix, args.requests // 4)))
+    }
+
+def start(command, port, env=None):
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               start_new_session=True)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            http.client.HTTPConnection('127.0.0.1', port, timeout=1).connect()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{command[0]} did not start")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--mb", type=int, default=256, help="size of the streamed download")
+    args = parser.parse_args()
+
+    upstream_port, port = free_port(), free_port()
+    home = tempfile.mkdtemp(prefix="sandbox-bench-")
+    with open(os.path.join(ROOT, "sandbox.yml")) as f:
+        config = yaml.safe_load(f)
+    config['network']['ports'].append({'name': 'bench-upstream', 'port': upstream_port})
+    with open(os.path.join(home, "sandbox.yml"), 'w') as f:
+        yaml.safe_dump(config, f)
+    env = dict(os.environ, SANDBOX_HOME=home, SANDBOX_JOBS_DIR=os.path.join(home, ".jobs"),
+               SANDBOX_SERVICE_LOG_DIR=os.path.join(home, "logs"), SANDBOX_PYTHON_WORKERS="0")
+
+    processes = []
+    try:
+        processes.append(start([sys.executable, "-m", "uvicorn", "--app-dir", os.path.dirname(__file__),
+                                "--port", str(upstream_port), "--log-level", "warning", "bench_proxy:upstream_app"],
+                               upstream_port))
+        processes.append(start([sys.executable, os.path.join(ROOT, "startup.py"), "--port", str(port)], port, env))
+        if not wait_ready(port):
+            raise RuntimeError("server did not start")
+        report = {
+            'cpus': os.cpu_count(),
+            'requests': args.requests,
+            'clients': args.clients,
+            'direct': measure(upstream_port, '', args),
+            'proxied': measure(port, f'/proxy/{upstream_port}', args)
+        }
+    finally:
+        for process in processes:
+            os.killpg(process.pid, 15)
+            process.wait()
+        shutil.rmtree(home, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
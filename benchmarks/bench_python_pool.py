@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Benchmark: warm Python worker pool against a cold `python3 -c` subprocess
+
+Usage: python3 benchmarks/bench_python_pool.py [--runs 20] [--workers 2]
+"""
+
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+
+from common import summarize
+
+import pyworkers
+
+SNIPPET = "import pandas, numpy, matplotlib.pyplot; print(numpy.arange(10).sum())"
+
+def cold_run(runs):
+    """Time the old subprocess.run path"""
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", SNIPPET], capture_output=True, text=True, timeout=60)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+async def warm_run(runs, workers):
+    """Time the same snippet through the worker pool"""
+    pool = pyworkers.PythonWorkerPool(size=workers)
+    started = time.perf_counter()
+    await pool.start()
+    warmup = time.perf_counter() - started
+
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = await pool.run(code=SNIPPET, argv=['-c'])
+        latencies.append(time.perf_counter() - start)
+        assert result.get('returncode') == 0, result
+
+    start = time.perf_counter()
+    await asyncio.gather(*(pool.run(code=SNIPPET, argv=['-c']) for _ in range(runs)))
+    concurrent = time.perf_counter() - start
+    pool.shutdown()
+    return warmup, latencies, concurrent
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    cold = cold_run(args.runs)
+    warmup, warm, concurrent = asyncio.run(warm_run(args.runs, args.workers))
+    cold_p50 = summarize(cold)['p50_ms']
+    warm_p50 = summarize(warm)['p50_ms']
+    print(json.dumps({
+        'snippet': SNIPPET,
+        'runs': args.runs,
+        'cold_subprocess': summarize(cold),
+        'pool_warmup_seconds': round(warmup, 3),
+        'pool_sequential': summarize(warm),
+        'pool_concurrent_wall_seconds': round(concurrent, 3),
+        'speedup_p50': round(cold_p50 / warm_p50, 1) if warm_p50 else None
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
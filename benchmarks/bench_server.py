@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Benchmark: end-to-end load and latency for the sandbox server
+
+Boots startup.py's app in-process against a scratch SANDBOX_HOME whose
+sandbox.yml runs local stand-in services (a static HTTP server and an idle
+worker), then drives each scenario at every requested concurrency from
+separate client processes over keep-alive connections:
+- /health, /api/status and the UI page (home)
+- /api/command with a fast, a slow and an output-heavy command
+For each run it records throughput, latency percentiles, errors and the
+server's RSS and open fds (before, peak and after, to spot leaks).
+
+It then times the analyze_data.py pipeline (parse, aggregate, plot) in its
+full, chunked, parallel and cached modes on generated sales CSVs of
+increasing size, with each run's peak RSS.
+
+The report is printed and written as JSON (by default to
+benchmarks/results/server-<git describe>.json); compare two reports with
+benchmarks/compare.py.
+
+Usage: python3 benchmarks/bench_server.py [--concurrency 1,8,32] [--seconds 5]
+           [--scenarios health,status,...] [--rows 100000,1000000,5000000] [--output FILE]
+"""
+
+import argparse
+import concurrent.futures
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from common import ROOT, ServerThread, free_port, request, summarize
+
+ANALYSIS_DIR = os.path.join(ROOT, 'projects', 'data-analysis-project')
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+# name -> (method, path, JSON body)
+SCENARIOS = {
+    'health': ('GET', '/health', None),
+    'status': ('GET', '/api/status', None),
+    'home': ('GET', '/', None),
+    'command_fast': ('POST', '/api/command', {'command': 'true'}),
+    'command_slow': ('POST', '/api/command', {'command': 'sleep 0.25'}),
+    # About 590KB of stdout per request
+    'command_output': ('POST', '/api/command', {'command': 'seq 1 100000'})
+}
+
+# label -> analyze_data.py arguments; the cached runs share one cold cache
+ANALYSIS_RUNS = [
+    ('full', ['--mode', 'full', '--no-cache']),
+    ('chunked', ['--mode', 'chunked', '--no-cache']),
+    ('parallel', ['--mode', 'parallel', '--no-cache']),
+    ('cache_cold', ['--mode', 'full']),
+    ('cache_warm', ['--mode', 'full'])
+]
+
+def client(port, method, path, body, threads, start_at, seconds):
+    """One client process: `threads` keep-alive connections issuing requests until the deadline"""
+    payload = json.dumps(body).encode() if body is not None else None
+    headers = {'Accept-Encoding': 'gzip, br'}
+    if payload is not None:
+        headers['Content-Type'] = 'application/json'
+    results = []
+
+    def loop():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        latencies, errors, received = [], 0, 0
+        time.sleep(max(0.0, start_at - time.time()))
+        deadline = start_at + seconds
+        while time.time() < deadline:
+            start = time.perf_counter()
+            try:
+                connection.request(method, path, body=payload, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+                received += len(data)
+                # /api/command reports failures in the body with a 200
+                if response.status >= 400 or (method == 'POST' and b'"error"' in data[:4096]):
+                    errors += 1
+            except (OSError, http.client.HTTPException):
+                errors += 1
+                connection.close()
+            latencies.append(time.perf_counter() - start)
+        connection.close()
+        results.append((latencies, errors, received))
+
+    workers = [threading.Thread(target=loop) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return ([latency for latencies, _, _ in results for latency in latencies],
+            sum(errors for _, errors, _ in results), sum(received for _, _, received in results))
+
+def process_usage():
+    """(RSS bytes, open fds) of this process, which hosts the server"""
+    with open('/proc/self/status') as f:
+        rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmRSS:'))
+    return rss, len(os.listdir('/proc/self/fd'))
+
+class UsageSampler:
+    """Track peak RSS and fd count of the server while a run is in progress"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.before = process_usage()
+        self.peak = self.before
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            rss, fds = process_usage()
+            self.peak = (max(self.peak[0], rss), max(self.peak[1], fds))
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+    def report(self):
+        after = process_usage()
+        return {
+            'rss_mb_before': round(self.before[0] / 1e6, 1),
+            'rss_mb_peak': round(max(self.peak[0], after[0]) / 1e6, 1),
+            'rss_mb_after': round(after[0] / 1e6, 1),
+            'fds_before': self.before[1],
+            'fds_peak': max(self.peak[1], after[1]),
+            'fds_after': after[1]
+        }
+
+def load(pool, processes, port, scenario, concurrency, seconds):
+    """Run one scenario at one concurrency and summarize it"""
+    method, path, body = SCENARIOS[scenario]
+    processes = min(processes, concurrency)
+    threads = [concurrency // processes + (1 if i < concurrency % processes else 0) for i in range(processes)]
+    start_at = time.time() + 0.2
+    with UsageSampler() as sampler:
+        futures = [pool.submit(client, port, method, path, body, count, start_at, seconds) for count in threads]
+        outcomes = [future.result() for future in futures]
+        # Let in-flight work (subprocesses, buffers) settle before the "after" reading
+        time.sleep(0.5)
+    latencies = [latency for outcome in outcomes for latency in outcome[0]]
+    return {
+        'scenario': scenario,
+        'method': method,
+        'path': path,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': sum(outcome[1] for outcome in outcomes),
+        'throughput_rps': round(len(latencies) / seconds, 1),
+        'received_mb_per_s': round(sum(outcome[2] for outcome in outcomes) / seconds / 1e6, 2),
+        'latency': summarize(latencies),
+        'server': sampler.report()
+    }
+
+def write_config(home, web_port):
+    """sandbox.yml with stand-in services in place of Jupyter and the dev server"""
+    with open(os.path.join(ROOT, 'sandbox.yml')) as f:
+        config = yaml.safe_load(f)
+    config['network']['ports'].append({'name': 'bench-web', 'port': web_port})
+    config['startup'] = {'scripts': [], 'services': [
+        {'name': 'bench-web', 'command': f"{sys.executable} -m http.server {web_port} --bind 127.0.0.1",
+         'auto_start': True},
+        {'name': 'bench-worker', 'command': 'sleep infinity', 'auto_start': True}
+    ]}
+    with open(os.path.join(home, 'sandbox.yml'), 'w') as f:
+        yaml.safe_dump(config, f)
+    shutil.copy(os.path.join(ROOT, 'tools.json'), home)
+
+def wait_for_services(url, timeout=60):
+    """Block until startup has finished and every stand-in service is ready"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        health = json.loads(request(url + '/health')[2])
+        services = json.loads(request(url + '/api/services')[2])['services']
+        if health['ready'] and all(service['state'] == 'ready' for service in services):
+            return
+        time.sleep(0.1)
+    raise RuntimeError("stand-in services did not become ready")
+
+def run_server(args, home):
+    port, web_port = free_port(), free_port()
+    write_config(home, web_port)
+    os.environ.update(SANDBOX_HOME=home, SANDBOX_PORT=str(port),
+                      SANDBOX_JOBS_DIR=os.path.join(home, '.jobs'),
+                      SANDBOX_SERVICE_LOG_DIR=os.path.join(home, 'logs'),
+                      SANDBOX_PKG_SEED=os.path.join(home, 'no-seed'), SANDBOX_PKG_OFFLINE='1',
+                      SANDBOX_PYTHON_WORKERS=str(args.python_workers))
+    # The server modules read their settings from the environment on import
+    import startup
+    import store
+    startup.load_sandbox_config()
+    store.reset()
+    for volume in ('projects', 'tools'):
+        os.makedirs(os.path.join(home, volume), exist_ok=True)
+
+    scenarios = args.scenarios.split(',')
+    concurrencies = [int(value) for value in args.concurrency.split(',')]
+    processes = args.client_processes or os.cpu_count() or 1
+    context = multiprocessing.get_context('spawn')
+    runs = []
+    with ServerThread(startup.app, port) as server, \
+            concurrent.futures.ProcessPoolExecutor(processes, mp_context=context) as pool:
+        wait_for_services(server.url)
+        # Start every client process before anything is measured
+        list(pool.map(time.sleep, [0.5] * processes))
+        baseline = process_usage()
+        for scenario in scenarios:
+            load(pool, processes, port, scenario, min(concurrencies), 1)  # warm up
+            for concurrency in concurrencies:
+                result = load(pool, processes, port, scenario, concurrency, args.seconds)
+                runs.append(result)
+                print(f"  {scenario:15} c={concurrency:<4} {result['throughput_rps']:>9} req/s  "
+                      f"p50 {result['latency']['p50_ms']:>8} ms  p99 {result['latency']['p99_ms']:>8} ms  "
+                      f"rss {result['server']['rss_mb_after']} MB  fds {result['server']['fds_after']}",
+                      file=sys.stderr)
+    return {
+        'baseline': {'rss_mb': round(baseline[0] / 1e6, 1), 'fds': baseline[1]},
+        'runs': runs
+    }
+
+def generate_csv(path, rows, products=20, days=730, seed=0):
+    """Sales rows shaped like sales_data.csv, with about 1% missing amounts"""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2023-01-01', periods=days).strftime('%Y-%m-%d').to_numpy()
+    names = np.array([f'Product {i}' for i in range(products)])
+    sales = np.where(rng.random(rows) < 0.01, np.nan, rng.gamma(2.0, 50.0, rows).round(2))
+    pd.DataFrame({
+        'Date': dates[np.sort(rng.integers(0, days, rows))],
+        'Product': names[rng.integers(0, products, rows)],
+        'Sales': sales
+    }).to_csv(path, index=False)
+
+# Runs analyze_data.py as __main__ and reports the process's own peak RSS on
+# exit. wait4's ru_maxrss would include the high-water mark of the forking
+# benchmark process, which Linux carries across exec.
+PIPELINE_LAUNCHER = """
+import atexit, os, runpy, sys
+def report():
+    with open('/proc/self/status') as f:
+        print(next(line for line in f if line.startswith('VmHWM:')), file=sys.stderr)
+atexit.register(report)
+sys.argv = sys.argv[1:]
+sys.path.insert(0, os.path.dirname(sys.argv[0]))
+runpy.run_path(sys.argv[0], run_name='__main__')
+"""
+
+def time_pipeline(csv_path, arguments, env, scratch):
+    """Wall time and peak RSS of one analyze_data.py run"""
+    command = [sys.executable, '-c', PIPELINE_LAUNCHER, os.path.join(ANALYSIS_DIR, 'analyze_data.py'), csv_path,
+               '--output', os.path.join(scratch, 'sales_by_product.png'), *arguments]
+    start = time.perf_counter()
+    result = subprocess.run(command, env=env, cwd=scratch, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    peak = [line.split()[1] for line in result.stderr.splitlines() if line.startswith('VmHWM:')]
+    return {
+        'seconds': round(elapsed, 3),
+        'peak_rss_mb': round(int(peak[-1]) * 1024 / 1e6, 1) if peak else None,
+        'ok': result.returncode == 0 and 'Analysis complete' in result.stdout
+    }
+
+def run_analysis(args, home):
+    scratch = os.path.join(home, 'analysis')
+    os.makedirs(scratch)
+    env = dict(os.environ, MPLBACKEND='Agg')
+    results = []
+    for rows in (int(value) for value in args.rows.split(',')):
+        csv_path = os.path.join(scratch, f'sales-{rows}.csv')
+        generate_csv(csv_path, rows)
+        env.update(SALES_CACHE_DIR=os.path.join(scratch, f'cache-{rows}'),
+                   CHART_CACHE_DIR=os.path.join(scratch, f'charts-{rows}'))
+        result = {'rows': rows, 'csv_mb': round(os.path.getsize(csv_path) / 1e6, 1), 'modes': {}}
+        for label, arguments in ANALYSIS_RUNS:
+            result['modes'][label] = time_pipeline(csv_path, arguments, env, scratch)
+            print(f"  analyze_data {rows:>10} rows  {label:10} {result['modes'][label]['seconds']:>8} s",
+                  file=sys.stderr)
+        results.append(result)
+        os.unlink(csv_path)
+    return results
+
+def describe_commit():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=30).stdout.strip() or 'unknown'
+    except (OSError, subprocess.TimeoutExpired):
+        return 'unknown'
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated client connection counts")
+    parser.add_argument("--seconds", type=float, default=5.0, help="duration of each scenario at each concurrency")
+    parser.add_argument("--scenarios", default=','.join(SCENARIOS), help="comma-separated subset of scenarios")
+    parser.add_argument("--client-processes", type=int, default=0,
+                        help="processes generating load (default: one per CPU)")
+    parser.add_argument("--python-workers", type=int, default=0,
+                        help="SANDBOX_PYTHON_WORKERS for the server; none of the scenarios run python3")
+    parser.add_argument("--rows", default="100000,1000000,5000000",
+                        help="comma-separated CSV sizes for analyze_data.py; empty to skip")
+    parser.add_argument("--output", help="where to write the JSON report")
+    args = parser.parse_args()
+    unknown = set(args.scenarios.split(',')) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    commit = describe_commit()
+    home = tempfile.mkdtemp(prefix="sandbox-bench-")
+    report = {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'seconds': args.seconds
+    }
+    try:
+        report['server'] = run_server(args, home)
+        report['analysis'] = run_analysis(args, home) if args.rows else []
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+    output = args.output or os.path.join(RESULTS_DIR, f'server-{commit}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"📝 Report written to {output}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Benchmark: workspace snapshots and restores
+
+Builds a synthetic projects tree (many small source files, a few large data
+files, duplicated content) and times:
+- the first snapshot, which hashes and stores everything
+- a snapshot with nothing changed
+- a snapshot after editing a small share of the files
+- restoring the first snapshot after edits and deletions
+and reports how much the object store grew each time.
+
+Usage: python3 benchmarks/bench_snapshots.py [--files 20000] [--large 4] [--large-mb 64]
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import common  # noqa: F401  puts the sandbox modules on sys.path
+
+import files
+import snapshots
+
+def build_tree(root, count, large, large_mb, rng):
+    for i in range(count):
+        directory = os.path.join(root, f"project{i % 20}", f"module{i % 97}")
+        os.makedirs(directory, exist_ok=True)
+        # A third of the files share content, like vendored or generated code
+        body = f"# shared file {i % 50}\n" * 40 if i % 3 == 0 else f"# file {i}\n" + "x = 1\n" * rng.randint(10, 400)
+        with open(os.path.join(directory, f"file{i}.py"), 'w') as f:
+            f.write(body)
+    os.makedirs(os.path.join(root, "data"), exist_ok=True)
+    for i in range(large):
+        with open(os.path.join(root, "data", f"dataset{i}.bin"), 'wb') as f:
+            for _ in range(large_mb):
+                f.write(os.urandom(1024 * 1024))
+
+def all_files(root):
+    return [os.path.join(directory, name) for directory, _, names in os.walk(root) for name in names]
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def stored_content(content):
+    """A file's bytes as the snapshot store has them"""
+    chunks = content if isinstance(content, list) else [content]
+    return b''.join(read(snapshots.object_path(sha256)) for sha256 in chunks)
+
+def timed(label, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return {'step': label, 'seconds': round(time.perf_counter() - start, 3), **result}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=20000)
+    parser.add_argument("--large", type=int, default=4, help="large data files")
+    parser.add_argument("--large-mb", type=int, default=64)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    home = tempfile.mkdtemp(prefix="sandbox-bench-")
+    projects = os.path.join(home, "projects")
+    snapshots.SNAPSHOT_DIR = snapshots.Path(home) / ".snapshots"
+    files.volumes['projects'] = snapshots.Path(projects)
+    try:
+        build_tree(projects, args.files, args.large, args.large_mb, rng)
+        paths = all_files(projects)
+        steps = []
+
+        def snapshot():
+            summary = snapshots.take('projects')
+            return {key: summary[key] for key in ('files', 'bytes', 'hashed', 'added_bytes')}
+
+        steps.append(timed('first snapshot', snapshot))
+        first_id = snapshots.list_snapshots('projects')[0]['id']
+        steps.append(timed('unchanged snapshot', snapshot))
+
+        for path in rng.sample(paths, len(paths) // 100):
+            with open(path, 'a') as f:
+                f.write("# edited\n")
+        steps.append(timed('1% edited snapshot', snapshot))
+
+        for path in rng.sample(paths, len(paths) // 10):
+            os.unlink(path)
+        with open(os.path.join(projects, "data", "dataset0.bin"), 'r+b') as f:
+            f.write(b'corrupted')
+        steps.append(timed('restore first snapshot', lambda: snapshots.restore(first_id)))
+
+        restored = snapshots.load(first_id)['entries']
+        mismatched = [path for path, entry in restored.items() if entry[0] == 'f'
+                      and read(os.path.join(projects, path)) != stored_content(entry[4])]
+        stats = snapshots.stats()
+        report = {
+            'files': len(paths),
+            'workspace_bytes': sum(os.path.getsize(path) for path in paths),
+            'steps': steps,
+            'stored_bytes': stats['stored_bytes'],
+            'snapshot_bytes': stats['snapshot_bytes'],
+            'restore_mismatches': len(mismatched)
+        }
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Benchmark: API throughput with 1, 2, 4... server workers
+
+Starts `startup.py --workers N` against a scratch SANDBOX_HOME for each N and
+drives it from several client processes over keep-alive connections, mixing
+/api/status, /api/jobs and /health. Reports requests/sec per worker count.
+
+Usage: python3 benchmarks/bench_workers.py [--workers 1,2,4] [--seconds 10] [--clients 4]
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import ROOT, free_port, summarize
+
+PATHS = ['/api/status', '/api/jobs', '/health']
+
+def client(port, seconds, connections, results):
+    """One client process: round-robin requests over a few connections"""
+    conns = [http.client.HTTPConnection("127.0.0.1", port, timeout=10) for _ in range(connections)]
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + seconds
+    i = 0
+    while time.perf_counter() < deadline:
+        conn = conns[i % connections]
+        start = time.perf_counter()
+        try:
+            conn.request("GET", PATHS[i % len(PATHS)])
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 400:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+        latencies.append(time.perf_counter() - start)
+        i += 1
+    results.put((latencies, errors))
+
+def wait_ready(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+def run(workers, seconds, clients, connections):
+    home = tempfile.mkdtemp(prefix="sandbox-bench-")
+    shutil.copy(os.path.join(ROOT, "sandbox.yml"), home)
+    port = free_port()
+    env = dict(os.environ, SANDBOX_HOME=home, SANDBOX_JOBS_DIR=os.path.join(home, ".jobs"),
+               SANDBOX_SERVICE_LOG_DIR=os.path.join(home, "logs"), SANDBOX_PYTHON_WORKERS="0")
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "startup.py"), "--workers", str(workers), "--port", str(port)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+    )
+    try:
+        if not wait_ready(port):
+            raise RuntimeError("server did not start")
+        time.sleep(1)
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=client, args=(port, seconds, connections, results))
+                 for _ in range(clients)]
+        started = time.perf_counter()
+        for proc in procs:
+            proc.start()
+        latencies, errors = [], 0
+        for _ in procs:
+            part, part_errors = results.get()
+            latencies += part
+            errors += part_errors
+        elapsed = time.perf_counter() - started
+        for proc in procs:
+            proc.join()
+    finally:
+        os.killpg(server.pid, 15)
+        server.wait()
+        shutil.rmtree(home, ignore_errors=True)
+
+    return {
+        'workers': workers,
+        'requests': len(latencies),
+        'errors': errors,
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'latency': summarize(latencies)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated worker counts")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--clients", type=int, default=4, help="client processes")
+    parser.add_argument("--connections", type=int, default=4, help="keep-alive connections per client")
+    args = parser.parse_args()
+
+    results = [run(int(n), args.seconds, args.clients, args.connections) for n in args.workers.split(',')]
+    base = results[0]['requests_per_second']
+    for result in results:
+        result['scaling'] = round(result['requests_per_second'] / base, 2) if base else None
+    print(json.dumps({'cpus': os.cpu_count(), 'paths': PATHS, 'results': results}, indent=2))
+
+if __name__ == "__main__":
+    main()
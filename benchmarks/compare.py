@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Compare two benchmark JSON reports, e.g. from bench_server.py on two commits
+
+Every metric whose name says which way is better is matched between the
+reports and printed with its relative change:
+- higher is better: throughput (*_rps, *_per_s)
+- lower is better: latency (*_ms), durations (seconds), memory (rss), fds, errors
+List entries are matched by their scenario/concurrency/rows/step fields, and
+top-level scalars (commit, timestamp, ...) are treated as metadata.
+Exits with status 1 if any metric got worse by more than --threshold percent.
+
+Usage: python3 benchmarks/compare.py OLD.json NEW.json [--threshold 10] [--all]
+"""
+
+import argparse
+import json
+import sys
+
+# Fields that identify an entry in a list of runs
+KEY_FIELDS = ('scenario', 'concurrency', 'rows', 'step', 'workers', 'mode')
+
+# Readings taken before a run starts say nothing about the run itself
+SKIPPED = ('_before',)
+
+def direction(name):
+    """+1 if a larger value is better, -1 if smaller is better, 0 if neither"""
+    if name.endswith(SKIPPED):
+        return 0
+    if name.endswith(('_rps', '_per_s', 'requests_per_second')):
+        return 1
+    if name.endswith(('_ms', 'seconds', 'errors')) or 'rss' in name or name.startswith('fds'):
+        return -1
+    return 0
+
+def entry_key(item, index):
+    fields = [f"{field}={item[field]}" for field in KEY_FIELDS if field in item]
+    return '[' + ','.join(fields) + ']' if fields else f'[{index}]'
+
+def flatten(value, path=''):
+    """Map of dotted path -> number for every leaf below `value`"""
+    leaves = {}
+    if isinstance(value, dict):
+        for name, child in value.items():
+            leaves.update(flatten(child, f'{path}.{name}' if path else name))
+    elif isinstance(value, list):
+        for index, child in enumerate(value):
+            key = entry_key(child, index) if isinstance(child, dict) else f'[{index}]'
+            leaves.update(flatten(child, path + key))
+    elif isinstance(value, (bool, int, float)):
+        leaves[path] = value
+    return leaves
+
+def metrics(report):
+    """Flattened metrics, leaving out the top-level metadata"""
+    return flatten({name: value for name, value in report.items() if isinstance(value, (dict, list))})
+
+def change(old, new):
+    if old == new:
+        return 0.0
+    if old == 0:
+        return float('inf')
+    return (new - old) / abs(old) * 100
+
+def compare(old_report, new_report, threshold):
+    """(rows, regressions) where each row is (path, old, new, percent change, verdict)"""
+    old, new = metrics(old_report), metrics(new_report)
+    rows, regressions = [], []
+    for path in sorted(old.keys() & new.keys()):
+        before, after = old[path], new[path]
+        if isinstance(before, bool) or isinstance(after, bool):
+            if before and not after:
+                rows.append((path, before, after, None, 'failed'))
+                regressions.append(path)
+            continue
+        better = direction(path.rsplit('.', 1)[-1])
+        if not better:
+            continue
+        percent = change(before, after)
+        verdict = ''
+        if percent * better < -threshold:
+            verdict = 'worse'
+            regressions.append(path)
+        elif percent * better > threshold:
+            verdict = 'better'
+        rows.append((path, before, after, percent, verdict))
+    return rows, regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent change that counts as a difference")
+    parser.add_argument("--all", action="store_true", help="also list metrics within the threshold")
+    args = parser.parse_args()
+
+    with open(args.old) as f:
+        old_report = json.load(f)
+    with open(args.new) as f:
+        new_report = json.load(f)
+
+    for field in ('cpus', 'python', 'seconds'):
+        if field in old_report and old_report.get(field) != new_report.get(field):
+            print(f"⚠️ {field} differs: {old_report.get(field)} vs {new_report.get(field)}")
+
+    rows, regressions = compare(old_report, new_report, args.threshold)
+    print(f"{old_report.get('commit', args.old)} -> {new_report.get('commit', args.new)}")
+    width = max((len(row[0]) for row in rows), default=10)
+    for path, before, after, percent, verdict in rows:
+        if not verdict and not args.all:
+            continue
+        shown = '' if percent is None else f"{percent:+.1f}%"
+        print(f"{path:<{width}}  {before:>12}  {after:>12}  {shown:>9}  {verdict}")
+
+    if regressions:
+        print(f"❌ {len(regressions)} of {len(rows)} metrics worse by more than {args.threshold:g}%")
+        sys.exit(1)
+    print(f"✅ No metric worse by more than {args.threshold:g}% ({len(rows)} compared)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Startup pipeline
+Records how long each startup phase takes (init.sh steps included) and
+answers /health from a bare listener while the web stack is still importing.
+Only the standard library is used here so it can run first.
+"""
+
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+
+IMPORTED_AT = time.time()
+
+SANDBOX_HOME = Path(os.environ.get("SANDBOX_HOME", "/home/sandbox"))
+
+# Written by init.sh, one JSON object per step
+INIT_TIMELINE = SANDBOX_HOME / ".state" / "init-timeline.jsonl"
+
+# Phases of this server process, in the order they finished
+phases = []
+
+ready_at = None
+
+# Listener bound before the heavy imports; uvicorn takes over its socket
+_early = {'server': None, 'thread': None, 'socket': None}
+
+def process_started_at():
+    """Wall-clock time the kernel started this process, or None off Linux"""
+    try:
+        with open('/proc/self/stat') as f:
+            # Field 22, counted after the parenthesised command name
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        uptime = time.clock_gettime(time.CLOCK_BOOTTIME)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+    return time.time() - (uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+
+def record(name, start, end=None, **extra):
+    """Add a finished phase"""
+    phases.append({'phase': name, 'start': start, 'end': time.time() if end is None else end, **extra})
+
+@contextmanager
+def phase(name):
+    start = time.time()
+    try:
+        yield
+    finally:
+        record(name, start)
+
+def mark_ready():
+    """The server is up and everything deferred at startup has finished"""
+    global ready_at
+    ready_at = time.time()
+
+def init_phases():
+    """Steps of the last init.sh run"""
+    try:
+        lines = INIT_TIMELINE.read_text().splitlines()
+    except OSError:
+        return []
+    steps = []
+    for line in lines:
+        try:
+            steps.append(json.loads(line))
+        except ValueError:
+            pass
+    return steps
+
+def _timeline(entries, origin):
+    return [
+        {
+            **entry,
+            'offset': round(entry['start'] - origin, 4),
+            'seconds': round(entry['end'] - entry['start'], 4)
+        }
+        for entry in sorted(entries, key=lambda entry: entry['start'])
+    ]
+
+def report():
+    """Each phase with its offset and duration
+
+    Server phases are timed from process start; init.sh steps from the
+    start of the last init.sh run, which may have been at image build time.
+    """
+    started = process_started_at() or IMPORTED_AT
+    server = [{'phase': 'server.interpreter', 'start': started, 'end': IMPORTED_AT}, *phases]
+    init = init_phases()
+    return {
+        'started_at': started,
+        'ready': ready_at is not None,
+        'ready_after': round(ready_at - started, 4) if ready_at else None,
+        'server': _timeline(server, started),
+        'init': _timeline(init, min((step['start'] for step in init), default=started))
+    }
+
+class _EarlyHandler(BaseHTTPRequestHandler):
+    """Answers /health while the real app loads; everything else is told to retry"""
+
+    def do_GET(self):
+        if self.path.split('?')[0] == '/health':
+            status, payload = 200, {
+                'status': 'starting',
+                'message': 'Ubuntu Sandbox is starting',
+                'timestamp': time.time()
+            }
+        else:
+            status, payload = 503, {'error': 'Sandbox is starting'}
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 503:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_HEAD = do_GET
+
+    def log_message(self, *args):
+        pass
+
+def requested_port():
+    """--port or SANDBOX_PORT, read before startup.py defines its own parser"""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--port', type=int, default=int(os.environ.get("SANDBOX_PORT", "8000")))
+    return parser.parse_known_args()[0].port
+
+def listen_early(port, host="0.0.0.0"):
+    """Bind the server socket now and answer /health until the app takes it over"""
+    start = time.time()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    server = HTTPServer((host, port), _EarlyHandler, bind_and_activate=False)
+    server.socket = sock
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    _early.update(server=server, thread=thread, socket=sock)
+    record('server.bind', start)
+    return sock
+
+def early_socket():
+    return _early['socket']
+
+def stop_early_listener():
+    """Stop answering on the early listener, leaving its socket open for uvicorn"""
+    server = _early['server']
+    if server is None:
+        return
+    server.shutdown()
+    _early['thread'].join()
+    _early.update(server=None, thread=None)
@@ -0,0 +1,323 @@
+"""
+Async command execution engine
+Runs shell commands as asyncio subprocesses so slow commands never block the server
+"""
+
+import asyncio
+import codecs
+import contextlib
+import os
+import signal
+import time
+import uuid
+from collections import deque
+
+import limits
+import tracing
+from pyworkers import parse_python_command
+
+# Maximum number of commands running at the same time, overall and per user
+MAX_CONCURRENT_COMMANDS = int(os.environ.get("SANDBOX_MAX_COMMANDS", "16"))
+MAX_COMMANDS_PER_USER = int(os.environ.get("SANDBOX_MAX_COMMANDS_PER_USER", str(MAX_CONCURRENT_COMMANDS)))
+
+# Default and upper bound for per-command timeouts (seconds)
+DEFAULT_TIMEOUT = float(os.environ.get("SANDBOX_COMMAND_TIMEOUT", "30"))
+MAX_TIMEOUT = float(os.environ.get("SANDBOX_MAX_COMMAND_TIMEOUT", "600"))
+
+# Streaming output limits
+MAX_STREAM_BYTES = int(os.environ.get("SANDBOX_MAX_STREAM_BYTES", str(10 * 1024 * 1024)))
+STREAM_CHUNK_SIZE = 4096
+STREAM_QUEUE_SIZE = 64
+
+# Optional warm Python worker pool (pyworkers.PythonWorkerPool), set at startup
+python_pool = None
+
+# Commands currently running, keyed by command id
+running_commands = {}
+cancelled_commands = set()
+
+class FairShareSlots:
+    """Command slots shared fairly between users
+
+    When a slot frees up it goes to the waiting user with the fewest commands
+    already running, so one user queueing many heavy commands cannot starve
+    everyone else.
+    """
+
+    def __init__(self, total, per_user):
+        self.total = total
+        self.per_user = per_user
+        self.running = {}
+        self.waiting = {}
+        self.in_use = 0
+
+    def _dispatch(self):
+        while self.in_use < self.total:
+            candidates = [
+                user for user, queue in self.waiting.items()
+                if queue and self.running.get(user, 0) < self.per_user
+            ]
+            if not candidates:
+                return
+            # Fewest running first, then whoever has waited longest
+            user = min(candidates, key=lambda u: (self.running.get(u, 0), self.waiting[u][0][0]))
+            _, future = self.waiting[user].popleft()
+            if not self.waiting[user]:
+                del self.waiting[user]
+            self.running[user] = self.running.get(user, 0) + 1
+            self.in_use += 1
+            future.set_result(None)
+
+    async def acquire(self, user):
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.setdefault(user, deque()).append((time.monotonic(), future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(user)
+            else:
+                queue = self.waiting.get(user)
+                if queue:
+                    self.waiting[user] = deque(entry for entry in queue if entry[1] is not future)
+                    if not self.waiting[user]:
+                        del self.waiting[user]
+            raise
+
+    def release(self, user):
+        self.running[user] -= 1
+        if not self.running[user]:
+            del self.running[user]
+        self.in_use -= 1
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, user):
+        await self.acquire(user)
+        try:
+            yield
+        finally:
+            self.release(user)
+
+    def stats(self):
+        return {
+            'total': self.total,
+            'in_use': self.in_use,
+            'running': dict(self.running),
+            'waiting': {user: len(queue) for user, queue in self.waiting.items()}
+        }
+
+_command_slots = None
+
+def get_command_slots():
+    """Return the fair-share scheduler limiting concurrent commands"""
+    global _command_slots
+    if _command_slots is None:
+        _command_slots = FairShareSlots(MAX_CONCURRENT_COMMANDS, MAX_COMMANDS_PER_USER)
+    return _command_slots
+
+def resolve_timeout(timeout):
+    """Clamp a requested timeout to the configured bounds"""
+    if timeout is None:
+        return DEFAULT_TIMEOUT
+    return max(0.1, min(float(timeout), MAX_TIMEOUT))
+
+def kill_process_group(process, sig=signal.SIGKILL):
+    """Signal a subprocess and everything it spawned"""
+    try:
+        os.killpg(process.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+async def run_command_async(command, timeout=None, command_id=None, user=None):
+    """Run a shell command without blocking the event loop"""
+    command_id = command_id or uuid.uuid4().hex[:12]
+    timeout = resolve_timeout(timeout)
+
+    queued = time.perf_counter()
+    async with get_command_slots().slot(user or 'anonymous'):
+        tracing.record_span('queue', queued)
+
+        # Plain python3 invocations skip interpreter start-up in a warm worker
+        parsed = parse_python_command(command) if python_pool and python_pool.ready else None
+        if parsed:
+            code, path, argv = parsed
+
+            def register(process):
+                running_commands[command_id] = {
+                    'process': process,
+                    'command': command,
+                    'user': user,
+                    'started_at': time.time()
+                }
+
+            try:
+                with tracing.span('python_worker') as run:
+                    result = await python_pool.run(code=code, path=path, argv=argv, timeout=timeout,
+                                                   limit_args=limits.limit_args(command_id, user),
+                                                   on_start=register)
+                    run['returncode'] = result.get('returncode')
+            finally:
+                running_commands.pop(command_id, None)
+                limits.release(command_id, user)
+            if command_id in cancelled_commands:
+                cancelled_commands.discard(command_id)
+                return {'command_id': command_id, 'error': 'Command cancelled'}
+            result['command_id'] = command_id
+            return result
+
+        spawning = time.perf_counter()
+        try:
+            # Each command gets its own session so the whole tree can be killed
+            process = await asyncio.create_subprocess_shell(
+                command,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=True,
+                **limits.spawn_kwargs(command_id, user)
+            )
+        except Exception as e:
+            limits.release(command_id, user)
+            tracing.error(e)
+            return {'command_id': command_id, 'error': str(e)}
+        tracing.record_span('spawn', spawning, pid=process.pid)
+
+        running_commands[command_id] = {
+            'process': process,
+            'command': command,
+            'user': user,
+            'started_at': time.time()
+        }
+        running = time.perf_counter()
+        stdout = stderr = b''
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            kill_process_group(process)
+            await process.wait()
+            return {'command_id': command_id, 'error': 'Command timed out'}
+        except asyncio.CancelledError:
+            kill_process_group(process)
+            await process.wait()
+            raise
+        finally:
+            running_commands.pop(command_id, None)
+            limits.release(command_id, user)
+            tracing.record_span('run', running, returncode=process.returncode,
+                                stdout_bytes=len(stdout), stderr_bytes=len(stderr))
+
+    if command_id in cancelled_commands:
+        cancelled_commands.discard(command_id)
+        return {'command_id': command_id, 'error': 'Command cancelled'}
+
+    return {
+        'command_id': command_id,
+        'stdout': stdout.decode(errors='replace'),
+        'stderr': stderr.decode(errors='replace'),
+        'returncode': process.returncode
+    }
+
+def cancel_command(command_id):
+    """Cancel a running command, returns False if it is unknown"""
+    entry = running_commands.get(command_id)
+    if entry is None:
+        return False
+    cancelled_commands.add(command_id)
+    kill_process_group(entry['process'], signal.SIGTERM)
+    return True
+
+async def _pump_stream(stream, name, queue):
+    """Forward chunks from a pipe into a bounded queue"""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    while True:
+        chunk = await stream.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            break
+        # Blocks while the client is slow, which stops draining the pipe
+        # and in turn pauses the child process (backpressure)
+        await queue.put((name, len(chunk), decoder.decode(chunk)))
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        await queue.put((name, 0, tail))
+    await queue.put((name, 0, None))
+
+async def stream_command(command, timeout=None, command_id=None, max_bytes=None, user=None):
+    """Run a shell command and yield (event, payload) pairs as output arrives"""
+    command_id = command_id or uuid.uuid4().hex[:12]
+    timeout = resolve_timeout(timeout)
+    max_bytes = MAX_STREAM_BYTES if max_bytes is None else min(int(max_bytes), MAX_STREAM_BYTES)
+    loop = asyncio.get_running_loop()
+
+    queued = time.perf_counter()
+    async with get_command_slots().slot(user or 'anonymous'):
+        tracing.record_span('queue', queued)
+        spawning = time.perf_counter()
+        try:
+            process = await asyncio.create_subprocess_shell(
+                command,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=True,
+                **limits.spawn_kwargs(command_id, user)
+            )
+        except Exception as e:
+            limits.release(command_id, user)
+            tracing.error(e)
+            yield 'error', {'command_id': command_id, 'error': str(e)}
+            return
+        tracing.record_span('spawn', spawning, pid=process.pid)
+
+        running_commands[command_id] = {
+            'process': process,
+            'command': command,
+            'user': user,
+            'started_at': time.time()
+        }
+        queue = asyncio.Queue(STREAM_QUEUE_SIZE)
+        pumps = [
+            asyncio.create_task(_pump_stream(process.stdout, 'stdout', queue)),
+            asyncio.create_task(_pump_stream(process.stderr, 'stderr', queue))
+        ]
+        deadline = loop.time() + timeout
+        sent = 0
+        running = time.perf_counter()
+        try:
+            yield 'start', {'command_id': command_id}
+
+            open_streams = len(pumps)
+            while open_streams:
+                name, size, text = await asyncio.wait_for(queue.get(), deadline - loop.time())
+                if text is None:
+                    open_streams -= 1
+                    continue
+                if sent + size > max_bytes:
+                    kill_process_group(process)
+                    yield 'truncated', {'command_id': command_id, 'bytes': sent, 'limit': max_bytes}
+                    break
+                sent += size
+                yield name, text
+
+            returncode = await asyncio.wait_for(process.wait(), max(0.0, deadline - loop.time()))
+            if command_id in cancelled_commands:
+                yield 'error', {'command_id': command_id, 'error': 'Command cancelled'}
+            else:
+                yield 'exit', {'command_id': command_id, 'returncode': returncode, 'bytes': sent}
+        except asyncio.TimeoutError:
+            kill_process_group(process)
+            yield 'error', {'command_id': command_id, 'error': 'Command timed out'}
+        finally:
+            for pump in pumps:
+                pump.cancel()
+            if process.returncode is None:
+                kill_process_group(process)
+                try:
+                    await process.wait()
+                except asyncio.CancelledError:
+                    pass
+            running_commands.pop(command_id, None)
+            cancelled_commands.discard(command_id)
+            limits.release(command_id, user)
+            tracing.record_span('run', running, returncode=process.returncode, output_bytes=sent)
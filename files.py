@@ -0,0 +1,370 @@
+"""
+File transfer
+Upload and download for the volumes declared in sandbox.yml. Downloads are
+sent straight from disk with Range/resume support, uploads are written to
+disk chunk by chunk (and can be resumed with Content-Range), and directories
+stream out as tar or zip archives built on the fly, so server memory stays
+flat whatever the size.
+"""
+
+import asyncio
+import email.utils
+import mimetypes
+import os
+import queue
+import re
+import stat
+import tarfile
+import threading
+import uuid
+import zipfile
+from pathlib import Path
+from urllib.parse import quote
+
+from starlette.responses import Response, StreamingResponse
+
+SANDBOX_HOME = Path(os.environ.get("SANDBOX_HOME", "/home/sandbox"))
+
+# Read and write size; also the unit archive data is handed over in
+CHUNK_SIZE = 1024 * 1024
+
+# Archive chunks buffered ahead of a slow client
+ARCHIVE_QUEUE = 8
+
+ARCHIVE_FORMATS = {
+    'tar': 'application/x-tar',
+    'zip': 'application/zip'
+}
+
+# Resumable uploads collect here until the last byte arrives
+PARTIAL_SUFFIX = '.part'
+
+RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+CONTENT_RANGE = re.compile(r"bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)$")
+
+# Volume name -> directory
+volumes = {}
+
+class UploadOffsetError(ValueError):
+    """A chunk starts past the bytes received so far"""
+
+    def __init__(self, received):
+        super().__init__(f"Upload has {received} bytes, chunk must start at or before that")
+        self.received = received
+
+def configure(config):
+    """Take the volumes from a parsed sandbox.yml"""
+    volumes.clear()
+    for volume in (config or {}).get('volumes') or []:
+        if volume.get('name') and volume.get('path'):
+            volumes[volume['name']] = Path(volume['path'])
+    if not volumes:
+        volumes.update(projects=SANDBOX_HOME / "projects", tools=SANDBOX_HOME / "tools")
+
+def list_volumes():
+    return [{'name': name, 'path': str(path), 'exists': path.is_dir()} for name, path in volumes.items()]
+
+def resolve(volume, path=''):
+    """Absolute path of `path` inside a volume; symlinks may not lead out of it"""
+    if volume not in volumes:
+        raise LookupError(f"Unknown volume '{volume}'")
+    root = os.path.realpath(volumes[volume])
+    full = os.path.realpath(os.path.join(root, path.lstrip('/')))
+    if full != root and not full.startswith(root + os.sep):
+        raise PermissionError(f"{path} is outside the {volume} volume")
+    return Path(full)
+
+def list_directory(volume, path=''):
+    directory = resolve(volume, path)
+    entries = []
+    with os.scandir(directory) as scan:
+        for entry in scan:
+            try:
+                info = entry.stat()
+            except OSError:
+                continue
+            entries.append({
+                'name': entry.name,
+                'type': 'directory' if stat.S_ISDIR(info.st_mode) else 'file',
+                'size': info.st_size,
+                'modified': info.st_mtime
+            })
+    entries.sort(key=lambda entry: (entry['type'] != 'directory', entry['name']))
+    return {'volume': volume, 'path': path, 'entries': entries}
+
+def _etag(info):
+    return f'"{info.st_mtime_ns:x}-{info.st_size:x}"'
+
+def _disposition(name):
+    return f"attachment; filename*=UTF-8''{quote(name)}"
+
+def _byte_range(header, size):
+    """(start, end) for a single-range header, None to send the whole file
+
+    Raises ValueError when the range cannot be satisfied. Multi-range
+    requests get the whole file, which RFC 9110 allows.
+    """
+    match = RANGE.match(header.replace(' ', '')) if header else None
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(f"Range {header} is outside a file of {size} bytes")
+    return start, end
+
+class FileRangeResponse(Response):
+    """Sends a file, or one byte range of it, without reading it into memory
+
+    Under uvicorn, which does not offer the ASGI zero-copy extension, this
+    means pread of CHUNK_SIZE blocks in a thread: one copy through user space,
+    at most one block in memory. Only a server that offers the extension
+    gets the file handed over for sendfile.
+    """
+
+    def __init__(self, path, offset, count, status_code, headers):
+        super().__init__(status_code=status_code, headers=headers)
+        self.path = path
+        self.offset = offset
+        self.count = count
+
+    async def __call__(self, scope, receive, send):
+        await send({'type': 'http.response.start', 'status': self.status_code, 'headers': self.raw_headers})
+        if scope['method'] == 'HEAD' or self.count == 0:
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        with open(self.path, 'rb', buffering=0) as f:
+            if 'http.response.zerocopy' in scope.get('extensions', {}):
+                await send({'type': 'http.response.zerocopy', 'file': f, 'offset': self.offset, 'count': self.count})
+                return
+            fd = f.fileno()
+            os.posix_fadvise(fd, self.offset, self.count, os.POSIX_FADV_SEQUENTIAL)
+            offset, remaining = self.offset, self.count
+            while remaining > 0:
+                chunk = await asyncio.to_thread(os.pread, fd, min(CHUNK_SIZE, remaining), offset)
+                if not chunk:
+                    # Truncated while being sent; the short body tells the client
+                    raise OSError(f"{self.path} shrank during download")
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': remaining > 0})
+
+def download(volume, path, headers):
+    """Response for a file in a volume, honouring Range, If-Range and If-None-Match"""
+    full = resolve(volume, path)
+    info = full.stat()
+    if stat.S_ISDIR(info.st_mode):
+        raise IsADirectoryError(f"{path or '/'} is a directory")
+    if not stat.S_ISREG(info.st_mode):
+        raise ValueError(f"{path} is not a regular file")
+
+    etag = _etag(info)
+    response_headers = {
+        'ETag': etag,
+        'Last-Modified': email.utils.formatdate(info.st_mtime, usegmt=True),
+        'Accept-Ranges': 'bytes',
+        'Content-Type': mimetypes.guess_type(full.name)[0] or 'application/octet-stream',
+        'Content-Disposition': _disposition(full.name)
+    }
+    if headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=response_headers)
+
+    byte_range = None
+    # A resumed download only gets a range if the file has not changed since
+    if headers.get('if-range') in (None, etag):
+        try:
+            byte_range = _byte_range(headers.get('range'), info.st_size)
+        except ValueError:
+            return Response(status_code=416, headers={**response_headers, 'Content-Range': f"bytes */{info.st_size}"})
+
+    if byte_range is None:
+        return FileRangeResponse(full, 0, info.st_size, 200, {**response_headers, 'Content-Length': str(info.st_size)})
+    start, end = byte_range
+    return FileRangeResponse(full, start, end - start + 1, 206, {
+        **response_headers,
+        'Content-Length': str(end - start + 1),
+        'Content-Range': f"bytes {start}-{end}/{info.st_size}"
+    })
+
+class _ArchiveWriter:
+    """File-like sink for tarfile/zipfile that hands CHUNK_SIZE blocks to the response"""
+
+    def __init__(self):
+        self.chunks = queue.Queue(maxsize=ARCHIVE_QUEUE)
+        self.buffer = bytearray()
+        self.cancelled = False
+
+    def _put(self, item):
+        # Blocks while the client is slow, gives up once it has gone
+        while True:
+            if self.cancelled:
+                raise OSError("Archive download was cancelled")
+            try:
+                self.chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= CHUNK_SIZE:
+            self._put(bytes(self.buffer))
+            self.buffer.clear()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def finish(self, error=None):
+        if self.buffer and error is None:
+            self._put(bytes(self.buffer))
+        self._put(error)
+
+    def cancel(self):
+        self.cancelled = True
+        # Wake a reader that might still be waiting
+        try:
+            self.chunks.put_nowait(None)
+        except queue.Full:
+            pass
+
+def _zip_tree(root, writer):
+    # Streamed zips need no seeking: sizes follow each entry in a data descriptor
+    with zipfile.ZipFile(writer, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for directory, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            relative = os.path.relpath(directory, root.parent)
+            archive.write(directory, relative)
+            for name in sorted(filenames):
+                path = os.path.join(directory, name)
+                # zip has no portable symlinks, and following them could leave the
+                # volume; FIFOs and devices would block or never end when read
+                try:
+                    regular = stat.S_ISREG(os.lstat(path).st_mode)
+                except FileNotFoundError:
+                    continue
+                if regular:
+                    archive.write(path, os.path.join(relative, name))
+
+def _build_archive(root, fmt, writer):
+    try:
+        if fmt == 'zip':
+            _zip_tree(root, writer)
+        else:
+            # Symlinks are stored as links, never followed
+            with tarfile.open(fileobj=writer, mode='w|', bufsize=CHUNK_SIZE) as archive:
+                archive.add(root, arcname=root.name)
+        writer.finish()
+    except Exception as e:
+        if not writer.cancelled:
+            writer.finish(e)
+
+async def _archive_chunks(root, fmt, writer):
+    thread = threading.Thread(target=_build_archive, args=(root, fmt, writer), daemon=True)
+    thread.start()
+    try:
+        while True:
+            chunk = await asyncio.to_thread(writer.chunks.get)
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                # Raising drops the connection, so the client sees a truncated archive
+                raise chunk
+            yield chunk
+    finally:
+        writer.cancel()
+
+def archive(volume, path, fmt):
+    """A directory as a tar or zip stream, built while it is sent"""
+    if fmt not in ARCHIVE_FORMATS:
+        raise ValueError(f"Unknown archive format '{fmt}', use one of: {', '.join(ARCHIVE_FORMATS)}")
+    root = resolve(volume, path)
+    if not root.is_dir():
+        raise NotADirectoryError(f"{path or '/'} is not a directory")
+    name = f"{root.name or volume}.{fmt}"
+    return StreamingResponse(
+        _archive_chunks(root, fmt, _ArchiveWriter()),
+        media_type=ARCHIVE_FORMATS[fmt],
+        headers={'Content-Disposition': _disposition(name)}
+    )
+
+def _content_range(header):
+    """(start, end, total) from an upload's Content-Range; start/end are None for `bytes */total`"""
+    match = CONTENT_RANGE.match(header.strip())
+    if not match:
+        raise ValueError(f"Bad Content-Range '{header}'")
+    first, last, total = match.groups()
+    total = None if total == '*' else int(total)
+    if first is None:
+        return None, None, total
+    start, end = int(first), int(last)
+    if end < start or (total is not None and end >= total):
+        raise ValueError(f"Bad Content-Range '{header}'")
+    return start, end, total
+
+async def _write_stream(f, chunks, limit=None):
+    """Copy an async byte stream into f in CHUNK_SIZE writes; returns the bytes written"""
+    written = 0
+    buffer = bytearray()
+    async for chunk in chunks:
+        buffer += chunk
+        if limit is not None and written + len(buffer) > limit:
+            raise ValueError(f"Chunk is longer than its Content-Range ({limit} bytes)")
+        if len(buffer) >= CHUNK_SIZE:
+            await asyncio.to_thread(f.write, buffer)
+            written += len(buffer)
+            buffer = bytearray()
+    if buffer:
+        await asyncio.to_thread(f.write, buffer)
+        written += len(buffer)
+    return written
+
+async def upload(volume, path, chunks, content_range=None):
+    """Write a request body to a file in a volume
+
+    Without Content-Range the body is the whole file, which replaces the
+    target only once it has fully arrived. With `Content-Range: bytes
+    a-b/total` each request adds a chunk to a partial file that becomes the
+    target when it reaches `total`; `bytes */total` just reports how much
+    has arrived, so an interrupted upload can resume from there.
+    """
+    target = resolve(volume, path)
+    if not path.strip('/') or target.is_dir():
+        raise IsADirectoryError(f"{path or '/'} is a directory")
+    target.parent.mkdir(parents=True, exist_ok=True)
+
+    if not content_range:
+        temporary = target.with_name(f".{target.name}.upload-{uuid.uuid4().hex[:8]}")
+        try:
+            with open(temporary, 'wb') as f:
+                size = await _write_stream(f, chunks)
+            os.replace(temporary, target)
+        finally:
+            if temporary.exists():
+                temporary.unlink()
+        return {'volume': volume, 'path': path, 'received': size, 'complete': True}
+
+    start, end, total = _content_range(content_range)
+    partial = target.with_name(target.name + PARTIAL_SUFFIX)
+    received = partial.stat().st_size if partial.exists() else 0
+    if start is not None:
+        if start > received:
+            raise UploadOffsetError(received)
+        with open(partial, 'r+b' if partial.exists() else 'wb') as f:
+            f.seek(start)
+            try:
+                written = await _write_stream(f, chunks, limit=end - start + 1)
+            finally:
+                received = max(received, f.tell())
+        if written != end - start + 1:
+            raise ValueError(f"Chunk has {written} bytes, Content-Range says {end - start + 1}")
+
+    complete = total is not None and received >= total and partial.exists()
+    if complete:
+        os.truncate(partial, total)
+        os.replace(partial, target)
+    return {'volume': volume, 'path': path, 'received': received, 'total': total, 'complete': complete}
@@ -1,6 +1,9 @@
 #!/bin/bash
 
 # Ubuntu Sandbox Initialization Script
+# Steps whose inputs have not changed since the last run are skipped (stamp
+# files hold a hash of each step's inputs), independent steps run in
+# parallel, and each step's duration is written to the startup timeline
 echo "🐧 Initializing Ubuntu Sandbox..."
 
 # Set up environment
@@ -8,21 +11,74 @@ export DEBIAN_FRONTEND=noninteractive
 export PYTHONDONTWRITEBYTECODE=1
 export PYTHONUNBUFFERED=1
 
-# Create necessary directories
-mkdir -p /home/sandbox/projects
-mkdir -p /home/sandbox/tools
-mkdir -p /home/sandbox/.jupyter
+SANDBOX_HOME=${SANDBOX_HOME:-/home/sandbox}
+SAMPLE_PROJECT="$SANDBOX_HOME/projects/sample-project"
+PKG_SEED=${SANDBOX_PKG_SEED:-/opt/sandbox-packages}
 
-# Set up Git configuration (if not exists)
-if [ ! -f /home/sandbox/.gitconfig ]; then
+# Stamps live next to the user site-packages, so wiping ~/.local also
+# forces the pip step to run again
+STAMP_DIR=${SANDBOX_INIT_STAMPS:-$SANDBOX_HOME/.local/share/sandbox-init}
+
+# One JSON line per step, read by startup.py for /api/startup-timeline
+TIMELINE="$SANDBOX_HOME/.state/init-timeline.jsonl"
+
+# Returned by a step that found its stamp up to date
+SKIPPED=99
+
+now() { date +%s.%N; }
+
+inputs_hash() {
+    # Hash of files and literal strings; missing files hash as empty
+    for input in "$@"; do
+        if [ -f "$input" ]; then cat "$input"; else echo "$input"; fi
+    done | sha256sum | cut -d' ' -f1
+}
+
+stamp_fresh() { [ "$(cat "$STAMP_DIR/$1" 2>/dev/null)" = "$2" ]; }
+
+stamp_write() { echo "$2" > "$STAMP_DIR/$1"; }
+
+# Write stdin to a file only when the content differs
+write_if_changed() {
+    local tmp="$1.tmp.$$"
+    cat > "$tmp"
+    if cmp -s "$tmp" "$1"; then
+        rm -f "$tmp"
+        return $SKIPPED
+    fi
+    mv "$tmp" "$1"
+}
+
+# step NAME FUNCTION: run a step and append its duration to the timeline
+step() {
+    local start end code
+    start=$(now)
+    "$2"
+    code=$?
+    end=$(now)
+    local skipped=false
+    [ $code -eq $SKIPPED ] && skipped=true && code=0
+    printf '{"phase": "init.%s", "start": %s, "end": %s, "skipped": %s, "status": %d}\n' \
+        "$1" "$start" "$end" "$skipped" "$code" >> "$TIMELINE"
+    [ $skipped = true ] && echo "⏭️  $1 (unchanged)" || echo "✅ $1 ($(awk "BEGIN {printf \"%.2f\", $end - $start}")s)"
+    return $code
+}
+
+mkdir -p "$SANDBOX_HOME/projects" "$SANDBOX_HOME/tools" "$SANDBOX_HOME/.jupyter" "$SANDBOX_HOME/.state" "$STAMP_DIR"
+: > "$TIMELINE"
+
+git_config() {
+    # Set up Git configuration (if not exists)
+    [ -f "$SANDBOX_HOME/.gitconfig" ] && return $SKIPPED
     git config --global user.name "Sandbox User"
     git config --global user.email "sandbox@example.com"
     git config --global init.defaultBranch main
     git config --global --add safe.directory '*'
-fi
+}
 
-# Create useful aliases
-cat > /home/sandbox/.bash_aliases << 'EOF'
+aliases() {
+    # Create useful aliases
+    write_if_changed "$SANDBOX_HOME/.bash_aliases" << 'EOF'
 # Custom aliases for sandbox
 alias ll='ls -alF'
 alias la='ls -A'
@@ -45,11 +101,15 @@ alias processes='ps aux'
 alias memory='free -h'
 alias disk='df -h'
 EOF
+}
 
-# Create Jupyter configuration
-cat > /home/sandbox/.jupyter/jupyter_lab_config.py << 'EOF'
+jupyter_config() {
+    # Create Jupyter configuration
+    write_if_changed "$SANDBOX_HOME/.jupyter/jupyter_lab_config.py" << 'EOF'
 c.ServerApp.ip = '0.0.0.0'
 c.ServerApp.port = 8888
+# Served at /proxy/8888/, both through the sandbox server's proxy and on port 8888
+c.ServerApp.base_url = '/proxy/8888/'
 c.ServerApp.open_browser = False
 c.ServerApp.allow_root = True
 c.ServerApp.token = ''
@@ -57,11 +117,13 @@ c.ServerApp.password = ''
 c.ServerApp.allow_origin = '*'
 c.ServerApp.disable_check_xsrf = True
 EOF
+}
 
-# Create a sample project structure
-if [ ! -d "/home/sandbox/projects/sample-project" ]; then
-    mkdir -p /home/sandbox/projects/sample-project
-    cd /home/sandbox/projects/sample-project
+sample_project() {
+    # Create a sample project structure
+    [ -d "$SAMPLE_PROJECT" ] && return $SKIPPED
+    mkdir -p "$SAMPLE_PROJECT"
+    cd "$SAMPLE_PROJECT" || return 1
     
     # Create a simple Python web app
     cat > app.py << 'EOF'
@@ -179,17 +241,54 @@ app.listen(port, '0.0.0.0', () => {
     console.log(`🚀 Server running at http://0.0.0.0:${port}`);
 });
 EOF
-fi
+}
 
-# Install Python packages if requirements.txt exists
-if [ -f "/home/sandbox/projects/sample-project/requirements.txt" ]; then
+python_packages() {
+    # Install Python packages if requirements.txt exists, unless this exact
+    # requirements file was already installed for this interpreter
+    local requirements="$SAMPLE_PROJECT/requirements.txt"
+    [ -f "$requirements" ] || return $SKIPPED
+    local hash
+    hash=$(inputs_hash "$requirements" "$(python3 --version 2>&1)" "$SANDBOX_PKG_OFFLINE")
+    stamp_fresh python_packages "$hash" && return $SKIPPED
     echo "📦 Installing Python dependencies..."
-    cd /home/sandbox/projects/sample-project
-    pip3 install -r requirements.txt --user
-fi
+    # Prefer packages from the offline seed directory shared with pkgcache.py
+    local sources=()
+    if [ -d "$PKG_SEED" ]; then
+        sources=(--find-links "$PKG_SEED")
+        [ "$SANDBOX_PKG_OFFLINE" = "1" ] && sources+=(--no-index)
+    fi
+    pip3 install -r "$requirements" "${sources[@]}" --user --disable-pip-version-check --quiet || return 1
+    stamp_write python_packages "$hash"
+}
+
+sample_project_and_packages() {
+    # pip needs the project's requirements.txt, so these two run in order
+    step sample_project sample_project
+    step python_packages python_packages
+}
+
+ownership() {
+    # Set proper permissions, touching only files that are not already ours
+    # instead of walking the whole home directory with chown -R
+    local user
+    user=$(id -un sandbox 2>/dev/null) || return $SKIPPED
+    local stray
+    stray=$(find "$SANDBOX_HOME" -xdev \( \! -user "$user" -o \! -group "$user" \) -print -quit 2>/dev/null)
+    [ -z "$stray" ] && return $SKIPPED
+    find "$SANDBOX_HOME" -xdev \( \! -user "$user" -o \! -group "$user" \) -print0 2>/dev/null \
+        | xargs -0r chown -h "$user:$user"
+}
 
-# Set proper permissions
-chown -R sandbox:sandbox /home/sandbox/
+# Independent steps run in parallel; ownership is fixed once they are done
+init_start=$(now)
+step git_config git_config &
+step aliases aliases &
+step jupyter_config jupyter_config &
+sample_project_and_packages &
+wait
+step ownership ownership
+printf '{"phase": "init", "start": %s, "end": %s, "skipped": false, "status": 0}\n' "$init_start" "$(now)" >> "$TIMELINE"
 
 # Display welcome message
 echo ""
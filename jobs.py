@@ -0,0 +1,238 @@
+"""
+Background job manager
+Runs long-lived commands with drained pipes, spooled logs and job IDs.
+Job records live in the shared store so every server worker can list, tail
+and kill them; the process handles stay with the worker that started them.
+"""
+
+import asyncio
+import os
+import signal
+import time
+import uuid
+from pathlib import Path
+
+from executor import kill_process_group
+import limits
+import store
+
+# Where job output is spooled
+JOBS_DIR = Path(os.environ.get("SANDBOX_JOBS_DIR", "/home/sandbox/.jobs"))
+
+# Each log file is rotated once it reaches this size, so a job keeps at
+# most twice this much output on disk
+JOB_LOG_MAX_BYTES = int(os.environ.get("SANDBOX_JOB_LOG_MAX_BYTES", str(4 * 1024 * 1024)))
+
+# Finished jobs kept around for inspection before being pruned
+MAX_FINISHED_JOBS = int(os.environ.get("SANDBOX_MAX_FINISHED_JOBS", "100"))
+
+# Seconds between SIGTERM and SIGKILL when stopping a job
+KILL_GRACE_SECONDS = 5.0
+
+READ_CHUNK_SIZE = 65536
+
+# Jobs started by this worker, with their process handles, tracked by id
+services = {}
+
+# How often a worker waits on a job another worker owns
+REMOTE_POLL_SECONDS = 0.1
+
+def job_info(job):
+    """Public view of a job record"""
+    return {
+        'job_id': job['job_id'],
+        'name': job['name'],
+        'command': job['command'],
+        'user': job['user'],
+        'status': job['status'],
+        'pid': job['pid'],
+        'returncode': job['returncode'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+        'output_bytes': job['output_bytes']
+    }
+
+def list_jobs():
+    """Return all known jobs, newest first"""
+    return [job_info(services.get(job['job_id'], job)) for job in store.list_jobs()]
+
+def get_job(job_id):
+    """Look up a job record by id, from this worker or the shared store"""
+    return services.get(job_id) or store.get_job(job_id)
+
+async def submit_job(command, name=None, cwd=None, env=None, user=None):
+    """Start a command in the background and return its job record"""
+    JOBS_DIR.mkdir(parents=True, exist_ok=True)
+    job_id = uuid.uuid4().hex[:12]
+    log_path = JOBS_DIR / f"{job_id}.log"
+
+    process = await asyncio.create_subprocess_shell(
+        command,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        cwd=cwd,
+        env=env,
+        start_new_session=True,
+        **limits.spawn_kwargs(job_id, user)
+    )
+
+    job = {
+        'job_id': job_id,
+        'name': name or command.split()[0],
+        'command': command,
+        'user': user,
+        'status': 'running',
+        'pid': process.pid,
+        'returncode': None,
+        'started_at': time.time(),
+        'finished_at': None,
+        'output_bytes': 0,
+        'log_path': log_path,
+        'log_base': 0,
+        'worker': os.getpid(),
+        'process': process
+    }
+    services[job_id] = job
+    store.put_job(job)
+    job['task'] = asyncio.create_task(_watch_job(job))
+    _prune_finished_jobs()
+    return job
+
+async def _watch_job(job):
+    """Drain a job's output into its log file and reap it on exit"""
+    process = job['process']
+    log_path = job['log_path']
+    log = open(log_path, 'ab')
+    try:
+        while True:
+            chunk = await process.stdout.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            log.write(chunk)
+            log.flush()
+            job['output_bytes'] += len(chunk)
+            if log.tell() >= JOB_LOG_MAX_BYTES:
+                log.close()
+                os.replace(log_path, _rotated_path(log_path))
+                log = open(log_path, 'ab')
+                job['log_base'] = job['output_bytes']
+                store.update_job(job['job_id'], log_base=job['log_base'], output_bytes=job['output_bytes'])
+        job['returncode'] = await process.wait()
+    finally:
+        log.close()
+        if job['returncode'] is None:
+            kill_process_group(process)
+            job['returncode'] = await process.wait()
+        # Another worker may have killed it through the store
+        stored = store.get_job(job['job_id'])
+        if stored and stored['status'] == 'killed':
+            job['status'] = 'killed'
+        if job['status'] != 'killed':
+            job['status'] = 'finished' if job['returncode'] == 0 else 'failed'
+        job['finished_at'] = time.time()
+        job['process'] = None
+        store.update_job(job['job_id'], status=job['status'], returncode=job['returncode'],
+                         finished_at=job['finished_at'], output_bytes=job['output_bytes'])
+        limits.release(job['job_id'], job['user'])
+
+def _rotated_path(log_path):
+    return log_path.with_name(log_path.name + ".1")
+
+def read_job_output(job, since=None, limit=READ_CHUNK_SIZE):
+    """Read spooled job output
+
+    Returns up to `limit` bytes starting at absolute output offset `since`,
+    or the last `limit` bytes when `since` is not given.
+    """
+    # Offsets come from the files themselves, so any worker can tail any job:
+    # the current log starts at log_base and the rotated one ends there
+    segments, sizes = [], []
+    for path in (_rotated_path(job['log_path']), job['log_path']):
+        try:
+            sizes.append(path.stat().st_size)
+            segments.append(path)
+        except FileNotFoundError:
+            pass
+    end = job['log_base'] + (sizes[-1] if segments and segments[-1] == job['log_path'] else 0)
+    start = end - sum(sizes)
+    if since is None:
+        since = max(0, end - limit)
+    truncated = since < start
+    since = max(since, start)
+
+    data = b''
+    offset = start
+    for path, size in zip(segments, sizes):
+        if since < offset + size and len(data) < limit:
+            with open(path, 'rb') as f:
+                f.seek(since - offset if since > offset else 0)
+                data += f.read(min(size, limit - len(data)))
+        offset += size
+
+    return {
+        'job_id': job['job_id'],
+        'offset': since,
+        'next_offset': since + len(data),
+        'truncated': truncated,
+        'output': data.decode(errors='replace')
+    }
+
+async def kill_job(job_id):
+    """Stop a running job, escalating to SIGKILL after a grace period"""
+    job = services.get(job_id)
+    if job is None:
+        return await _kill_remote_job(job_id)
+    if job['process'] is None:
+        return job
+    job['status'] = 'killed'
+    kill_process_group(job['process'], signal.SIGTERM)
+    try:
+        await asyncio.wait_for(asyncio.shield(job['task']), KILL_GRACE_SECONDS)
+    except asyncio.TimeoutError:
+        if job['process'] is not None:
+            kill_process_group(job['process'])
+        await job['task']
+    return job
+
+async def _wait_remote_job(job_id, timeout):
+    """Wait for the owning worker to record that a job finished"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = store.get_job(job_id)
+        if job is None or job['finished_at'] is not None:
+            return job
+        await asyncio.sleep(REMOTE_POLL_SECONDS)
+    return store.get_job(job_id)
+
+async def _kill_remote_job(job_id):
+    """Kill a job started by another worker by signalling its process group"""
+    job = store.get_job(job_id)
+    if job is None or job['finished_at'] is not None:
+        return job
+    store.update_job(job_id, status='killed')
+    try:
+        os.killpg(job['pid'], signal.SIGTERM)
+        job = await _wait_remote_job(job_id, KILL_GRACE_SECONDS)
+        if job is not None and job['finished_at'] is None:
+            os.killpg(job['pid'], signal.SIGKILL)
+            job = await _wait_remote_job(job_id, KILL_GRACE_SECONDS)
+    except ProcessLookupError:
+        job = store.get_job(job_id)
+    return job
+
+async def shutdown_jobs():
+    """Kill every running job, used when the server stops"""
+    running = [job_id for job_id, job in services.items() if job['process'] is not None]
+    await asyncio.gather(*(kill_job(job_id) for job_id in running))
+
+def _prune_finished_jobs():
+    """Forget the oldest finished jobs beyond MAX_FINISHED_JOBS"""
+    for job in store.finished_jobs_beyond(MAX_FINISHED_JOBS):
+        store.delete_job(job['job_id'])
+        services.pop(job['job_id'], None)
+        for path in (job['log_path'], _rotated_path(job['log_path'])):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
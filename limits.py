@@ -0,0 +1,175 @@
+"""
+Resource limits for spawned commands
+Derives per-command caps from sandbox.yml `resources` and applies them through
+a cgroup v2 subtree when one is delegated to us, falling back to setrlimit
+"""
+
+import functools
+import hashlib
+import os
+import re
+import resource
+from pathlib import Path
+
+from metrics import parse_bytes, parse_cpu, own_cgroup
+
+# Share of the sandbox memory/CPU that user commands may use in total; the
+# rest is kept for the server so a runaway command cannot take down port 8000
+COMMANDS_SHARE = float(os.environ.get("SANDBOX_COMMANDS_SHARE", "0.75"))
+
+# Share of the sandbox memory a single command may use
+COMMAND_MEMORY_SHARE = float(os.environ.get("SANDBOX_COMMAND_MEMORY_SHARE", "0.5"))
+
+# Process cap for a single command tree
+COMMAND_MAX_PIDS = int(os.environ.get("SANDBOX_COMMAND_MAX_PIDS", "256"))
+
+# Children are made nicer and more attractive to the OOM killer than the server
+COMMAND_NICE = 5
+COMMAND_OOM_SCORE_ADJ = 500
+
+CONTROLLERS = ('cpu', 'memory', 'pids')
+
+# Effective per-command limits, filled in by configure()
+command_limits = {'memory_bytes': None, 'file_size_bytes': None, 'pids': COMMAND_MAX_PIDS}
+
+# cgroup v2 directories, or None when cgroups cannot be used
+cgroups = {'root': None, 'commands': None, 'controls': ''}
+
+def configure(config):
+    """Derive command limits from a parsed sandbox.yml and set up cgroups"""
+    resources = (config or {}).get('resources') or {}
+    memory = parse_bytes(resources.get('memory'))
+    storage = parse_bytes(resources.get('storage'))
+    cpu = parse_cpu(resources.get('cpu'))
+
+    command_limits['memory_bytes'] = int(memory * COMMAND_MEMORY_SHARE) if memory else None
+    command_limits['file_size_bytes'] = storage
+    setup_cgroups(memory, cpu)
+
+def _write(path, value):
+    try:
+        with open(path, 'w') as f:
+            f.write(str(value))
+        return True
+    except OSError:
+        return False
+
+def setup_cgroups(memory, cpu):
+    """Create a delegated cgroup v2 subtree for commands, if permitted
+
+    Layout under the server's own cgroup:
+        server/             the sandbox server itself
+        commands/           capped at COMMANDS_SHARE of the sandbox
+            <user>/         equal cpu.weight per user (fair share)
+                <id>/       one command or job
+    """
+    root = os.environ.get("SANDBOX_CGROUP")
+    root = Path(root) if root else own_cgroup()
+    if root is None or not os.access(root / "cgroup.procs", os.W_OK):
+        return False
+
+    try:
+        # cgroup v2 forbids processes in inner nodes, so move ourselves to a leaf
+        (root / "server").mkdir(exist_ok=True)
+        for pid in (root / "cgroup.procs").read_text().split():
+            _write(root / "server" / "cgroup.procs", pid)
+        (root / "commands").mkdir(exist_ok=True)
+    except OSError as e:
+        print(f"⚠️ cgroup setup failed, falling back to rlimits: {e}")
+        return False
+
+    enabled = set((root / "cgroup.controllers").read_text().split()) & set(CONTROLLERS)
+    controls = ' '.join('+' + name for name in sorted(enabled))
+    _write(root / "cgroup.subtree_control", controls)
+    _write(root / "commands" / "cgroup.subtree_control", controls)
+
+    if memory:
+        _write(root / "commands" / "memory.max", int(memory * COMMANDS_SHARE))
+    if cpu:
+        period = 100000
+        _write(root / "commands" / "cpu.max", f"{int(cpu * COMMANDS_SHARE * period)} {period}")
+
+    cgroups['root'] = root
+    cgroups['commands'] = root / "commands"
+    cgroups['controls'] = controls
+    print(f"✅ Command cgroups enabled under {root}")
+    return True
+
+def _user_slug(user):
+    user = user or 'anonymous'
+    if re.fullmatch(r'[A-Za-z0-9_.-]{1,64}', user) and user not in ('.', '..'):
+        return user
+    return 'u-' + hashlib.sha1(user.encode()).hexdigest()[:16]
+
+def _command_cgroup(owner_id, user):
+    """Create the leaf cgroup for one command"""
+    user_dir = cgroups['commands'] / _user_slug(user)
+    if not user_dir.exists():
+        user_dir.mkdir(exist_ok=True)
+        _write(user_dir / "cgroup.subtree_control", cgroups['controls'])
+    leaf = user_dir / owner_id
+    leaf.mkdir(exist_ok=True)
+    if command_limits['memory_bytes']:
+        _write(leaf / "memory.max", command_limits['memory_bytes'])
+        _write(leaf / "memory.swap.max", 0)
+    _write(leaf / "pids.max", command_limits['pids'])
+    return leaf
+
+def _cap_rlimit(limit, value):
+    """Lower an rlimit, never above the existing hard limit"""
+    _, hard = resource.getrlimit(limit)
+    if hard != resource.RLIM_INFINITY:
+        value = min(value, hard)
+    resource.setrlimit(limit, (value, value))
+
+def apply_limits(procs_path, memory, file_size):
+    """Apply the limits to the calling process
+
+    Runs in the child between fork and exec, so it sticks to raw syscalls.
+    """
+    if procs_path:
+        fd = os.open(procs_path, os.O_WRONLY)
+        try:
+            os.write(fd, str(os.getpid()).encode())
+        finally:
+            os.close(fd)
+    elif memory:
+        # RLIMIT_DATA rather than RLIMIT_AS, so runtimes that reserve large
+        # address ranges up front (node, JVMs) still start
+        _cap_rlimit(resource.RLIMIT_DATA, memory)
+    if file_size:
+        _cap_rlimit(resource.RLIMIT_FSIZE, file_size)
+    _cap_rlimit(resource.RLIMIT_CORE, 0)
+    os.nice(COMMAND_NICE)
+    try:
+        fd = os.open("/proc/self/oom_score_adj", os.O_WRONLY)
+        try:
+            os.write(fd, str(COMMAND_OOM_SCORE_ADJ).encode())
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+def limit_args(owner_id, user=None):
+    """Arguments for apply_limits(), creating the command's cgroup if enabled"""
+    leaf = None
+    if cgroups['commands'] is not None:
+        try:
+            leaf = _command_cgroup(owner_id, user)
+        except OSError:
+            leaf = None
+    procs_path = str(leaf / "cgroup.procs") if leaf else None
+    return procs_path, command_limits['memory_bytes'], command_limits['file_size_bytes']
+
+def spawn_kwargs(owner_id, user=None):
+    """Keyword arguments for asyncio.create_subprocess_* that apply the limits"""
+    return {'preexec_fn': functools.partial(apply_limits, *limit_args(owner_id, user))}
+
+def release(owner_id, user=None):
+    """Remove a command's cgroup once its processes are gone"""
+    if cgroups['commands'] is None:
+        return
+    try:
+        (cgroups['commands'] / _user_slug(user) / owner_id).rmdir()
+    except OSError:
+        pass
@@ -0,0 +1,309 @@
+"""
+Resource metrics
+Samples /proc and cgroup v2 files (no subprocesses) into a fixed-size ring
+buffer and accounts CPU, RSS and I/O to the commands and jobs that own them
+"""
+
+import asyncio
+import os
+import re
+import time
+from collections import deque
+from pathlib import Path
+
+# Sampling interval and how many samples the ring buffer keeps
+SAMPLE_INTERVAL = float(os.environ.get("SANDBOX_METRICS_INTERVAL", "2"))
+HISTORY_SIZE = int(os.environ.get("SANDBOX_METRICS_HISTORY", "300"))
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+PROC = Path("/proc")
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+# Rolling time series of system samples
+history = deque(maxlen=HISTORY_SIZE)
+
+# Most recent per-owner accounting, keyed by (kind, id)
+owners = {}
+
+# Limits advertised by sandbox.yml `resources`
+limits = {'cpu': None, 'memory_bytes': None, 'storage_bytes': None}
+
+_UNITS = {
+    '': 1, 'k': 1000, 'm': 1000 ** 2, 'g': 1000 ** 3, 't': 1000 ** 4,
+    'ki': 1024, 'mi': 1024 ** 2, 'gi': 1024 ** 3, 'ti': 1024 ** 4
+}
+
+def parse_bytes(value):
+    """Parse a Kubernetes-style quantity such as '4Gi' or '512M'"""
+    if value is None:
+        return None
+    match = re.fullmatch(r'\s*([0-9.]+)\s*([kmgtKMGT]i?)?\s*[bB]?\s*', str(value))
+    if not match:
+        raise ValueError(f"Invalid size: {value}")
+    return int(float(match.group(1)) * _UNITS[(match.group(2) or '').lower()])
+
+def parse_cpu(value):
+    """Parse a CPU quantity such as '2' or '500m'"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    if value.endswith('m'):
+        return float(value[:-1]) / 1000
+    return float(value)
+
+def configure(config):
+    """Read resource limits from a parsed sandbox.yml"""
+    resources = (config or {}).get('resources') or {}
+    limits['cpu'] = parse_cpu(resources.get('cpu'))
+    limits['memory_bytes'] = parse_bytes(resources.get('memory'))
+    limits['storage_bytes'] = parse_bytes(resources.get('storage'))
+
+def _read(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except OSError:
+        return None
+
+def _read_keyed(path):
+    """Parse 'key value' lines into a dict of ints"""
+    content = _read(path)
+    values = {}
+    for line in (content or '').splitlines():
+        parts = line.replace(':', ' ').split()
+        if len(parts) >= 2 and parts[1].isdigit():
+            values[parts[0]] = int(parts[1])
+    return values
+
+def own_cgroup():
+    """Path of this process's cgroup v2 directory, if any"""
+    for line in (_read(PROC / "self" / "cgroup") or '').splitlines():
+        if line.startswith('0::'):
+            path = CGROUP_ROOT / line[3:].lstrip('/')
+            if (path / "cgroup.controllers").exists():
+                return path
+    return None
+
+def sample_cgroup(path=None):
+    """CPU, memory, pids and I/O counters of a cgroup v2 directory"""
+    path = path or own_cgroup()
+    if path is None:
+        return None
+    cpu = _read_keyed(path / "cpu.stat")
+    memory_max = (_read(path / "memory.max") or '').strip()
+    io_read = io_write = 0
+    for line in (_read(path / "io.stat") or '').splitlines():
+        for field in line.split()[1:]:
+            key, _, value = field.partition('=')
+            if key == 'rbytes':
+                io_read += int(value)
+            elif key == 'wbytes':
+                io_write += int(value)
+    pids = (_read(path / "pids.current") or '').strip()
+    memory = (_read(path / "memory.current") or '').strip()
+    return {
+        'cpu_usage_seconds': cpu.get('usage_usec', 0) / 1e6,
+        'cpu_throttled_seconds': cpu.get('throttled_usec', 0) / 1e6,
+        'memory_bytes': int(memory) if memory.isdigit() else None,
+        'memory_max_bytes': int(memory_max) if memory_max.isdigit() else None,
+        'pids': int(pids) if pids.isdigit() else None,
+        'io_read_bytes': io_read,
+        'io_write_bytes': io_write
+    }
+
+def _proc_stat(pid):
+    """(ppid, cpu ticks, rss bytes) for a pid, or None if it is gone"""
+    content = _read(PROC / str(pid) / "stat")
+    if not content:
+        return None
+    # The command name may contain spaces, fields start after the last ')'
+    fields = content[content.rfind(')') + 2:].split()
+    return int(fields[1]), int(fields[11]) + int(fields[12]), int(fields[21]) * PAGE_SIZE
+
+def _proc_io(pid):
+    values = _read_keyed(PROC / str(pid) / "io")
+    return values.get('read_bytes', 0), values.get('write_bytes', 0)
+
+def process_table():
+    """Map of pid -> (ppid, cpu ticks, rss bytes) for every visible process"""
+    table = {}
+    for entry in os.scandir(PROC):
+        if entry.name.isdigit():
+            stat = _proc_stat(entry.name)
+            if stat:
+                table[int(entry.name)] = stat
+    return table
+
+def children_map(table):
+    """Map of pid -> list of child pids"""
+    children = {}
+    for pid, (ppid, _, _) in table.items():
+        children.setdefault(ppid, []).append(pid)
+    return children
+
+def descendants(root, table, children):
+    """A pid plus every process below it in the tree"""
+    found = []
+    stack = [root]
+    while stack:
+        pid = stack.pop()
+        if pid in table:
+            found.append(pid)
+            stack.extend(children.get(pid, []))
+    return found
+
+def sample_system():
+    """System-wide CPU, memory, load and storage figures"""
+    cpu_line = (_read(PROC / "stat") or 'cpu').splitlines()[0].split()[1:]
+    ticks = [int(value) for value in cpu_line]
+    meminfo = _read_keyed(PROC / "meminfo")
+    load = (_read(PROC / "loadavg") or '0 0 0').split()[:3]
+    storage_path = os.environ.get("SANDBOX_HOME", "/home/sandbox")
+    try:
+        vfs = os.statvfs(storage_path if os.path.isdir(storage_path) else "/")
+        storage_used = (vfs.f_blocks - vfs.f_bfree) * vfs.f_frsize
+    except OSError:
+        storage_used = None
+    return {
+        'cpu_total_ticks': sum(ticks),
+        'cpu_idle_ticks': ticks[3] + ticks[4] if len(ticks) > 4 else 0,
+        'memory_total_bytes': meminfo.get('MemTotal', 0) * 1024,
+        'memory_available_bytes': meminfo.get('MemAvailable', 0) * 1024,
+        'load': [float(value) for value in load],
+        'storage_used_bytes': storage_used
+    }
+
+def sample(roots, previous=None):
+    """Take one sample; roots is a list of (kind, id, user, pid)"""
+    now = time.time()
+    system = sample_system()
+    table = process_table()
+    children = children_map(table)
+
+    accounted = {}
+    for kind, owner_id, user, pid in roots:
+        pids = descendants(pid, table, children)
+        read_bytes = write_bytes = 0
+        for child in pids:
+            child_read, child_write = _proc_io(child)
+            read_bytes += child_read
+            write_bytes += child_write
+        accounted[(kind, owner_id)] = {
+            'kind': kind,
+            'id': owner_id,
+            'user': user,
+            'pids': len(pids),
+            'cpu_seconds': sum(table[child][1] for child in pids) / CLOCK_TICKS,
+            'rss_bytes': sum(table[child][2] for child in pids),
+            'io_read_bytes': read_bytes,
+            'io_write_bytes': write_bytes,
+            'cpu_percent': 0.0
+        }
+
+    cpu_percent = None
+    if previous:
+        elapsed = now - previous['timestamp']
+        total = system['cpu_total_ticks'] - previous['system']['cpu_total_ticks']
+        idle = system['cpu_idle_ticks'] - previous['system']['cpu_idle_ticks']
+        if total > 0:
+            cpu_percent = round(100.0 * (total - idle) / total, 2)
+        for key, entry in accounted.items():
+            before = owners.get(key)
+            if before and elapsed > 0:
+                used = entry['cpu_seconds'] - before['cpu_seconds']
+                entry['cpu_percent'] = round(100.0 * max(0.0, used) / elapsed, 2)
+
+    return {
+        'timestamp': now,
+        'system': system,
+        'cpu_percent': cpu_percent,
+        'cgroup': sample_cgroup(),
+        'processes': len(table)
+    }, accounted
+
+def per_user(entries):
+    """Aggregate owner accounting by sandbox user"""
+    users = {}
+    for entry in entries:
+        totals = users.setdefault(entry['user'] or 'anonymous', {
+            'running': 0, 'cpu_percent': 0.0, 'rss_bytes': 0, 'io_read_bytes': 0, 'io_write_bytes': 0
+        })
+        totals['running'] += 1
+        totals['cpu_percent'] = round(totals['cpu_percent'] + entry['cpu_percent'], 2)
+        totals['rss_bytes'] += entry['rss_bytes']
+        totals['io_read_bytes'] += entry['io_read_bytes']
+        totals['io_write_bytes'] += entry['io_write_bytes']
+    return users
+
+async def collect(get_roots, on_sample=None):
+    """Sample forever; get_roots() returns the (kind, id, user, pid) list to account
+
+    on_sample(snapshot, owners) is called after each sample, e.g. to share it
+    with other server workers.
+    """
+    while True:
+        roots = get_roots()
+        previous = history[-1] if history else None
+        snapshot, accounted = await asyncio.to_thread(sample, roots, previous)
+        history.append(snapshot)
+        owners.clear()
+        owners.update(accounted)
+        if on_sample:
+            on_sample(snapshot, owners)
+        await asyncio.sleep(SAMPLE_INTERVAL)
+
+def _labels(**labels):
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+def prometheus():
+    """Render the latest sample in the Prometheus text exposition format"""
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        samples = [(labels, value) for labels, value in samples if value is not None]
+        if not samples:
+            return
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{_labels(**labels) if labels else ''} {value}")
+
+    latest = history[-1] if history else None
+    if latest:
+        system = latest['system']
+        metric('sandbox_cpu_percent', 'gauge', 'Host CPU utilisation', [({}, latest['cpu_percent'])])
+        metric('sandbox_memory_available_bytes', 'gauge', 'Available host memory', [({}, system['memory_available_bytes'])])
+        metric('sandbox_storage_used_bytes', 'gauge', 'Bytes used on the sandbox home filesystem', [({}, system['storage_used_bytes'])])
+        metric('sandbox_processes', 'gauge', 'Visible processes', [({}, latest['processes'])])
+        cgroup = latest['cgroup'] or {}
+        metric('sandbox_cgroup_cpu_seconds_total', 'counter', 'CPU time used by the sandbox cgroup', [({}, cgroup.get('cpu_usage_seconds'))])
+        metric('sandbox_cgroup_memory_bytes', 'gauge', 'Memory charged to the sandbox cgroup', [({}, cgroup.get('memory_bytes'))])
+        metric('sandbox_cgroup_io_read_bytes_total', 'counter', 'Bytes read by the sandbox cgroup', [({}, cgroup.get('io_read_bytes'))])
+        metric('sandbox_cgroup_io_write_bytes_total', 'counter', 'Bytes written by the sandbox cgroup', [({}, cgroup.get('io_write_bytes'))])
+
+    metric('sandbox_limit_cpu', 'gauge', 'CPU limit from sandbox.yml', [({}, limits['cpu'])])
+    metric('sandbox_limit_memory_bytes', 'gauge', 'Memory limit from sandbox.yml', [({}, limits['memory_bytes'])])
+    metric('sandbox_limit_storage_bytes', 'gauge', 'Storage limit from sandbox.yml', [({}, limits['storage_bytes'])])
+
+    entries = list(owners.values())
+    def owner_labels(entry):
+        return {'kind': entry['kind'], 'id': entry['id'], 'user': entry['user'] or 'anonymous'}
+    metric('sandbox_owner_cpu_seconds_total', 'counter', 'CPU time of a command or job and its children',
+           [(owner_labels(e), e['cpu_seconds']) for e in entries])
+    metric('sandbox_owner_cpu_percent', 'gauge', 'CPU utilisation of a command or job and its children',
+           [(owner_labels(e), e['cpu_percent']) for e in entries])
+    metric('sandbox_owner_rss_bytes', 'gauge', 'Resident memory of a command or job and its children',
+           [(owner_labels(e), e['rss_bytes']) for e in entries])
+    metric('sandbox_owner_io_read_bytes_total', 'counter', 'Bytes read from storage by a command or job',
+           [(owner_labels(e), e['io_read_bytes']) for e in entries])
+    metric('sandbox_owner_io_write_bytes_total', 'counter', 'Bytes written to storage by a command or job',
+           [(owner_labels(e), e['io_write_bytes']) for e in entries])
+    metric('sandbox_user_rss_bytes', 'gauge', 'Resident memory of everything a sandbox user is running',
+           [({'user': user}, totals['rss_bytes']) for user, totals in per_user(entries).items()])
+
+    return '\n'.join(lines) + '\n'
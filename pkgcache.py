@@ -0,0 +1,504 @@
+"""
+Shared package cache
+Content-addressed store of Python wheels/sdists and npm tarballs, served as a
+PEP 503 simple index and an npm registry so every sandbox user (and every
+container sharing the cache directory) downloads and builds a package once.
+Upstream indexes are used when reachable; otherwise only what is in the store
+or the pre-seeded directory is offered, so installs also work offline.
+"""
+
+import asyncio
+import base64
+import fcntl
+import hashlib
+import html
+import json
+import os
+import re
+import shlex
+import shutil
+import tarfile
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from html.parser import HTMLParser
+from pathlib import Path
+from urllib.parse import quote, urljoin, urlparse
+
+SANDBOX_HOME = Path(os.environ.get("SANDBOX_HOME", "/home/sandbox"))
+
+# Mount the same directory into several containers to share one cache
+CACHE_DIR = Path(os.environ.get("SANDBOX_PKG_CACHE", str(SANDBOX_HOME / ".pkgcache")))
+
+# Wheels, sdists and npm tarballs imported into the store at startup
+SEED_DIR = Path(os.environ.get("SANDBOX_PKG_SEED", "/opt/sandbox-packages"))
+
+# Never contact the upstream indexes
+OFFLINE = os.environ.get("SANDBOX_PKG_OFFLINE", "0") == "1"
+
+PYPI_UPSTREAM = os.environ.get("SANDBOX_PYPI_UPSTREAM", "https://pypi.org/simple").rstrip('/')
+NPM_UPSTREAM = os.environ.get("SANDBOX_NPM_UPSTREAM", "https://registry.npmjs.org").rstrip('/')
+
+# Upstream listings are reused for this long before being fetched again
+INDEX_TTL = float(os.environ.get("SANDBOX_PKG_INDEX_TTL", "600"))
+
+FETCH_TIMEOUT = 30.0
+COPY_CHUNK_SIZE = 1024 * 1024
+
+PYTHON_SUFFIXES = ('.whl', '.tar.gz', '.zip')
+
+# Port of this server, for the index URLs handed to pip and npm
+server = {'port': 8000}
+
+# In-flight fetches and builds by key; later callers wait on the first one
+inflight = {}
+
+# After a failed upstream request, cached listings are used without retrying
+# until this time
+UPSTREAM_RETRY_SECONDS = 60.0
+upstream_down_until = {'pypi': 0.0, 'npm': 0.0}
+
+def configure(port):
+    server['port'] = port
+
+def pypi_index_url():
+    return f"http://127.0.0.1:{server['port']}/pkg/pypi/simple/"
+
+def npm_registry_url():
+    return f"http://127.0.0.1:{server['port']}/pkg/npm/"
+
+def normalize(name):
+    """PEP 503 project name"""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+def python_project(filename):
+    """Project a wheel or sdist file belongs to, from its name"""
+    if filename.endswith('.whl'):
+        return normalize(filename.split('-')[0])
+    for suffix in PYTHON_SUFFIXES[1:]:
+        if filename.endswith(suffix):
+            return normalize(filename[:-len(suffix)].rsplit('-', 1)[0])
+    return None
+
+def single_flight(key, factory):
+    """Run factory() once per key at a time; concurrent callers share the result"""
+    task = inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(factory())
+        inflight[key] = task
+        task.add_done_callback(lambda _: inflight.pop(key, None))
+    return asyncio.shield(task)
+
+# Blob store
+
+def blob_path(sha256):
+    return CACHE_DIR / "blobs" / sha256[:2] / sha256
+
+def has_blob(sha256):
+    return bool(sha256) and blob_path(sha256).exists()
+
+def _staging_dir():
+    path = CACHE_DIR / "tmp"
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+def _digests(path):
+    hashes = {name: hashlib.new(name) for name in ('sha256', 'sha1', 'sha512')}
+    with open(path, 'rb') as f:
+        while chunk := f.read(COPY_CHUNK_SIZE):
+            for h in hashes.values():
+                h.update(chunk)
+    return {
+        'sha256': hashes['sha256'].hexdigest(),
+        'sha1': hashes['sha1'].hexdigest(),
+        'integrity': 'sha512-' + base64.b64encode(hashes['sha512'].digest()).decode()
+    }
+
+def _store(path, digests, move=False):
+    """Put a file into the blob store under its sha256"""
+    target = blob_path(digests['sha256'])
+    if target.exists():
+        if move:
+            os.unlink(path)
+        return target
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if move:
+        os.replace(path, target)
+    else:
+        tmp = _staging_dir() / f"{digests['sha256']}.{os.getpid()}"
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, target)
+    return target
+
+def _download(url, expected):
+    """Fetch url into the store, checking the digests in `expected`
+
+    A lock file per url keeps workers and containers sharing the cache from
+    downloading the same file at the same time.
+    """
+    sha256 = expected.get('sha256')
+    lock_name = hashlib.sha256(url.encode()).hexdigest()
+    with open(_staging_dir() / f"{lock_name}.lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if has_blob(sha256):
+            return _digests(blob_path(sha256))
+        fd, tmp = tempfile.mkstemp(dir=_staging_dir())
+        try:
+            with os.fdopen(fd, 'wb') as out, urllib.request.urlopen(url, timeout=FETCH_TIMEOUT) as response:
+                shutil.copyfileobj(response, out, COPY_CHUNK_SIZE)
+            digests = _digests(tmp)
+            for name, value in expected.items():
+                if value and digests[name] != value:
+                    raise ValueError(f"{name} mismatch for {url}")
+            _store(tmp, digests, move=True)
+            return digests
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+def _fetch_json(url, accept='application/json'):
+    request = urllib.request.Request(url, headers={'Accept': accept})
+    with urllib.request.urlopen(request, timeout=FETCH_TIMEOUT) as response:
+        if 'html' in response.headers.get('Content-Type', ''):
+            return _parse_simple_page(response.read().decode(errors='replace'), response.geturl())
+        return json.load(response)
+
+class _SimpleLinks(HTMLParser):
+    """Anchors of a PEP 503 page as PEP 691 file entries"""
+
+    def __init__(self, base_url):
+        super().__init__()
+        self.base_url = base_url
+        self.files = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag != 'a':
+            return
+        attrs = dict(attrs)
+        url, _, fragment = urljoin(self.base_url, attrs.get('href', '')).partition('#')
+        algorithm, _, digest = fragment.partition('=')
+        self.files.append({
+            'filename': os.path.basename(urlparse(url).path),
+            'url': url,
+            'hashes': {algorithm: digest} if digest else {},
+            'requires-python': attrs.get('data-requires-python'),
+            'yanked': 'data-yanked' in attrs
+        })
+
+def _parse_simple_page(text, base_url):
+    """Upstreams that only speak HTML still get the JSON shape used here"""
+    parser = _SimpleLinks(base_url)
+    parser.feed(text)
+    return {'files': parser.files}
+
+# Per-package indexes
+
+def _index_path(kind, name):
+    return CACHE_DIR / kind / (quote(name, safe='@') + '.json')
+
+def load_index(kind, name):
+    try:
+        return json.loads(_index_path(kind, name).read_text())
+    except (OSError, ValueError):
+        return {}
+
+def update_index(kind, name, change):
+    """Read-modify-write an index under a file lock shared with other processes"""
+    path = _index_path(kind, name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(str(path) + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        index = load_index(kind, name)
+        change(index)
+        tmp = path.with_name(path.name + f'.{os.getpid()}.tmp')
+        tmp.write_text(json.dumps(index))
+        os.replace(tmp, path)
+    return index
+
+def _stale(kind, index):
+    if OFFLINE or time.time() < upstream_down_until[kind]:
+        return False
+    return time.time() - index.get('fetched_at', 0) > INDEX_TTL
+
+async def _refresh(kind, name, url, accept, merge):
+    """Fetch an upstream listing into the index; keep the cached one if unreachable"""
+    async def fetch():
+        try:
+            listing = await asyncio.to_thread(_fetch_json, url, accept)
+        except urllib.error.HTTPError as e:
+            if e.code != 404:
+                return load_index(kind, name)
+            # Not published upstream; remember that for INDEX_TTL
+            listing = {}
+        except (OSError, ValueError):
+            upstream_down_until[kind] = time.time() + UPSTREAM_RETRY_SECONDS
+            return load_index(kind, name)
+        return await asyncio.to_thread(update_index, kind, name, lambda index: merge(index, listing))
+    return await single_flight((kind, 'index', name), fetch)
+
+# Python packages
+
+def add_python_file(path, move=False):
+    """Import a wheel or sdist into the store and its project's index"""
+    filename = Path(path).name
+    project = python_project(filename)
+    if project is None:
+        return None
+    digests = _digests(path)
+    _store(path, digests, move=move)
+
+    def add(index):
+        entry = index.setdefault('files', {}).setdefault(filename, {})
+        entry['sha256'] = digests['sha256']
+    update_index('pypi', project, add)
+    return filename
+
+def _merge_pypi(index, listing):
+    files = index.setdefault('files', {})
+    for item in listing.get('files', []):
+        entry = files.setdefault(item['filename'], {})
+        entry.setdefault('sha256', item.get('hashes', {}).get('sha256'))
+        entry['url'] = item['url']
+        entry['requires_python'] = item.get('requires-python')
+        entry['yanked'] = item.get('yanked', False)
+    index['fetched_at'] = time.time()
+
+async def python_files(project):
+    """Files known for a project: stored ones, plus upstream ones when online"""
+    project = normalize(project)
+    index = load_index('pypi', project)
+    if _stale('pypi', index):
+        index = await _refresh('pypi', project, f"{PYPI_UPSTREAM}/{project}/",
+                               'application/vnd.pypi.simple.v1+json, text/html;q=0.1', _merge_pypi)
+    files = index.get('files', {})
+    if OFFLINE:
+        return {name: entry for name, entry in files.items() if has_blob(entry.get('sha256'))}
+    return {name: entry for name, entry in files.items() if has_blob(entry.get('sha256')) or entry.get('url')}
+
+def python_projects():
+    directory = CACHE_DIR / "pypi"
+    if not directory.is_dir():
+        return []
+    return sorted(path.name[:-len('.json')] for path in directory.glob('*.json'))
+
+def simple_root_page():
+    links = ''.join(f'<a href="{quote(name)}/">{html.escape(name)}</a>\n' for name in python_projects())
+    return f"<!DOCTYPE html>\n<html><body>\n{links}</body></html>\n"
+
+def simple_project_page(project, files):
+    """PEP 503 page linking to /pkg/pypi/files, with hashes for pip to check"""
+    links = []
+    for filename, entry in sorted(files.items()):
+        href = f"/pkg/pypi/files/{quote(project)}/{quote(filename)}"
+        if entry.get('sha256'):
+            href += f"#sha256={entry['sha256']}"
+        attributes = ''
+        if entry.get('requires_python'):
+            attributes += f' data-requires-python="{html.escape(entry["requires_python"])}"'
+        if entry.get('yanked'):
+            attributes += ' data-yanked=""'
+        links.append(f'<a href="{href}"{attributes}>{html.escape(filename)}</a><br/>\n')
+    return f"<!DOCTYPE html>\n<html><body>\n<h1>Links for {html.escape(project)}</h1>\n{''.join(links)}</body></html>\n"
+
+async def python_file(project, filename):
+    """Path of a stored file, fetching it from upstream on first use"""
+    project = normalize(project)
+    entry = load_index('pypi', project).get('files', {}).get(filename)
+    if entry is None:
+        entry = (await python_files(project)).get(filename)
+    if entry is None:
+        return None
+    if has_blob(entry.get('sha256')):
+        return blob_path(entry['sha256'])
+    if OFFLINE or not entry.get('url'):
+        return None
+
+    async def fetch():
+        digests = await asyncio.to_thread(_download, entry['url'], {'sha256': entry.get('sha256')})
+        def record(index):
+            index.setdefault('files', {}).setdefault(filename, {})['sha256'] = digests['sha256']
+        await asyncio.to_thread(update_index, 'pypi', project, record)
+        return blob_path(digests['sha256'])
+    return await single_flight(('pypi', 'file', entry['url']), fetch)
+
+def parse_requirements(spec):
+    """Split an install spec into requirement arguments, refusing pip options"""
+    tokens = shlex.split(spec or '')
+    if not tokens or any(token.startswith('-') for token in tokens):
+        raise ValueError('Expected one or more requirements, without options')
+    return tokens
+
+async def build_wheels(spec):
+    """Download or build wheels for a spec and its dependencies into the store
+
+    Concurrent requests for the same spec share one build.
+    """
+    requirements = parse_requirements(spec)
+
+    async def build():
+        staging = tempfile.mkdtemp(dir=_staging_dir())
+        try:
+            process = await asyncio.create_subprocess_exec(
+                'pip3', 'wheel', '--disable-pip-version-check', '--index-url', pypi_index_url(),
+                '--wheel-dir', staging, *requirements,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT
+            )
+            output, _ = await process.communicate()
+            wheels = [
+                await asyncio.to_thread(add_python_file, os.path.join(staging, name), True)
+                for name in sorted(os.listdir(staging))
+            ]
+            return {
+                'returncode': process.returncode,
+                'wheels': [name for name in wheels if name],
+                'output': output.decode(errors='replace')[-4000:]
+            }
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+    return await single_flight(('wheel', ' '.join(requirements)), build)
+
+def pip_install_command(spec):
+    """Install command that resolves against this cache"""
+    return f"pip3 install --index-url {pypi_index_url()} {shlex.join(parse_requirements(spec))}"
+
+# npm packages
+
+def _tarball_name(name, version):
+    return f"{name.split('/')[-1]}-{version}.tgz"
+
+def add_npm_tarball(path):
+    """Import an npm tarball (as written by `npm pack`) into the store"""
+    with tarfile.open(path, 'r:gz') as archive:
+        member = next((m for m in archive.getmembers() if m.name.split('/', 1)[-1] == 'package.json'), None)
+        if member is None:
+            return None
+        manifest = json.load(archive.extractfile(member))
+    name, version = manifest.get('name'), manifest.get('version')
+    if not name or not version:
+        return None
+    digests = _digests(path)
+    _store(path, digests)
+    filename = _tarball_name(name, version)
+
+    def add(index):
+        index.setdefault('tarballs', {})[filename] = digests['sha256']
+        index.setdefault('local', {})[version] = dict(
+            manifest,
+            dist={'tarball': filename, 'shasum': digests['sha1'], 'integrity': digests['integrity']}
+        )
+    update_index('npm', name, add)
+    return filename
+
+def _merge_npm(index, listing):
+    index['packument'] = listing or None
+    index['fetched_at'] = time.time()
+
+def _version_key(version):
+    release, _, prerelease = version.partition('-')
+    numbers = [int(part) if part.isdigit() else 0 for part in release.split('.')]
+    return numbers, prerelease == '', prerelease
+
+def _upstream_versions(index):
+    return (index.get('packument') or {}).get('versions', {})
+
+async def npm_packument(name, base_url):
+    """Registry document for a package, with tarballs pointing at this cache"""
+    index = load_index('npm', name)
+    if _stale('npm', index):
+        index = await _refresh('npm', name, f"{NPM_UPSTREAM}/{quote(name, safe='@')}",
+                               'application/json', _merge_npm)
+    cached = index.get('tarballs', {})
+    versions = {}
+    for version, manifest in {**_upstream_versions(index), **index.get('local', {})}.items():
+        dist = dict(manifest.get('dist', {}))
+        filename = os.path.basename(urlparse(dist.get('tarball', '')).path)
+        # Offline, only versions npm can actually download are offered
+        if (OFFLINE or not index.get('packument')) and not has_blob(cached.get(filename)):
+            continue
+        dist['tarball'] = f"{base_url}/pkg/npm/{name}/-/{filename}"
+        versions[version] = dict(manifest, dist=dist)
+    if not versions:
+        return None
+
+    tags = dict((index.get('packument') or {}).get('dist-tags', {}))
+    if tags.get('latest') not in versions:
+        tags['latest'] = max(versions, key=_version_key)
+    return {'name': name, 'dist-tags': tags, 'versions': versions}
+
+async def npm_tarball(name, filename):
+    """Path of a stored tarball, fetching it from upstream on first use"""
+    index = load_index('npm', name)
+    sha256 = index.get('tarballs', {}).get(filename)
+    if has_blob(sha256):
+        return blob_path(sha256)
+    if OFFLINE:
+        return None
+    dist = next((manifest.get('dist', {}) for manifest in _upstream_versions(index).values()
+                 if os.path.basename(urlparse(manifest.get('dist', {}).get('tarball', '')).path) == filename), None)
+    if dist is None:
+        return None
+
+    async def fetch():
+        digests = await asyncio.to_thread(_download, dist['tarball'], {
+            'sha1': dist.get('shasum'),
+            'integrity': dist.get('integrity') if str(dist.get('integrity', '')).startswith('sha512-') else None
+        })
+        def record(index):
+            index.setdefault('tarballs', {})[filename] = digests['sha256']
+        await asyncio.to_thread(update_index, 'npm', name, record)
+        return blob_path(digests['sha256'])
+    return await single_flight(('npm', 'file', dist['tarball']), fetch)
+
+# Seeding and stats
+
+def seed(directory=SEED_DIR):
+    """Import every package file under directory that is not in the store yet"""
+    if not Path(directory).is_dir():
+        return 0
+    seen_path = CACHE_DIR / "seeded.json"
+    try:
+        seen = json.loads(seen_path.read_text())
+    except (OSError, ValueError):
+        seen = {}
+    added = 0
+    for path in sorted(Path(directory).rglob('*')):
+        if not path.is_file():
+            continue
+        stat = path.stat()
+        signature = f"{stat.st_size}:{stat.st_mtime_ns}"
+        if seen.get(str(path)) == signature:
+            continue
+        try:
+            if path.name.endswith('.tgz'):
+                imported = add_npm_tarball(path)
+            elif path.name.endswith(PYTHON_SUFFIXES):
+                imported = add_python_file(path)
+            else:
+                continue
+        except (OSError, ValueError, tarfile.TarError) as e:
+            print(f"⚠️ Could not import {path} into the package cache: {e}")
+            continue
+        if imported:
+            added += 1
+        seen[str(path)] = signature
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    seen_path.write_text(json.dumps(seen))
+    return added
+
+def stats():
+    blobs = [path for path in (CACHE_DIR / "blobs").glob('*/*') if path.is_file()]
+    npm_dir = CACHE_DIR / "npm"
+    return {
+        'cache_dir': str(CACHE_DIR),
+        'seed_dir': str(SEED_DIR),
+        'offline': OFFLINE,
+        'blobs': len(blobs),
+        'bytes': sum(path.stat().st_size for path in blobs),
+        'python_projects': len(python_projects()),
+        'npm_packages': len(list(npm_dir.glob('*.json'))) if npm_dir.is_dir() else 0,
+        'inflight': len(inflight),
+        'pypi_index_url': pypi_index_url(),
+        'npm_registry_url': npm_registry_url()
+    }
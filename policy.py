@@ -0,0 +1,314 @@
+"""
+Command policy
+Allow/deny rules from sandbox.yml `security.commands`, matched against the
+shell words of every simple command in a command line (pipelines, `&&`
+chains, `$(...)` substitutions, `bash -c` strings, `find -exec` clauses and
+wrappers such as sudo, env or watch included) instead of raw substrings.
+
+A rule is written as shell words: the first is the program (a glob, matched
+against the basename), the rest must all appear among the arguments. An
+argument pattern may be a glob (`if=*`), and a short-flag cluster such as
+`-rf` matches any spelling of those flags (`-fr`, `-r -f`, `-vrf`, and the
+long forms `--recursive --force` of the programs in LONG_FLAGS).
+
+Commands whose program is only known at run time (`$cmd -rf /`) cannot be
+judged from the text and are left to the default.
+"""
+
+import fnmatch
+import functools
+import re
+import shlex
+from collections import namedtuple
+
+# Used when sandbox.yml has no security.commands section
+DEFAULT_RULES = {
+    'default': 'allow',
+    'deny': ['rm -rf', 'rm -Rf', 'sudo rm', 'mkfs*', 'dd if=*', 'shutdown', 'reboot', 'halt', 'poweroff',
+             'systemctl reboot', 'systemctl poweroff', 'systemctl halt', 'systemctl kexec', 'init 0', 'init 6'],
+    'allow': []
+}
+
+# Decisions remembered for repeated command lines
+CACHE_SIZE = 4096
+
+SEPARATORS = {';', '&', '&&', '|', '||', '|&', ';;', '(', ')', '\n'}
+REDIRECTIONS = {'<', '>', '>>', '<<', '<<<', '<>', '>&', '<&', '&>', '&>>', '>|'}
+
+# Words that may start a simple command without being its program
+RESERVED = {'{', '}', '!', 'if', 'then', 'else', 'elif', 'fi', 'do', 'done', 'while', 'until', 'time'}
+
+# Programs that run another command: options taking a value, and how many
+# positional words come before the wrapped command
+WRAPPERS = {
+    'sudo': ({'-u', '-g', '-C', '-h', '-p', '-U', '-r', '-t', '-D'}, 0),
+    'env': ({'-u', '-C', '-S'}, 0),
+    'nice': ({'-n'}, 0),
+    'ionice': ({'-c', '-n', '-p'}, 0),
+    'nohup': (set(), 0),
+    'setsid': (set(), 0),
+    'stdbuf': ({'-i', '-o', '-e'}, 0),
+    'command': (set(), 0),
+    'exec': ({'-a'}, 0),
+    'time': ({'-f', '-o'}, 0),
+    'timeout': ({'-s', '-k'}, 1),
+    'xargs': ({'-n', '-I', '-i', '-d', '-P', '-L', '-l', '-s', '-E', '-a'}, 0),
+    'chroot': (set(), 1),
+    'doas': ({'-u', '-C'}, 0),
+    'busybox': (set(), 0),
+    'toybox': (set(), 0),
+    'watch': ({'-n', '-d', '-q'}, 0),
+    'parallel': ({'-j', '-S', '-a', '-d', '-E', '-I', '-n', '-L', '--jobs', '--sshlogin', '--delimiter'}, 0),
+    'strace': ({'-e', '-o', '-p', '-s', '-u', '-E', '-a', '-b', '-I', '-O', '-P', '-S', '-X'}, 0),
+    'ltrace': ({'-e', '-o', '-p', '-s', '-u', '-a', '-n'}, 0),
+    'flock': ({'-w', '-E', '--timeout', '--conflict-exit-code'}, 1)
+}
+
+# Wrappers that hand the wrapped words to `sh -c` joined into one string
+SHELL_WRAPPERS = {'watch', 'parallel'}
+
+# find actions whose arguments, up to `;` or `+`, are a command it runs
+FIND_EXEC = {'-exec', '-execdir', '-ok', '-okdir'}
+
+# Programs whose -c argument is itself a command line, and their options
+# that take a value
+SHELLS = {'sh', 'bash', 'dash', 'zsh', 'ksh'}
+SHELL_VALUED = {'-o', '+o', '-O', '+O', '--rcfile', '--init-file'}
+
+# Long options and the short flags they stand for, so `rm --recursive --force`
+# matches a `rm -rf` rule. GNU tools accept any unambiguous prefix (`--rec`)
+LONG_FLAGS = {
+    'rm': {'recursive': 'rR', 'force': 'f', 'dir': 'd', 'interactive': 'i', 'verbose': 'v'},
+    'cp': {'recursive': 'rR', 'force': 'f', 'archive': 'a', 'link': 'l', 'verbose': 'v'},
+    'mv': {'force': 'f', 'verbose': 'v'},
+    'chmod': {'recursive': 'R', 'verbose': 'v'},
+    'chown': {'recursive': 'R', 'verbose': 'v'},
+    'chgrp': {'recursive': 'R', 'verbose': 'v'},
+    'shred': {'remove': 'u', 'force': 'f', 'zero': 'z', 'verbose': 'v'},
+    'git': {'force': 'f'}
+}
+
+SUBSTITUTION = re.compile(r"\$\(([^()]*)\)|`([^`]*)`")
+ASSIGNMENT = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*=")
+GLOB_CHARS = set('*?[')
+QUOTING = set('\'"\\')
+PLAIN_TOKEN = re.compile(r"[();<>|&\n]+|[^ \t\r();<>|&\n]+")
+
+Decision = namedtuple('Decision', 'allowed rule reason')
+
+class Rule:
+    """One compiled allow or deny rule"""
+
+    def __init__(self, text, action):
+        words = shlex.split(text)
+        if not words:
+            raise ValueError(f"Empty {action} rule")
+        self.text = text
+        self.action = action
+        self.program = words[0]
+        self.exact_args = set()
+        self.glob_args = []
+        self.flags = set()
+        for word in words[1:]:
+            if re.fullmatch(r"-[A-Za-z0-9]{2,}", word):
+                self.flags.update(word[1:])
+            elif re.fullmatch(r"-[A-Za-z0-9]", word):
+                self.flags.add(word[1])
+            elif GLOB_CHARS & set(word):
+                self.glob_args.append(re.compile(fnmatch.translate(word)))
+            else:
+                self.exact_args.add(word)
+
+    def matches(self, args, arg_set, flags):
+        if self.flags and not self.flags <= flags:
+            return False
+        if self.exact_args and not self.exact_args <= arg_set:
+            return False
+        return all(any(pattern.match(arg) for arg in args) for pattern in self.glob_args)
+
+class RuleSet:
+    """Rules of one action, indexed by program so lookup cost does not grow with the rule count"""
+
+    def __init__(self, rules):
+        self.by_program = {}
+        self.glob_rules = []
+        for rule in rules:
+            if GLOB_CHARS & set(rule.program):
+                self.glob_rules.append(rule)
+            else:
+                self.by_program.setdefault(rule.program, []).append(rule)
+        # One combined pattern tells whether any glob program can match at all
+        self.glob_any = re.compile('|'.join(f"(?:{fnmatch.translate(rule.program)})" for rule in self.glob_rules)) \
+            if self.glob_rules else None
+
+    def candidates(self, program):
+        rules = self.by_program.get(program, [])
+        if self.glob_any is not None and self.glob_any.match(program):
+            rules = rules + [rule for rule in self.glob_rules if fnmatch.fnmatchcase(program, rule.program)]
+        return rules
+
+    def match(self, program, args):
+        rules = self.candidates(program)
+        if not rules:
+            return None
+        arg_set = set(args)
+        flags = set()
+        long_flags = LONG_FLAGS.get(program, {})
+        for arg in args:
+            if arg == '--':
+                break
+            if len(arg) > 2 and arg.startswith('--'):
+                flags.update(_long_flag(long_flags, arg[2:].split('=', 1)[0]))
+            elif len(arg) > 1 and arg[0] == '-' and arg[1] != '-':
+                flags.update(arg[1:])
+        return next((rule for rule in rules if rule.matches(args, arg_set, flags)), None)
+
+def _long_flag(long_flags, name):
+    """Short flags for a long option name or an unambiguous prefix of one"""
+    if name in long_flags:
+        return long_flags[name]
+    matches = [flags for option, flags in long_flags.items() if option.startswith(name)]
+    return matches[0] if len(matches) == 1 else ''
+
+def _tokens(command):
+    # Without quotes or escapes, shell words are plain runs of characters
+    if not QUOTING & set(command):
+        return PLAIN_TOKEN.findall(command)
+    lexer = shlex.shlex(command, posix=True, punctuation_chars='();<>|&\n')
+    lexer.whitespace = ' \t\r'
+    lexer.whitespace_split = True
+    lexer.commenters = ''
+    return list(lexer)
+
+def simple_commands(command, depth=0):
+    """Yield (program, args) for every simple command a command line may run"""
+    if depth > 8:
+        raise ValueError("Command nests too deeply")
+    # Substitutions run too, even inside double quotes
+    if '$(' in command or '`' in command:
+        for match in SUBSTITUTION.finditer(command):
+            yield from simple_commands(match.group(1) or match.group(2) or '', depth + 1)
+    words = []
+    for token in _tokens(command) + [';']:
+        if token in SEPARATORS or (token and set(token) <= set(';&|()\n')):
+            yield from _unwrap(words, depth)
+            words = []
+        else:
+            words.append(token)
+
+def _unwrap(words, depth):
+    """Simple command of a word list, plus the commands it runs through wrappers or -c"""
+    words = [word for i, word in enumerate(words)
+             if word not in REDIRECTIONS and (i == 0 or words[i - 1] not in REDIRECTIONS)]
+    while words and (words[0] in RESERVED or ASSIGNMENT.match(words[0])):
+        words = words[1:]
+    if not words:
+        return
+    program = words[0].rsplit('/', 1)[-1]
+    args = words[1:]
+    yield program, args
+
+    if program in SHELLS:
+        script = _shell_command_string(args)
+        if script is not None:
+            yield from simple_commands(script, depth + 1)
+    elif program == 'eval':
+        yield from simple_commands(' '.join(args), depth + 1)
+    elif program == 'find':
+        for i, arg in enumerate(args):
+            if arg in FIND_EXEC:
+                # An escaped `\;` already ended the word list, so the clause may run to the end
+                end = next((j for j in range(i + 1, len(args)) if args[j] in (';', '+')), len(args))
+                yield from _unwrap(args[i + 1:end], depth)
+    elif program in WRAPPERS:
+        valued, positional = WRAPPERS[program]
+        i = 0
+        while i < len(args) and (args[i].startswith('-') or (program == 'env' and ASSIGNMENT.match(args[i]))):
+            i += 2 if args[i] in valued else 1
+        i += positional
+        if program == 'flock' and i + 1 < len(args) and args[i] in ('-c', '--command'):
+            yield from simple_commands(args[i + 1], depth + 1)
+        elif program in SHELL_WRAPPERS and i < len(args):
+            wrapped = args[i:]
+            if program == 'parallel' and ':::' in wrapped:
+                wrapped = wrapped[:wrapped.index(':::')]
+            yield from simple_commands(' '.join(wrapped), depth + 1)
+        elif i < len(args):
+            yield from _unwrap(args[i:], depth)
+
+def _shell_command_string(args):
+    """The command string of `sh -c`, also given as part of a flag cluster (`-lc`, `-ec`)"""
+    command_mode = False
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '--':
+            i += 1
+            break
+        if len(arg) < 2 or arg[0] not in '-+':
+            break
+        if arg in SHELL_VALUED:
+            i += 1
+        elif arg[0] == '-' and arg[1] != '-' and 'c' in arg[1:]:
+            command_mode = True
+        i += 1
+    if command_mode and i < len(args):
+        return args[i]
+    return None
+
+class Policy:
+    """Compiled rules with a decision cache"""
+
+    def __init__(self, config=None):
+        config = config or DEFAULT_RULES
+        self.default_allow = str(config.get('default', 'allow')).lower() != 'deny'
+        deny = [Rule(text, 'deny') for text in config.get('deny') or []]
+        allow = [Rule(text, 'allow') for text in config.get('allow') or []]
+        self.deny = RuleSet(deny)
+        self.allow = RuleSet(allow)
+        self.rule_count = len(deny) + len(allow)
+        self.check = functools.lru_cache(maxsize=CACHE_SIZE)(self._check)
+
+    def _check(self, command):
+        try:
+            commands = list(simple_commands(command))
+        except ValueError as e:
+            return Decision(False, None, f"Could not parse command: {e}")
+        for program, args in commands:
+            allowed_by = self.allow.match(program, args)
+            if allowed_by:
+                continue
+            denied_by = self.deny.match(program, args)
+            if denied_by:
+                return Decision(False, denied_by.text, f"Denied by rule '{denied_by.text}'")
+            if not self.default_allow:
+                return Decision(False, None, f"'{program}' is not in the allow list")
+        return Decision(True, None, None)
+
+    def stats(self):
+        info = self.check.cache_info()
+        return {
+            'rules': self.rule_count,
+            'default': 'allow' if self.default_allow else 'deny',
+            'cache_hits': info.hits,
+            'cache_misses': info.misses,
+            'cache_size': info.currsize
+        }
+
+_policy = None
+
+def configure(config):
+    """Compile the rules from a parsed sandbox.yml"""
+    global _policy
+    security = (config or {}).get('security') or {}
+    _policy = Policy(security.get('commands'))
+    return _policy
+
+def get_policy():
+    global _policy
+    if _policy is None:
+        _policy = Policy()
+    return _policy
+
+def check(command):
+    return get_policy().check(command)
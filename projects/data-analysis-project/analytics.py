@@ -0,0 +1,288 @@
+"""
+Declarative, vectorized aggregation over sales data
+
+A spec names the group keys, an optional time bucket and the measures:
+
+    spec = {
+        'group_by': ['Product'],
+        'time_bucket': {'column': 'Date', 'freq': 'M'},
+        'measures': [
+            {'column': 'Sales', 'agg': 'sum'},
+            {'column': 'Sales', 'agg': 'mean'},
+            {'column': 'Sales', 'agg': 'quantile', 'q': 0.9},
+            {'agg': 'count'}
+        ]
+    }
+
+Every measure is computed from one set of integer group codes: keys are
+factorized once and combined into a single group id, sums/counts/means come
+from np.bincount, min/max from ufunc.reduceat over one stable sort by group,
+and quantiles from one value sort per measured column. Adding metrics does not
+add passes of pandas groupby.
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import frame_cache
+
+AGGREGATIONS = ('sum', 'mean', 'count', 'min', 'max', 'median', 'quantile')
+
+# Combined key spaces up to this size are compressed with a bincount instead of a sort
+DENSE_KEY_SPACE = 1 << 22
+
+def parse_spec(spec):
+    """Validate a spec and fill in defaults, raising ValueError on mistakes"""
+    group_by = list(spec.get('group_by') or [])
+    bucket = spec.get('time_bucket')
+    if bucket is not None:
+        if 'column' not in bucket:
+            raise ValueError("time_bucket needs a column")
+        bucket = {'column': bucket['column'], 'freq': bucket.get('freq', 'M')}
+
+    measures = []
+    for measure in spec.get('measures') or [{'agg': 'count'}]:
+        agg = measure.get('agg', 'sum')
+        if agg not in AGGREGATIONS:
+            raise ValueError(f"Unknown aggregation: {agg}")
+        column = measure.get('column')
+        if column is None and agg != 'count':
+            raise ValueError(f"{agg} needs a column")
+        q = 0.5 if agg == 'median' else measure.get('q')
+        if agg == 'quantile' and (q is None or not 0 <= q <= 1):
+            raise ValueError("quantile needs q between 0 and 1")
+        if 'name' in measure:
+            name = measure['name']
+        elif agg == 'quantile':
+            name = f"{column}_p{q * 100:g}"
+        else:
+            name = f"{column}_{agg}" if column else 'count'
+        measures.append({'column': column, 'agg': 'quantile' if agg == 'median' else agg, 'q': q, 'name': name})
+
+    return {'group_by': group_by, 'time_bucket': bucket, 'measures': measures}
+
+def spec_columns(spec):
+    """Columns a spec reads"""
+    spec = parse_spec(spec)
+    columns = list(spec['group_by'])
+    if spec['time_bucket']:
+        columns.append(spec['time_bucket']['column'])
+    columns += [m['column'] for m in spec['measures'] if m['column']]
+    return list(dict.fromkeys(columns))
+
+def _factorize(values):
+    """(codes, labels) for one key column, with -1 for missing values"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return np.asarray(values.cat.codes), values.cat.categories
+    codes, labels = pd.factorize(values, sort=True)
+    return codes, labels
+
+def _bucket(values, freq):
+    """(codes, labels) of the time bucket each value falls in"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Bucket each distinct date once and map the row codes through it
+        buckets = pd.to_datetime(values.cat.categories).to_period(freq)
+        bucket_codes, labels = pd.factorize(buckets, sort=True)
+        codes = np.asarray(values.cat.codes)
+        return np.where(codes < 0, -1, bucket_codes[codes]), labels
+    return _factorize(pd.to_datetime(values).dt.to_period(freq))
+
+def group_codes(frame, spec):
+    """Dense group ids per row (-1 for rows with a missing key) and the group index"""
+    keys, names = [], []
+    for column in spec['group_by']:
+        keys.append(_factorize(frame[column]))
+        names.append(column)
+    if spec['time_bucket']:
+        column = spec['time_bucket']['column']
+        keys.append(_bucket(frame[column], spec['time_bucket']['freq']))
+        names.append(column)
+
+    if not keys:
+        return np.zeros(len(frame), dtype=np.intp), 1, None
+
+    codes = [np.asarray(c, dtype=np.int64) for c, _ in keys]
+    sizes = [max(len(labels), 1) for _, labels in keys]
+    missing = np.zeros(len(frame), dtype=bool)
+    for c in codes:
+        missing |= c < 0
+    combined = np.ravel_multi_index([np.where(missing, 0, c) for c in codes], sizes)
+
+    # Compress to the groups that actually occur, in key order: a bincount
+    # over the key space when it is small, a sort otherwise
+    space = int(np.prod(sizes))
+    present = combined[~missing] if missing.any() else combined
+    if space <= max(len(combined), DENSE_KEY_SPACE):
+        occupied = np.bincount(present, minlength=space) > 0
+        observed = np.flatnonzero(occupied)
+        group = (np.cumsum(occupied) - 1)[combined]
+    else:
+        observed = np.unique(present)
+        group = np.searchsorted(observed, combined)
+    if missing.any():
+        group[missing] = -1
+
+    positions = np.unravel_index(observed, sizes)
+    levels = [np.asarray(labels)[pos] for (_, labels), pos in zip(keys, positions)]
+    if len(levels) == 1:
+        index = pd.Index(levels[0], name=names[0])
+    else:
+        index = pd.MultiIndex.from_arrays(levels, names=names)
+    return group, len(observed), index
+
+def _group_order(group, n_groups, within=None):
+    """Stable argsort by group id (optionally of an already permuted order)
+
+    Narrow integer keys let numpy use a radix sort instead of a comparison sort.
+    """
+    keys = group if within is None else group[within]
+    if n_groups < 2 ** 15:
+        keys = keys.astype(np.int16)
+    order = np.argsort(keys, kind='stable')
+    return order if within is None else within[order]
+
+def _quantiles(group, values, n_groups, qs):
+    """Linear-interpolated quantiles per group (NaNs ignored), one sort for all qs"""
+    valid = ~np.isnan(values)
+    group, values = group[valid], values[valid]
+    # Sort by value, then stably by group: values end up ordered within each group
+    order = _group_order(group, n_groups, within=np.argsort(values))
+    ordered = values[order]
+    counts = np.bincount(group, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    results = {}
+    for q in qs:
+        out = np.full(n_groups, np.nan)
+        has = counts > 0
+        position = starts[has] + q * (counts[has] - 1)
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, starts[has] + counts[has] - 1)
+        fraction = position - low
+        out[has] = ordered[low] + (ordered[high] - ordered[low]) * fraction
+        results[q] = out
+    return results
+
+def aggregate(frame, spec):
+    """Compute every measure of a spec in one pass over a DataFrame"""
+    spec = parse_spec(spec)
+    group, n_groups, index = group_codes(frame, spec)
+
+    keep = group >= 0
+    if not keep.all():
+        group = group[keep]
+    group = group.astype(np.intp, copy=False)
+
+    # Shared per-column work: values, NaN mask, counts and sums via bincount
+    columns = {}
+    def column_stats(name):
+        if name not in columns:
+            values = np.asarray(frame[name], dtype='float64')
+            if not keep.all():
+                values = values[keep]
+            valid = ~np.isnan(values)
+            columns[name] = {
+                'values': values,
+                'count': np.bincount(group[valid], minlength=n_groups),
+                'sum': np.bincount(group, weights=np.where(valid, values, 0.0), minlength=n_groups)
+            }
+        return columns[name]
+
+    sizes = np.bincount(group, minlength=n_groups)
+
+    # One stable sort by group serves every min/max; groups are dense, so
+    # each starts where the previous one ends
+    order = None
+    def sorted_by_group():
+        nonlocal order
+        if order is None:
+            order = _group_order(group, n_groups)
+        return order
+
+    wanted_quantiles = {}
+    for measure in spec['measures']:
+        if measure['agg'] == 'quantile':
+            wanted_quantiles.setdefault(measure['column'], set()).add(measure['q'])
+    quantiles = {
+        name: _quantiles(group, column_stats(name)['values'], n_groups, sorted(qs))
+        for name, qs in wanted_quantiles.items()
+    }
+
+    result = {}
+    for measure in spec['measures']:
+        agg, name = measure['agg'], measure['column']
+        if agg == 'count':
+            out = sizes if name is None else column_stats(name)['count']
+        elif agg == 'sum':
+            out = column_stats(name)['sum']
+        elif agg == 'mean':
+            stats = column_stats(name)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                out = stats['sum'] / stats['count']
+        elif agg in ('min', 'max'):
+            values = column_stats(name)['values'][sorted_by_group()]
+            starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+            ufunc = np.fmin if agg == 'min' else np.fmax
+            out = ufunc.reduceat(values, starts) if len(values) else np.full(n_groups, np.nan)
+        else:
+            out = quantiles[name][measure['q']]
+        result[measure['name']] = out
+
+    return pd.DataFrame(result, index=index)
+
+def load_frame(csv_path, columns=None, dtypes=None, use_cache=True):
+    """Parse a CSV, or reload it memory-mapped from the columnar cache"""
+    if use_cache:
+        key = frame_cache.cache_key(csv_path)
+        df = frame_cache.load_frame(key, columns)
+        if df is not None and (columns is None or set(columns) <= set(df.columns)):
+            return df
+        # Cache the whole file so later specs with other columns hit too
+        df = pd.read_csv(csv_path, dtype=dtypes)
+        frame_cache.store_frame(key, df)
+        return df[columns] if columns is not None else df
+    return pd.read_csv(csv_path, usecols=columns, dtype=dtypes)
+
+def aggregate_csv(csv_path, spec, dtypes=None, use_cache=True):
+    """Load only the columns a spec needs and aggregate them"""
+    columns = spec_columns(spec)
+    if dtypes:
+        dtypes = {name: dtype for name, dtype in dtypes.items() if name in columns}
+    return aggregate(load_frame(csv_path, columns, dtypes, use_cache), spec)
+
+def _parse_measure(text):
+    """column:agg[:q] or count"""
+    parts = text.split(':')
+    if parts == ['count']:
+        return {'agg': 'count'}
+    measure = {'column': parts[0], 'agg': parts[1] if len(parts) > 1 else 'sum'}
+    if len(parts) > 2:
+        measure['q'] = float(parts[2])
+    return measure
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Aggregate a CSV by a declarative spec")
+    parser.add_argument('csv_path', nargs='?', help="CSV file (defaults to sales_data.csv next to this script)")
+    parser.add_argument('--group-by', action='append', default=[], help="group key column (repeatable)")
+    parser.add_argument('--bucket', help="time bucket as column:freq, e.g. Date:M")
+    parser.add_argument('--measure', action='append', default=[],
+                        help="column:agg[:q] with agg in " + ', '.join(AGGREGATIONS) + ", or count (repeatable)")
+    parser.add_argument('--output', help="write the result as CSV instead of printing it")
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false', help="bypass the columnar cache")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    csv_path = args.csv_path or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sales_data.csv')
+    spec = {'group_by': args.group_by, 'measures': [_parse_measure(m) for m in args.measure]}
+    if args.bucket:
+        column, _, freq = args.bucket.partition(':')
+        spec['time_bucket'] = {'column': column, 'freq': freq or 'M'}
+    result = aggregate_csv(csv_path, spec, use_cache=args.use_cache)
+    if args.output:
+        result.to_csv(args.output)
+        print(f"Wrote {len(result)} groups to {args.output}")
+    else:
+        print(result.to_string())
@@ -1,8 +1,259 @@
-import pandas as pd
-import matplotlib.pyplot as plt
+import argparse
+import hashlib
 import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import analytics
+import frame_cache
+import render
+
+# Only the columns the analysis needs, with explicit dtypes so pandas does not
+# have to infer them (and keep whole object columns around) for every chunk
+USECOLS = ['Product', 'Sales']
+DTYPES = {'Product': 'category', 'Sales': 'float64'}
+
+SALES_SPEC = {'group_by': ['Product'], 'measures': [{'column': 'Sales', 'agg': 'sum', 'name': 'Sales'}]}
+
+DEFAULT_CHUNKSIZE = 500_000
+
+# Files larger than this are streamed when --mode=auto
+AUTO_CHUNK_THRESHOLD = 256 * 1024 * 1024
+
+# Bytes hashed at the start of the file and just before the saved offset to
+# tell an append apart from a rewrite in --mode=incremental
+FINGERPRINT_BYTES = 64 * 1024
+
+def _partial_sums(frame):
+    """Sales per product for one chunk, indexed by plain product names"""
+    sums = frame.groupby('Product', observed=True, sort=False)['Sales'].sum()
+    sums.index = sums.index.astype(str)
+    return sums
+
+def _merge(total, partial):
+    if total is None:
+        return partial
+    return total.add(partial, fill_value=0)
+
+def sales_by_product_full(csv_path):
+    """Load the whole file at once (fine for small inputs)"""
+    df = pd.read_csv(csv_path, usecols=USECOLS, dtype=DTYPES)
+    return _partial_sums(df)
+
+def load_sales_frame(csv_path, use_cache=True):
+    """Parse the whole CSV, or reload it from the columnar cache"""
+    return analytics.load_frame(csv_path, dtypes=DTYPES, use_cache=use_cache)
+
+def sales_by_product_chunked(csv_path, chunksize=DEFAULT_CHUNKSIZE):
+    """Stream the file in chunks, keeping only running per-product sums"""
+    total = None
+    for chunk in pd.read_csv(csv_path, usecols=USECOLS, dtype=DTYPES, chunksize=chunksize):
+        total = _merge(total, _partial_sums(chunk))
+    return total if total is not None else pd.Series(dtype='float64')
+
+class _RangeReader:
+    """File-like view of bytes [start, end) of a file"""
+
+    def __init__(self, path, start, end):
+        self.file = open(path, 'rb')
+        self.file.seek(start)
+        self.remaining = end - start
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+def _byte_ranges(csv_path, parts):
+    """Split the data rows of a CSV into line-aligned byte ranges
+
+    Assumes no quoted field contains a newline, which holds for sales exports.
+    """
+    size = os.path.getsize(csv_path)
+    with open(csv_path, 'rb') as f:
+        header = f.readline()
+        start = len(header)
+        bounds = [start]
+        for i in range(1, parts):
+            f.seek(max(start, size * i // parts))
+            f.readline()
+            bounds.append(max(f.tell(), bounds[-1]))
+    bounds.append(size)
+    columns = header.decode().strip().split(',')
+    return columns, [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+
+def _sum_range(csv_path, columns, start, end, chunksize):
+    """Worker: aggregate one byte range in chunks"""
+    reader = _RangeReader(csv_path, start, end)
+    try:
+        total = None
+        for chunk in pd.read_csv(reader, names=columns, header=None, usecols=USECOLS,
+                                 dtype=DTYPES, chunksize=chunksize):
+            total = _merge(total, _partial_sums(chunk))
+        return total
+    finally:
+        reader.close()
+
+def sales_by_product_parallel(csv_path, chunksize=DEFAULT_CHUNKSIZE, workers=None):
+    """Fan line-aligned byte ranges of the file out over a process pool
 
-def analyze_sales_data():
+    Each worker parses its own range straight from disk, so no row data is
+    pickled between processes and peak memory is about one chunk per worker.
+    """
+    workers = workers or os.cpu_count() or 1
+    columns, ranges = _byte_ranges(csv_path, workers * 4)
+    total = None
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_sum_range, csv_path, columns, start, end, chunksize) for start, end in ranges]
+        for future in futures:
+            partial = future.result()
+            if partial is not None:
+                total = _merge(total, partial)
+    return total if total is not None else pd.Series(dtype='float64')
+
+def _fingerprint(f, start, end):
+    f.seek(start)
+    return hashlib.blake2b(f.read(end - start), digest_size=16).hexdigest()
+
+def _last_line_end(f, start, end):
+    """Offset just past the last newline in [start, end), or start if there is none"""
+    position = end
+    while position > start:
+        step = min(FINGERPRINT_BYTES, position - start)
+        f.seek(position - step)
+        block = f.read(step)
+        newline = block.rfind(b'\n')
+        if newline >= 0:
+            return position - step + newline + 1
+        position -= step
+    return start
+
+def _series_from(sums):
+    return pd.Series(sums, dtype='float64')
+
+def sales_by_product_incremental(csv_path, chunksize=DEFAULT_CHUNKSIZE):
+    """Update the totals from the last run with only the rows appended since
+
+    The state (byte offset of the last complete line, per-product sums and
+    fingerprints of the file head and of the bytes before the offset) lives
+    in the frame cache directory. If the file shrank or either fingerprint
+    changed, it was truncated or rewritten and the totals are recomputed.
+    The fingerprints cannot see an edit in the middle of the file, so a file
+    whose mtime changed while its size did not is recomputed as well.
+    """
+    st = os.stat(csv_path)
+    size = st.st_size
+    state = frame_cache.load_state(csv_path)
+    with open(csv_path, 'rb') as f:
+        header = f.readline()
+        columns = header.decode().strip().split(',')
+        start = len(header)
+        total = None
+
+        rewritten = state and state.get('size') == size and state.get('mtime_ns') != st.st_mtime_ns
+        if state and not rewritten and state.get('columns') == columns and state['offset'] <= size:
+            offset = state['offset']
+            head = _fingerprint(f, 0, min(FINGERPRINT_BYTES, offset))
+            tail = _fingerprint(f, max(0, offset - FINGERPRINT_BYTES), offset)
+            if head == state['head'] and tail == state['tail']:
+                start = offset
+                total = _series_from(state['sums'])
+
+        # Only complete lines go into the saved state; a trailing partial line
+        # (still being written, or a missing final newline) is counted for
+        # this run and read again next time
+        end = _last_line_end(f, start, size)
+        if end > start:
+            total = _merge(total, _sum_range(csv_path, columns, start, end, chunksize))
+        total = total if total is not None else pd.Series(dtype='float64')
+
+        frame_cache.store_state(csv_path, {
+            'columns': columns,
+            'offset': end,
+            'sums': {str(product): float(value) for product, value in total.items()},
+            'head': _fingerprint(f, 0, min(FINGERPRINT_BYTES, end)),
+            'tail': _fingerprint(f, max(0, end - FINGERPRINT_BYTES), end),
+            'size': size,
+            'mtime_ns': st.st_mtime_ns
+        })
+
+    if size > end:
+        partial = _sum_range(csv_path, columns, end, size, chunksize)
+        if partial is not None:
+            total = _merge(total, partial)
+    return total
+
+def compute_sales_by_product(csv_path, mode='auto', chunksize=DEFAULT_CHUNKSIZE, workers=None, use_cache=True):
+    """Total sales per product using the requested aggregation mode"""
+    if mode == 'auto':
+        mode = 'chunked' if os.path.getsize(csv_path) > AUTO_CHUNK_THRESHOLD else 'full'
+
+    # Unchanged input: reuse the stored aggregate without parsing anything.
+    # Incremental mode keeps its own state, since hashing the whole file to
+    # look up the cache would cost as much as the scan it is avoiding.
+    key = frame_cache.cache_key(csv_path) if use_cache and mode != 'incremental' else None
+    if key:
+        cached = frame_cache.load_aggregate(key, 'sales_by_product')
+        if cached is not None:
+            return cached
+
+    if mode == 'full' and use_cache:
+        sales = analytics.aggregate(load_sales_frame(csv_path), SALES_SPEC)['Sales']
+    elif mode == 'full':
+        sales = sales_by_product_full(csv_path)
+    elif mode == 'chunked':
+        sales = sales_by_product_chunked(csv_path, chunksize)
+    elif mode == 'parallel':
+        sales = sales_by_product_parallel(csv_path, chunksize, workers)
+    elif mode == 'incremental':
+        sales = sales_by_product_incremental(csv_path, chunksize)
+    else:
+        raise ValueError(f"Unknown mode: {mode}")
+
+    sales = sales.sort_index()
+    sales.index.name = 'Product'
+    if key:
+        frame_cache.store_aggregate(key, 'sales_by_product', sales)
+    return sales
+
+def plot_sales(sales_by_product, plot_path):
+    """Render the total sales bar chart"""
+    spec = render.bar_chart(sales_by_product.index, sales_by_product.to_numpy(), 'Total Sales by Product',
+                            xlabel='Product', ylabel='Total Sales')
+    return render.render(spec, plot_path)
+
+def sales_by_window(csv_path, freq='M', use_cache=True):
+    """Sales per (date window, product), with windows as period labels"""
+    spec = dict(SALES_SPEC, time_bucket={'column': 'Date', 'freq': freq})
+    sales = analytics.aggregate(load_sales_frame(csv_path, use_cache), spec)['Sales']
+    table = sales.unstack('Product', fill_value=0)
+    table.index = table.index.astype(str).rename('Window')
+    table.columns = table.columns.astype(str)
+    return table
+
+def render_window_charts(csv_path, out_dir, freq='M', use_cache=True):
+    """Render one chart per date window and one per product as a single batch"""
+    table = sales_by_window(csv_path, freq, use_cache)
+    os.makedirs(out_dir, exist_ok=True)
+    specs, outputs = [], []
+    for window, row in table.iterrows():
+        specs.append(render.bar_chart(row.index, row.to_numpy(), f'Sales by Product, {window}',
+                                      xlabel='Product', ylabel='Sales'))
+        outputs.append(os.path.join(out_dir, f'window-{window}.png'))
+    for product, column in table.items():
+        specs.append(render.line_chart(column.index, column.to_numpy(), f'{product} Sales per Window',
+                                       xlabel='Window', ylabel='Sales'))
+        outputs.append(os.path.join(out_dir, f"product-{product.replace(' ', '_')}.png"))
+    return render.render_batch(specs, outputs)
+
+def analyze_sales_data(csv_path=None, mode='auto', chunksize=DEFAULT_CHUNKSIZE, workers=None, plot_path=None,
+                       use_cache=True, charts_dir=None, window='M'):
     """
     Analyzes sales data and generates a plot.
     """
@@ -10,7 +261,7 @@ def analyze_sales_data():
     script_dir = os.path.dirname(os.path.abspath(__file__))
 
     # Construct the full path to the CSV file
-    csv_path = os.path.join(script_dir, 'sales_data.csv')
+    csv_path = csv_path or os.path.join(script_dir, 'sales_data.csv')
 
     # Check if the data file exists
     if not os.path.exists(csv_path):
@@ -18,29 +269,41 @@ def analyze_sales_data():
         return
 
     try:
-        # Read the data
-        df = pd.read_csv(csv_path)
-
         # Perform analysis: total sales per product
-        sales_by_product = df.groupby('Product')['Sales'].sum()
-
-        # Create a plot
-        plt.figure(figsize=(10, 6))
-        sales_by_product.plot(kind='bar', color=['#3498db', '#2ecc71', '#e74c3c'])
-        plt.title('Total Sales by Product')
-        plt.xlabel('Product')
-        plt.ylabel('Total Sales')
-        plt.xticks(rotation=0)
-        plt.grid(axis='y', linestyle='--')
+        sales_by_product = compute_sales_by_product(csv_path, mode, chunksize, workers, use_cache)
 
         # Save the plot
-        plot_path = os.path.join(script_dir, 'sales_by_product.png')
-        plt.savefig(plot_path)
+        plot_path = plot_path or os.path.join(script_dir, 'sales_by_product.png')
+        plot_sales(sales_by_product, plot_path)
+
+        if charts_dir:
+            charts = render_window_charts(csv_path, charts_dir, window, use_cache)
+            print(f"Rendered {len(charts)} window/product charts to {charts_dir}")
 
         print(f"Analysis complete. Plot saved to {plot_path}")
+        return sales_by_product
 
     except Exception as e:
         print(f"An error occurred during analysis: {e}")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Total sales per product")
+    parser.add_argument('csv_path', nargs='?', help="CSV file (defaults to sales_data.csv next to this script)")
+    parser.add_argument('--mode', choices=['auto', 'full', 'chunked', 'parallel', 'incremental'], default='auto',
+                        help="full loads the whole file, chunked streams it, parallel streams byte ranges "
+                             "over a process pool, incremental reads only rows appended since the last "
+                             "run; auto streams files over 256MB")
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE, help="rows per chunk")
+    parser.add_argument('--workers', type=int, default=None, help="processes for --mode=parallel")
+    parser.add_argument('--output', help="where to save the plot")
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false',
+                        help="always parse the CSV instead of using the columnar cache "
+                             "(SALES_CACHE_DIR, bounded by SALES_CACHE_BUDGET bytes)")
+    parser.add_argument('--charts-dir', help="also render per-window and per-product charts here")
+    parser.add_argument('--window', default='M', help="pandas period for --charts-dir windows (D, W, M, Q)")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    analyze_sales_data()
+    args = parse_args()
+    analyze_sales_data(args.csv_path, args.mode, args.chunksize, args.workers, args.output, args.use_cache,
+                       args.charts_dir, args.window)
@@ -0,0 +1,201 @@
+"""
+Columnar cache for parsed CSV data
+
+Entries are keyed on the content hash of the source file; a per-path index of
+(size, mtime) avoids re-hashing files that have not been touched. Each entry
+stores one .npy file per column (memory-mapped on reload) plus precomputed
+aggregates, and entries are evicted least-recently-used to stay inside a disk
+budget.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = os.environ.get("SALES_CACHE_DIR", os.path.expanduser("~/.cache/sales-analysis"))
+
+# Keep well inside the 10Gi storage limit from sandbox.yml
+CACHE_BUDGET_BYTES = int(os.environ.get("SALES_CACHE_BUDGET", str(1024 ** 3)))
+
+HASH_BLOCK_SIZE = 1024 * 1024
+INDEX_FILE = "index.json"
+META_FILE = "meta.json"
+
+def _index_path():
+    return os.path.join(CACHE_DIR, INDEX_FILE)
+
+def _load_index():
+    try:
+        with open(_index_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_json(path, data):
+    """Write JSON atomically"""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+def content_hash(path):
+    """BLAKE2b digest of a file's contents"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def cache_key(path):
+    """Content hash of a file, reusing the recorded hash while size and mtime match"""
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    index = _load_index()
+    record = index.get(path)
+    if record and record['size'] == st.st_size and record['mtime_ns'] == st.st_mtime_ns:
+        return record['hash']
+
+    key = content_hash(path)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    index[path] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'hash': key}
+    _write_json(_index_path(), index)
+    return key
+
+def _entry_dir(key):
+    return os.path.join(CACHE_DIR, key)
+
+def _read_meta(key):
+    try:
+        with open(os.path.join(_entry_dir(key), META_FILE)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # Directory mtime doubles as the LRU timestamp
+    os.utime(_entry_dir(key))
+    return meta
+
+def _entry_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def evict(budget=None, keep=None):
+    """Delete least recently used entries until the cache fits its budget"""
+    budget = CACHE_BUDGET_BYTES if budget is None else budget
+    if not os.path.isdir(CACHE_DIR):
+        return
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        path = os.path.join(CACHE_DIR, name)
+        if os.path.isdir(path):
+            entries.append((os.path.getmtime(path), name, _entry_size(path)))
+    total = sum(size for _, _, size in entries)
+    for _, name, size in sorted(entries):
+        if total <= budget:
+            break
+        if name == keep:
+            continue
+        shutil.rmtree(os.path.join(CACHE_DIR, name), ignore_errors=True)
+        total -= size
+
+def _ensure_entry(key):
+    """Create an entry directory with an empty meta file if needed"""
+    path = _entry_dir(key)
+    os.makedirs(path, exist_ok=True)
+    meta_path = os.path.join(path, META_FILE)
+    if not os.path.exists(meta_path):
+        _write_json(meta_path, {'columns': None, 'aggregates': {}, 'created_at': time.time()})
+    return path
+
+def store_frame(key, frame):
+    """Store a DataFrame as one .npy file per column"""
+    path = _ensure_entry(key)
+    staging = tempfile.mkdtemp(dir=path, prefix=".frame-")
+    columns = []
+    for position, name in enumerate(frame.columns):
+        series = frame[name]
+        column = {'name': str(name), 'file': f"col{position}.npy"}
+        if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_dtype(series):
+            np.save(os.path.join(staging, column['file']), series.to_numpy())
+            column['kind'] = 'array'
+        else:
+            # Strings are dictionary-encoded so the codes can be memory-mapped
+            codes, uniques = pd.factorize(series, use_na_sentinel=True)
+            np.save(os.path.join(staging, column['file']), codes.astype(np.int32))
+            column['kind'] = 'category'
+            column['categories'] = [str(value) for value in uniques]
+        columns.append(column)
+
+    for column in columns:
+        os.replace(os.path.join(staging, column['file']), os.path.join(path, column['file']))
+    os.rmdir(staging)
+
+    meta = _read_meta(key)
+    meta['columns'] = columns
+    meta['rows'] = len(frame)
+    _write_json(os.path.join(path, META_FILE), meta)
+    evict(keep=key)
+
+def load_frame(key, columns=None):
+    """Load a cached DataFrame with numeric columns memory-mapped, or None"""
+    meta = _read_meta(key)
+    if not meta or not meta.get('columns'):
+        return None
+    data = {}
+    for column in meta['columns']:
+        if columns is not None and column['name'] not in columns:
+            continue
+        values = np.load(os.path.join(_entry_dir(key), column['file']), mmap_mode='r')
+        if column['kind'] == 'category':
+            values = pd.Categorical.from_codes(np.asarray(values), categories=column['categories'])
+        data[column['name']] = values
+    return pd.DataFrame(data, copy=False)
+
+def store_aggregate(key, name, series):
+    """Store a small precomputed Series alongside the entry"""
+    path = _ensure_entry(key)
+    meta = _read_meta(key)
+    meta['aggregates'][name] = {
+        'index': [str(value) for value in series.index],
+        'values': [float(value) for value in series.to_numpy()],
+        'index_name': series.index.name,
+        'name': series.name
+    }
+    _write_json(os.path.join(path, META_FILE), meta)
+    evict(keep=key)
+
+def load_aggregate(key, name):
+    """Return a stored aggregate as a Series, or None"""
+    meta = _read_meta(key)
+    if not meta or name not in meta.get('aggregates', {}):
+        return None
+    stored = meta['aggregates'][name]
+    index = pd.Index(stored['index'], name=stored['index_name'])
+    return pd.Series(stored['values'], index=index, name=stored['name'])
+
+def _state_path(path):
+    digest = hashlib.blake2b(os.path.abspath(path).encode(), digest_size=8).hexdigest()
+    return os.path.join(CACHE_DIR, f"state-{digest}.json")
+
+def load_state(path):
+    """Per-path state kept across runs (e.g. incremental aggregates), or None"""
+    try:
+        with open(_state_path(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def store_state(path, state):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    _write_json(_state_path(path), state)
@@ -0,0 +1,292 @@
+"""
+Headless chart rendering
+
+Charts are described by small JSON-able specs and rendered with the Agg
+backend. A spec's PNG is stored under a hash of the spec, so an identical
+request is served from disk without touching matplotlib.
+
+Charts that are not cached go to a render service: a background process
+with a pool of renderers that have already imported and warmed up pyplot.
+It listens on a Unix socket, so every run (each sandbox python3 command is
+a fresh process) reaches the same warm renderers. The first run starts it,
+and it exits after CHART_RENDER_IDLE seconds without requests. Without the
+service (CHART_RENDER_IDLE=0, or it cannot start) single charts render
+in-process and batches on a pool that lives as long as the run.
+"""
+
+import atexit
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.connection import Client, Connection
+
+# Must be set before anything imports pyplot
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+CACHE_DIR = os.environ.get("CHART_CACHE_DIR", os.path.expanduser("~/.cache/sales-analysis/charts"))
+
+# Renderer processes for batches; single charts are rendered in-process
+RENDER_WORKERS = int(os.environ.get("CHART_RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Seconds the render service stays up without requests; 0 disables it
+SERVICE_IDLE_SECONDS = float(os.environ.get("CHART_RENDER_IDLE", "600"))
+
+# How long a run waits for a newly started service before rendering itself
+SERVICE_START_TIMEOUT = 15.0
+
+# Socket and lock of the render service; the directory is private to the user
+SERVICE_DIR = os.path.join(CACHE_DIR, '.service')
+SERVICE_SOCKET = os.path.join(SERVICE_DIR, 'renderer.sock')
+
+# Bump when the drawing code changes so stale PNGs are not served
+RENDER_VERSION = 1
+
+DEFAULT_COLORS = ['#3498db', '#2ecc71', '#e74c3c']
+
+_pool = None
+
+def bar_chart(labels, values, title, xlabel='', ylabel='', colors=None, rotation=0, size=(10, 6)):
+    """Spec for a bar chart"""
+    return {
+        'kind': 'bar',
+        'labels': [str(label) for label in labels],
+        'values': [float(value) for value in values],
+        'title': title,
+        'xlabel': xlabel,
+        'ylabel': ylabel,
+        'colors': colors or DEFAULT_COLORS,
+        'rotation': rotation,
+        'size': list(size)
+    }
+
+def line_chart(labels, values, title, xlabel='', ylabel='', color=None, size=(10, 6)):
+    """Spec for a line chart"""
+    return {
+        'kind': 'line',
+        'labels': [str(label) for label in labels],
+        'values': [float(value) for value in values],
+        'title': title,
+        'xlabel': xlabel,
+        'ylabel': ylabel,
+        'colors': [color or DEFAULT_COLORS[0]],
+        'rotation': 45,
+        'size': list(size)
+    }
+
+def chart_key(spec):
+    """Content address of a chart spec"""
+    canonical = json.dumps([RENDER_VERSION, spec], sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+def _cache_path(key):
+    return os.path.join(CACHE_DIR, key[:2], key + '.png')
+
+def _draw(spec, path):
+    """Render one spec to a PNG file (runs in a renderer process)"""
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=spec['size'])
+    try:
+        positions = range(len(spec['values']))
+        if spec['kind'] == 'bar':
+            colors = [spec['colors'][i % len(spec['colors'])] for i in positions]
+            ax.bar(positions, spec['values'], color=colors)
+        elif spec['kind'] == 'line':
+            ax.plot(positions, spec['values'], color=spec['colors'][0], marker='o')
+        else:
+            raise ValueError(f"Unknown chart kind: {spec['kind']}")
+        ax.set_xticks(list(positions), spec['labels'], rotation=spec['rotation'])
+        ax.set_title(spec['title'])
+        ax.set_xlabel(spec['xlabel'])
+        ax.set_ylabel(spec['ylabel'])
+        ax.grid(axis='y', linestyle='--')
+        fig.tight_layout()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.png.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            fig.savefig(f, format='png')
+        os.replace(tmp, path)
+    finally:
+        plt.close(fig)
+    return path
+
+def _warm_up():
+    """Pay for the pyplot import and first-figure setup once per process"""
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots()
+    ax.bar([0], [1])
+    fig.canvas.draw()
+    plt.close(fig)
+
+def get_pool():
+    """The shared renderer pool, started on first use"""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, initializer=_warm_up)
+        atexit.register(shutdown)
+    return _pool
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+def _connect_service():
+    """Connection to the render service, starting it if it is not running"""
+    try:
+        return Client(SERVICE_SOCKET, family='AF_UNIX')
+    except OSError:
+        pass
+    os.makedirs(SERVICE_DIR, mode=0o700, exist_ok=True)
+    # Its own session, so it outlives the run that started it
+    subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve'], stdin=subprocess.DEVNULL,
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    deadline = time.monotonic() + SERVICE_START_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        try:
+            return Client(SERVICE_SOCKET, family='AF_UNIX')
+        except OSError:
+            pass
+    return None
+
+def _render_remote(jobs):
+    """Render (spec, path) jobs on the render service; False if it is unavailable"""
+    if SERVICE_IDLE_SECONDS <= 0:
+        return False
+    try:
+        conn = _connect_service()
+        if conn is None:
+            return False
+        with conn:
+            conn.send(jobs)
+            errors = conn.recv()
+    except (OSError, EOFError):
+        return False
+    for error in errors:
+        if error:
+            raise RuntimeError(f"Chart rendering failed: {error}")
+    return True
+
+def _handle(conn, pool, activity):
+    """Service side of one request: render its jobs and report an error per job"""
+    with conn:
+        try:
+            jobs = conn.recv()
+        except (OSError, EOFError):
+            return
+        futures = [pool.submit(_draw, spec, path) for spec, path in jobs]
+        errors = []
+        for future in futures:
+            try:
+                future.result()
+                errors.append(None)
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+        activity[0] = time.monotonic()
+        try:
+            conn.send(errors)
+        except OSError:
+            pass
+
+def serve():
+    """Run the render service until it has been idle for SERVICE_IDLE_SECONDS"""
+    os.makedirs(SERVICE_DIR, mode=0o700, exist_ok=True)
+    os.chmod(SERVICE_DIR, 0o700)
+    lock = open(os.path.join(SERVICE_DIR, 'renderer.lock'), 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return  # another service is already running
+    if os.path.exists(SERVICE_SOCKET):
+        os.unlink(SERVICE_SOCKET)
+
+    pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, initializer=_warm_up)
+    # Start and warm every renderer before accepting requests
+    for future in [pool.submit(time.sleep, 0.1) for _ in range(RENDER_WORKERS)]:
+        future.result()
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(SERVICE_SOCKET)
+    server.listen(16)
+    server.settimeout(1.0)
+    activity = [time.monotonic()]
+    handlers = []
+    try:
+        while True:
+            try:
+                client, _ = server.accept()
+            except socket.timeout:
+                handlers = [handler for handler in handlers if handler.is_alive()]
+                if not handlers and time.monotonic() - activity[0] > SERVICE_IDLE_SECONDS:
+                    return
+                continue
+            activity[0] = time.monotonic()
+            client.setblocking(True)
+            handler = threading.Thread(target=_handle, args=(Connection(client.detach()), pool, activity),
+                                       daemon=True)
+            handler.start()
+            handlers.append(handler)
+    finally:
+        server.close()
+        if os.path.exists(SERVICE_SOCKET):
+            os.unlink(SERVICE_SOCKET)
+        pool.shutdown(cancel_futures=True)
+
+def _deliver(cached, output):
+    if output and os.path.abspath(output) != cached:
+        shutil.copyfile(cached, output)
+    return output or cached
+
+def render_batch(specs, outputs=None):
+    """Render many charts, returning a path per spec
+
+    Cached charts are copied out immediately; the rest are rendered in
+    parallel by the render service, or without it on this run's renderer
+    pool (in-process when only one is missing). Each chart is copied to the
+    matching entry of outputs, if given.
+    """
+    outputs = outputs or [None] * len(specs)
+    paths = [None] * len(specs)
+    pending = {}
+    for i, spec in enumerate(specs):
+        cached = _cache_path(chart_key(spec))
+        if os.path.exists(cached):
+            paths[i] = _deliver(cached, outputs[i])
+        else:
+            # Identical specs in one batch are rendered once
+            pending.setdefault(cached, (spec, []))[1].append(i)
+
+    if pending and not _render_remote([(spec, cached) for cached, (spec, _) in pending.items()]):
+        if len(pending) == 1 and _pool is None:
+            (cached, (spec, _)), = pending.items()
+            _draw(spec, cached)
+        else:
+            pool = get_pool()
+            futures = [pool.submit(_draw, spec, cached) for cached, (spec, _) in pending.items()]
+            for future in futures:
+                future.result()
+
+    for cached, (_, indexes) in pending.items():
+        for i in indexes:
+            paths[i] = _deliver(cached, outputs[i])
+    return paths
+
+def render(spec, output=None):
+    """Render one chart, returning its path"""
+    return render_batch([spec], [output])[0]
+
+if __name__ == "__main__" and sys.argv[1:] == ['--serve']:
+    serve()
@@ -0,0 +1,361 @@
+"""
+Reverse proxy
+Forwards /proxy/{port}/... to the local services declared under
+network.ports in sandbox.yml (Jupyter, the dev server), so they are
+reachable on hosts that only expose the sandbox port. Upstream connections
+are kept alive in a pool, bodies stream through in both directions, and
+WebSocket connections (Jupyter kernels) are relayed frame by frame.
+"""
+
+import asyncio
+import os
+import time
+
+import h11
+from starlette.background import BackgroundTask
+from starlette.responses import Response, StreamingResponse
+from websockets.asyncio.client import connect as websocket_connect
+from websockets.exceptions import ConnectionClosed, InvalidHandshake
+
+import tracing
+
+UPSTREAM_HOST = "127.0.0.1"
+
+# Open upstream connections per port, and how many of them may idle between requests
+MAX_CONNECTIONS = int(os.environ.get("SANDBOX_PROXY_CONNECTIONS", "100"))
+MAX_KEEPALIVE = 32
+KEEPALIVE_EXPIRY = 30.0
+
+CONNECT_TIMEOUT = 5.0
+
+# Long polls and event streams stay open, so reads only give up after this
+READ_TIMEOUT = float(os.environ.get("SANDBOX_PROXY_TIMEOUT", "300"))
+
+READ_SIZE = 256 * 1024
+
+# Responses up to this size are read whole and sent in one piece
+BUFFER_LIMIT = 64 * 1024
+
+# Headers that describe one connection and are not forwarded (RFC 9110 7.6.1)
+HOP_BY_HOP = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'proxy-connection',
+    'te', 'trailer', 'transfer-encoding', 'upgrade'
+}
+
+# Request headers passed on when opening an upstream WebSocket
+WEBSOCKET_HEADERS = ('cookie', 'authorization', 'user-agent', 'accept-language')
+
+# Proxied port -> whether the upstream expects the /proxy/{port} prefix
+# (a service with a matching base URL, like Jupyter) or has it stripped
+ports = {}
+
+# Port -> its connection pool
+pools = {}
+
+def configure(config, server_port=None):
+    """Proxy the ports from a parsed sandbox.yml, except the server's own"""
+    ports.clear()
+    for entry in ((config or {}).get('network') or {}).get('ports') or []:
+        port = entry.get('port')
+        if port and int(port) != server_port:
+            ports[int(port)] = bool(entry.get('proxy_keep_prefix'))
+
+class Connection:
+    """One HTTP/1.1 connection to a local service"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.h11 = h11.Connection(h11.CLIENT)
+        self.idle_since = None
+        # Set once a response has started, so a failed request is not retried
+        self.used = False
+
+    def usable(self):
+        return not self.reader.at_eof() and not self.writer.is_closing() \
+            and time.monotonic() - self.idle_since < KEEPALIVE_EXPIRY
+
+    def send(self, event):
+        self.writer.write(self.h11.send(event))
+
+    async def next_event(self):
+        while True:
+            event = self.h11.next_event()
+            if event is not h11.NEED_DATA:
+                return event
+            data = await asyncio.wait_for(self.reader.read(READ_SIZE), READ_TIMEOUT)
+            self.h11.receive_data(data)
+
+    def close(self):
+        self.writer.close()
+
+class Pool:
+    """Keep-alive connections to one port
+
+    Plain asyncio streams and h11: a general-purpose client's pool
+    bookkeeping costs several times more CPU than the proxied request itself.
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.idle = []
+        self.slots = asyncio.Semaphore(MAX_CONNECTIONS)
+        self.opened = 0
+        self.reused = 0
+
+    async def acquire(self):
+        await self.slots.acquire()
+        while self.idle:
+            connection = self.idle.pop()
+            if connection.usable():
+                self.reused += 1
+                return connection
+            connection.close()
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(UPSTREAM_HOST, self.port), CONNECT_TIMEOUT)
+        except BaseException:
+            self.slots.release()
+            raise
+        self.opened += 1
+        return Connection(reader, writer)
+
+    def release(self, connection, reuse):
+        self.slots.release()
+        if reuse and connection.h11.our_state is h11.DONE and connection.h11.their_state is h11.DONE \
+                and len(self.idle) < MAX_KEEPALIVE:
+            connection.h11.start_next_cycle()
+            connection.idle_since = time.monotonic()
+            self.idle.append(connection)
+        else:
+            connection.close()
+
+    def close(self):
+        for connection in self.idle:
+            connection.close()
+        self.idle.clear()
+
+def pool(port):
+    if port not in pools:
+        pools[port] = Pool(port)
+    return pools[port]
+
+async def close():
+    for upstream in pools.values():
+        upstream.close()
+    pools.clear()
+
+def stats():
+    return {
+        port: {'idle': len(upstream.idle), 'opened': upstream.opened, 'reused': upstream.reused}
+        for port, upstream in pools.items()
+    }
+
+def _sendable(code):
+    # 1005/1006 only describe what happened to a connection and cannot be sent
+    return 1000 if code in (None, 1005, 1006) else code
+
+def _check_port(port):
+    if port not in ports:
+        raise LookupError(f"Port {port} is not proxied; declare it under network.ports in sandbox.yml")
+
+def upstream_target(scope, port):
+    """Path and query to request upstream, still percent-encoded as the client sent them"""
+    prefix = f"/proxy/{port}".encode()
+    raw_path = scope.get('raw_path') or scope['path'].encode()
+    if not ports[port]:
+        raw_path = raw_path[len(prefix):] if raw_path.startswith(prefix) else raw_path
+    target = raw_path or b'/'
+    if scope.get('query_string'):
+        target += b'?' + scope['query_string']
+    return target
+
+def _connection_tokens(value):
+    return {name.strip().lower() for name in value.split(',')}
+
+def _forward_headers(headers, scope, port):
+    """Request headers for upstream: hop-by-hop ones dropped, X-Forwarded-* added"""
+    connection = _connection_tokens(headers.get('connection', ''))
+    forwarded = [(name, value) for name, value in headers.items()
+                 if name not in HOP_BY_HOP and name not in connection]
+    # Bodies of unknown length are sent on chunked
+    if 'transfer-encoding' in headers and 'content-length' not in headers:
+        forwarded.append(('transfer-encoding', 'chunked'))
+    client_host = scope['client'][0] if scope.get('client') else None
+    if client_host:
+        previous = headers.get('x-forwarded-for')
+        forwarded.append(('x-forwarded-for', f"{previous}, {client_host}" if previous else client_host))
+    forwarded.append(('x-forwarded-proto', headers.get('x-forwarded-proto') or scope.get('scheme', 'http')))
+    if headers.get('host'):
+        forwarded.append(('x-forwarded-host', headers.get('x-forwarded-host') or headers['host']))
+    else:
+        forwarded.append(('host', f"{UPSTREAM_HOST}:{port}"))
+    if not ports[port]:
+        forwarded.append(('x-forwarded-prefix', f"/proxy/{port}"))
+    return forwarded
+
+def _response_headers(headers, port):
+    headers = [(name.decode('latin-1'), value.decode('latin-1')) for name, value in headers]
+    connection = set()
+    for name, value in headers:
+        if name == 'connection':
+            connection |= _connection_tokens(value)
+    kept = []
+    for name, value in headers:
+        if name in HOP_BY_HOP or name in connection:
+            continue
+        # Keep redirects inside the proxy
+        if name == 'location' and not ports[port]:
+            for origin in (f"http://{UPSTREAM_HOST}:{port}", f"http://localhost:{port}", ''):
+                if value.startswith(origin + '/') and not value.startswith('//'):
+                    value = f"/proxy/{port}{value[len(origin):]}"
+                    break
+        kept.append((name.encode('latin-1'), value.encode('latin-1')))
+    return kept
+
+async def _send_request(connection, request, target, headers, has_body):
+    connection.send(h11.Request(method=request.method, target=target, headers=headers))
+    if has_body:
+        async for chunk in request.stream():
+            if chunk:
+                connection.send(h11.Data(data=chunk))
+                await connection.writer.drain()
+    connection.send(h11.EndOfMessage())
+    await connection.writer.drain()
+    while True:
+        event = await connection.next_event()
+        if isinstance(event, h11.Response):
+            return event
+        if isinstance(event, h11.ConnectionClosed):
+            raise ConnectionResetError("Upstream closed the connection without a response")
+
+async def _open(request, port, target, headers, has_body):
+    """Send the request on a pooled connection; returns (connection, response head)"""
+    upstream = pool(port)
+    # A request without a body can be replayed on a new connection if a
+    # pooled one turns out to have been closed by the service meanwhile
+    for attempt in range(1 if has_body else 2):
+        connection = await upstream.acquire()
+        reused = connection.idle_since is not None
+        try:
+            return connection, await _send_request(connection, request, target, headers, has_body)
+        except (OSError, h11.ProtocolError) as e:
+            upstream.release(connection, reuse=False)
+            if reused and attempt == 0 and not has_body:
+                continue
+            if isinstance(e, h11.ProtocolError):
+                raise ConnectionError(f"Bad response from port {port}: {e}") from e
+            raise
+        except BaseException:
+            upstream.release(connection, reuse=False)
+            raise
+
+async def _body(connection, state):
+    while True:
+        event = await connection.next_event()
+        if isinstance(event, h11.Data):
+            yield bytes(event.data)
+        elif isinstance(event, (h11.EndOfMessage, h11.ConnectionClosed)):
+            state['complete'] = True
+            return
+
+async def forward(request, port):
+    """Send a request to a local service and stream its response back
+
+    Raises LookupError for ports that are not proxied, OSError when the
+    service cannot be reached and asyncio.TimeoutError when it does not answer.
+    """
+    _check_port(port)
+    headers = request.headers
+    # Only stream a body upstream when the client sent one
+    has_body = 'content-length' in headers or 'transfer-encoding' in headers
+    target = upstream_target(request.scope, port)
+    forwarded = _forward_headers(headers, request.scope, port)
+
+    tracing.annotate(upstream_port=port)
+    with tracing.span('upstream') as span:
+        connection, head = await _open(request, port, target, forwarded, has_body)
+        span['status'] = head.status_code
+
+    length = next((value for name, value in head.headers if name == b'content-length'), None)
+    if length is not None and length.isdigit() and int(length) <= BUFFER_LIMIT:
+        # Small bodies skip the streaming machinery, which costs more than they do
+        try:
+            body = b''.join([chunk async for chunk in _body(connection, {})])
+        finally:
+            pool(port).release(connection, connection.h11.their_state is h11.DONE)
+        response = Response(body, status_code=head.status_code)
+        response.raw_headers = _response_headers(head.headers, port)
+        return response
+
+    state = {'complete': False}
+
+    async def release():
+        # The connection goes back to the pool only once the whole body was read
+        pool(port).release(connection, state['complete'])
+
+    response = StreamingResponse(_body(connection, state), status_code=head.status_code,
+                                 background=BackgroundTask(release))
+    response.raw_headers = _response_headers(head.headers, port)
+    return response
+
+async def relay_websocket(websocket, port):
+    """Connect a client WebSocket to the same path on a local service and pass frames both ways"""
+    try:
+        _check_port(port)
+    except LookupError:
+        await websocket.close(code=1008)
+        return
+
+    headers = [(name, websocket.headers[name]) for name in WEBSOCKET_HEADERS if name in websocket.headers]
+    try:
+        upstream = await websocket_connect(
+            f"ws://{UPSTREAM_HOST}:{port}{upstream_target(websocket.scope, port).decode('latin-1')}",
+            subprotocols=websocket.scope.get('subprotocols') or None,
+            origin=websocket.headers.get('origin'),
+            additional_headers=headers,
+            open_timeout=CONNECT_TIMEOUT,
+            max_size=None,
+            proxy=None
+        )
+    except (OSError, InvalidHandshake, asyncio.TimeoutError) as e:
+        print(f"⚠️ WebSocket proxy to port {port} failed: {e}")
+        await websocket.close(code=1011)
+        return
+
+    await websocket.accept(subprotocol=upstream.subprotocol)
+
+    async def to_client():
+        async for message in upstream:
+            if isinstance(message, bytes):
+                await websocket.send_bytes(message)
+            else:
+                await websocket.send_text(message)
+
+    async def to_upstream():
+        while True:
+            frame = await websocket.receive()
+            if frame['type'] == 'websocket.disconnect':
+                return frame.get('code', 1000)
+            if frame.get('bytes') is not None:
+                await upstream.send(frame['bytes'])
+            elif frame.get('text') is not None:
+                await upstream.send(frame['text'])
+
+    pumps = [asyncio.ensure_future(to_client()), asyncio.ensure_future(to_upstream())]
+    try:
+        done, _ = await asyncio.wait(pumps, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for pump in pumps:
+            pump.cancel()
+        await asyncio.gather(*pumps, return_exceptions=True)
+
+    if pumps[1] in done and not pumps[1].cancelled() and pumps[1].exception() is None:
+        # The client went away
+        await upstream.close(code=_sendable(pumps[1].result()))
+    else:
+        await upstream.close()
+        try:
+            await websocket.close(code=_sendable(upstream.close_code))
+        except (RuntimeError, ConnectionClosed):
+            pass
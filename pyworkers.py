@@ -0,0 +1,282 @@
+"""
+Pre-warmed Python worker pool
+Runs `python3 -c ...` / `python3 script.py` commands in workers forked from a
+fork server that has already imported the data stack, instead of paying
+interpreter start-up and `import pandas, numpy, matplotlib` on every command.
+Each command runs in a child forked from a worker, so no state carries over
+from one command to the next
+"""
+
+import asyncio
+import multiprocessing
+import os
+import shlex
+import signal
+import sys
+import tempfile
+import traceback
+
+import limits
+
+# Modules imported once by the fork server and inherited by every worker
+PRELOAD_MODULES = [
+    name for name in os.environ.get("SANDBOX_PYTHON_PRELOAD", "numpy,pandas,matplotlib,matplotlib.pyplot").split(',')
+    if name
+]
+
+# Pool size; 0 disables the pool and python3 commands run as normal subprocesses
+POOL_SIZE = int(os.environ.get("SANDBOX_PYTHON_WORKERS", "2"))
+
+# Seconds a worker gets to report a killed run before it is replaced
+STOP_GRACE_SECONDS = 5.0
+
+PYTHON_NAMES = ('python', 'python3', sys.executable)
+
+def _needs_shell(command):
+    """True if a command uses shell syntax (pipes, redirects, globs, expansions)"""
+    quote = None
+    for ch in command:
+        if quote == "'":
+            if ch == "'":
+                quote = None
+        elif quote == '"':
+            if ch == '"':
+                quote = None
+            elif ch in '$`\\':
+                return True
+        elif ch in '\'"':
+            quote = ch
+        elif ch in '|&;<>()$`*?[]{}~#\\\n':
+            return True
+    return False
+
+def parse_python_command(command):
+    """Return (code, path, argv) if a command is a plain python invocation"""
+    if _needs_shell(command):
+        return None
+    try:
+        words = shlex.split(command)
+    except ValueError:
+        return None
+    if len(words) < 2 or words[0] not in PYTHON_NAMES:
+        return None
+    if words[1] == '-c' and len(words) >= 3:
+        return words[2], None, ['-c'] + words[3:]
+    if words[1].startswith('-'):
+        return None
+    return None, words[1], words[1:]
+
+def _run_request(request):
+    """Execute one request as __main__ and return its exit code
+
+    Runs in a child forked for this request alone, so whatever the code does
+    to sys.modules, os.environ, the cwd or global state dies with it.
+    """
+    import atexit
+    import runpy
+
+    returncode = 0
+    try:
+        sys.argv = request['argv']
+        if request['cwd']:
+            os.chdir(request['cwd'])
+        if request['code'] is not None:
+            sys.path.insert(0, '')
+            namespace = {'__name__': '__main__', '__builtins__': __builtins__}
+            exec(compile(request['code'], '<string>', 'exec'), namespace)
+        else:
+            sys.path.insert(0, os.path.dirname(os.path.abspath(request['path'])))
+            runpy.run_path(request['path'], run_name='__main__')
+    except SystemExit as e:
+        if e.code is None:
+            returncode = 0
+        elif isinstance(e.code, int):
+            returncode = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            returncode = 1
+    except BaseException:
+        # Drop this function's own frame so tracebacks look like plain python3
+        _, error, tb = sys.exc_info()
+        traceback.print_exception(type(error), error, tb.tb_next)
+        returncode = 1
+    # os._exit() skips interpreter shutdown, so run the user's atexit hooks here
+    atexit._run_exitfuncs()
+    return returncode
+
+def _run_child(request, stdout, stderr):
+    """Forked child: capture fds 1 and 2, run the request and exit with its code"""
+    returncode = 1
+    try:
+        # Own session, so a timeout or cancel kills everything the run spawned
+        os.setsid()
+        if request['limits']:
+            limits.apply_limits(*request['limits'])
+        os.dup2(stdout.fileno(), 1)
+        os.dup2(stderr.fileno(), 2)
+        returncode = _run_request(request)
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(returncode & 0xff)
+
+def _worker_main(conn):
+    """Worker loop: fork a fresh child from the warm interpreter for every request"""
+    # Non-interactive backend for every run; set here so the server's own env is untouched
+    os.environ['MPLBACKEND'] = 'Agg'
+    if 'matplotlib' in sys.modules:
+        sys.modules['matplotlib'].use('Agg')
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        stdout = tempfile.TemporaryFile()
+        stderr = tempfile.TemporaryFile()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            conn.close()
+            _run_child(request, stdout, stderr)
+        conn.send({'pid': pid})
+        _, status = os.waitpid(pid, 0)
+        stdout.seek(0)
+        stderr.seek(0)
+        conn.send({
+            'stdout': stdout.read().decode(errors='replace'),
+            'stderr': stderr.read().decode(errors='replace'),
+            'returncode': os.waitstatus_to_exitcode(status)
+        })
+        stdout.close()
+        stderr.close()
+
+class PythonRun:
+    """Handle on the process running one pooled command, standing in for a subprocess"""
+
+    def __init__(self, pid):
+        self.pid = pid
+
+class PythonWorker:
+    """Parent-side handle on one pooled worker"""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,))
+        self.process.start()
+        child_conn.close()
+        self.alive = True
+        self.run_pid = None
+
+    def begin(self, request):
+        """Hand a request to the worker and return the pid of the child running it"""
+        try:
+            self.conn.send(request)
+            self.run_pid = self.conn.recv()['pid']
+        except (EOFError, OSError):
+            self.stop()
+            return None
+        return self.run_pid
+
+    def finish(self, timeout):
+        """Wait for the running request's result, blocking; run from a thread"""
+        try:
+            if not self.conn.poll(timeout):
+                self.kill_run()
+                # The worker reports the killed child; give up on it if it does not
+                if not self.conn.poll(STOP_GRACE_SECONDS):
+                    self.stop()
+                else:
+                    self.conn.recv()
+                return {'error': 'Command timed out'}
+            return self.conn.recv()
+        except (EOFError, OSError):
+            self.stop()
+            return {'error': 'Python worker died'}
+        finally:
+            self.run_pid = None
+
+    def kill_run(self, sig=signal.SIGKILL):
+        """Signal the child running the current request and everything it spawned"""
+        if self.run_pid:
+            try:
+                os.killpg(self.run_pid, sig)
+            except (ProcessLookupError, PermissionError):
+                pass
+
+    def stop(self):
+        self.alive = False
+        self.kill_run()
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+class PythonWorkerPool:
+    """Fixed-size pool of warm Python workers"""
+
+    def __init__(self, size=POOL_SIZE, preload=PRELOAD_MODULES):
+        self.size = size
+        self.preload = preload
+        self.context = multiprocessing.get_context('forkserver')
+        self.idle = None
+        self.workers = []
+        self.runs = 0
+
+    async def start(self):
+        """Start the fork server and the workers without blocking the loop"""
+        # Preloading __main__ too means workers do not re-import the server module
+        self.context.set_forkserver_preload(['__main__'] + self.preload)
+        self.idle = asyncio.Queue()
+        workers = await asyncio.gather(*(asyncio.to_thread(PythonWorker, self.context) for _ in range(self.size)))
+        for worker in workers:
+            self.workers.append(worker)
+            self.idle.put_nowait(worker)
+        print(f"✅ Python worker pool ready ({self.size} workers, preloaded {', '.join(self.preload)})")
+
+    @property
+    def ready(self):
+        return bool(self.workers)
+
+    async def run(self, code=None, path=None, argv=None, cwd=None, timeout=30, limit_args=None, on_start=None):
+        """Run code or a script file in a warm worker
+
+        limit_args come from limits.limit_args() for the command; on_start is
+        called with a PythonRun handle once the run's process exists.
+        """
+        worker = await self.idle.get()
+        try:
+            request = {'code': code, 'path': path, 'argv': argv or [], 'cwd': cwd, 'limits': limit_args}
+            pid = await asyncio.to_thread(worker.begin, request)
+            if pid is None:
+                return {'error': 'Python worker died'}
+            if on_start:
+                on_start(PythonRun(pid))
+            result = await asyncio.to_thread(worker.finish, timeout)
+        except asyncio.CancelledError:
+            # The worker is still busy with the abandoned request
+            worker.stop()
+            raise
+        finally:
+            if not worker.alive:
+                self.workers.remove(worker)
+                worker = await asyncio.to_thread(PythonWorker, self.context)
+                self.workers.append(worker)
+            self.idle.put_nowait(worker)
+        self.runs += 1
+        return result
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'idle': self.idle.qsize() if self.idle else 0,
+            'runs': self.runs,
+            'preload': self.preload
+        }
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
@@ -0,0 +1,384 @@
+"""
+Workspace snapshots
+Checkpoints of a volume (projects, tools) kept as manifests over a
+content-addressed object store, so identical files are stored once however
+many snapshots hold them. A snapshot only hashes files whose size or mtime
+changed since the previous one, and a restore only rewrites files that
+differ from the snapshot, cloning (reflink) objects instead of copying them
+where the filesystem allows. Restored files never share an inode with an
+object, so editing one cannot change what a snapshot holds.
+"""
+
+import fcntl
+import fnmatch
+import hashlib
+import json
+import os
+import re
+import shutil
+import stat
+import struct
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import files
+
+SANDBOX_HOME = Path(os.environ.get("SANDBOX_HOME", "/home/sandbox"))
+
+# Keep this on the same filesystem as the volumes so objects can be cloned
+SNAPSHOT_DIR = Path(os.environ.get("SANDBOX_SNAPSHOT_DIR", str(SANDBOX_HOME / ".snapshots")))
+
+# Files hashed and copied in parallel
+WORKERS = int(os.environ.get("SANDBOX_SNAPSHOT_WORKERS", "4"))
+
+READ_SIZE = 1024 * 1024
+
+# Files larger than this are stored as chunks of this size, so an edit to a
+# big dataset only stores the chunks it touched
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# ioctls that make copy-on-write clones of a file or a range of it (btrfs, xfs, ...)
+FICLONE = 0x40049409
+FICLONERANGE = 0x4020940d
+
+# Used when sandbox.yml has no snapshots section
+settings = {
+    'keep': 20,
+    'exclude': ['__pycache__', '.ipynb_checkpoints']
+}
+
+def configure(config):
+    """Retention and exclude patterns from a parsed sandbox.yml"""
+    section = (config or {}).get('snapshots') or {}
+    if 'keep' in section:
+        settings['keep'] = int(section['keep'])
+    if 'exclude' in section:
+        settings['exclude'] = list(section['exclude'] or [])
+
+def object_path(sha256):
+    return SNAPSHOT_DIR / "objects" / sha256[:2] / sha256
+
+def _manifest_path(snapshot_id):
+    if not re.fullmatch(r"[\w-]+", snapshot_id):
+        raise LookupError(f"Snapshot {snapshot_id} not found")
+    return SNAPSHOT_DIR / "manifests" / f"{snapshot_id}.json"
+
+def _lock():
+    """Exclusive lock on the store, shared with the other server workers"""
+    SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    lock = open(SNAPSHOT_DIR / "lock", 'w')
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    return lock
+
+def _excluded(name):
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in settings['exclude'])
+
+def _scan(root):
+    """(relative path, lstat) of everything under root except excluded names and the store"""
+    store = os.path.realpath(SNAPSHOT_DIR)
+    pending = ['']
+    while pending:
+        relative = pending.pop()
+        with os.scandir(os.path.join(root, relative)) as entries:
+            for entry in entries:
+                if _excluded(entry.name) or entry.path == store:
+                    continue
+                path = f"{relative}/{entry.name}" if relative else entry.name
+                info = entry.stat(follow_symlinks=False)
+                yield path, info
+                if stat.S_ISDIR(info.st_mode):
+                    pending.append(path)
+
+def _clone(source, target):
+    """Copy-on-write copy of source; False if the filesystem cannot do it"""
+    try:
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except OSError:
+        if os.path.exists(target):
+            os.unlink(target)
+        return False
+
+# Object directories known to exist
+_object_dirs = set()
+
+def _write_object(data):
+    """Store bytes under their sha256; returns (sha256, bytes added)"""
+    sha256 = hashlib.sha256(data).hexdigest()
+    target = object_path(sha256)
+    if target.exists():
+        return sha256, 0
+    if target.parent not in _object_dirs:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        _object_dirs.add(target.parent)
+    tmp = target.with_name(f"{sha256}.{uuid.uuid4().hex[:8]}.tmp")
+    # Objects are shared by snapshots and never change once written
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o444)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, target)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+    return sha256, len(data)
+
+def _store_file(path):
+    """Put a file into the store, read once: one object, or a list of
+    CHUNK_SIZE objects when it is larger. Returns (content, bytes added)."""
+    chunks, added = [], 0
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data and chunks:
+                break
+            sha256, size = _write_object(data)
+            chunks.append(sha256)
+            added += size
+            if len(data) < CHUNK_SIZE:
+                break
+    return chunks[0] if len(chunks) == 1 else chunks, added
+
+# A manifest file is two JSON lines: the summary, then the entries, so
+# listing snapshots does not parse every file list
+
+def _write_manifest(summary, entries):
+    path = _manifest_path(summary['id'])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'w') as f:
+        f.write(json.dumps(summary) + '\n')
+        f.write(json.dumps(entries, separators=(',', ':')) + '\n')
+    os.replace(tmp, path)
+
+def load(snapshot_id):
+    """Summary of a snapshot with its entries"""
+    try:
+        with open(_manifest_path(snapshot_id)) as f:
+            return {**json.loads(f.readline()), 'entries': json.loads(f.readline())}
+    except (OSError, ValueError):
+        raise LookupError(f"Snapshot {snapshot_id} not found")
+
+def _manifests():
+    """Summaries of all snapshots, oldest first"""
+    summaries = []
+    for path in (SNAPSHOT_DIR / "manifests").glob('*.json'):
+        try:
+            with open(path) as f:
+                summaries.append(json.loads(f.readline()))
+        except (OSError, ValueError):
+            continue
+    return sorted(summaries, key=lambda manifest: manifest['created_at'])
+
+def list_snapshots(volume=None):
+    return [manifest for manifest in _manifests() if volume is None or manifest['volume'] == volume]
+
+def take(volume='projects', name=None):
+    """Snapshot a volume; files unchanged (size and mtime) since its last snapshot are not read"""
+    root = str(files.resolve(volume))
+    started = time.time()
+    with _lock():
+        previous = list_snapshots(volume)
+        known = load(previous[-1]['id'])['entries'] if previous else {}
+
+        # entries: path -> [type, mode, size, mtime_ns, sha256 or chunk list] for files,
+        # [type, mode, target] for symlinks, [type, mode] for directories
+        entries = {}
+        changed = []
+        for path, info in _scan(root):
+            mode = stat.S_IMODE(info.st_mode)
+            if stat.S_ISDIR(info.st_mode):
+                entries[path] = ['d', mode]
+            elif stat.S_ISLNK(info.st_mode):
+                entries[path] = ['l', mode, os.readlink(os.path.join(root, path))]
+            elif stat.S_ISREG(info.st_mode):
+                old = known.get(path)
+                if old and old[0] == 'f' and old[2] == info.st_size and old[3] == info.st_mtime_ns:
+                    entries[path] = ['f', mode, info.st_size, info.st_mtime_ns, old[4]]
+                else:
+                    changed.append((path, info))
+
+        def add(item):
+            path, info = item
+            return path, info, _store_file(os.path.join(root, path))
+
+        added = 0
+        with ThreadPoolExecutor(WORKERS) as pool:
+            for path, info, (content, size) in pool.map(add, changed):
+                entries[path] = ['f', stat.S_IMODE(info.st_mode), info.st_size, info.st_mtime_ns, content]
+                added += size
+
+        snapshot_id = time.strftime('%Y%m%d-%H%M%S', time.gmtime(started)) + '-' + uuid.uuid4().hex[:6]
+        summary = {
+            'id': snapshot_id,
+            'name': name,
+            'volume': volume,
+            'created_at': started,
+            'seconds': round(time.time() - started, 3),
+            'files': sum(1 for entry in entries.values() if entry[0] == 'f'),
+            'bytes': sum(entry[2] for entry in entries.values() if entry[0] == 'f'),
+            'hashed': len(changed),
+            'added_bytes': added
+        }
+        _write_manifest(summary, entries)
+
+        # Oldest snapshots of this volume beyond the retention limit go
+        expired = (previous + [summary])[:-settings['keep']] if settings['keep'] > 0 else []
+        for old in expired:
+            _manifest_path(old['id']).unlink()
+        if expired:
+            _collect_garbage()
+    print(f"📸 Snapshot {snapshot_id} of {volume}: {summary['files']} files, "
+          f"{summary['hashed']} hashed, {added} bytes added in {summary['seconds']}s")
+    return summary
+
+def _join_chunks(chunks, target, able):
+    """Assemble a chunked file, cloning each chunk's blocks where possible"""
+    with open(target, 'wb') as dst:
+        offset = 0
+        for sha256 in chunks:
+            with open(object_path(sha256), 'rb') as src:
+                length = os.fstat(src.fileno()).st_size
+                if able['clone']:
+                    try:
+                        fcntl.ioctl(dst.fileno(), FICLONERANGE, struct.pack('qQQQ', src.fileno(), 0, length, offset))
+                    except OSError:
+                        able['clone'] = False
+                if not able['clone']:
+                    dst.seek(offset)
+                    shutil.copyfileobj(src, dst, READ_SIZE)
+            offset += length
+    return 'cloned' if able['clone'] else 'copied'
+
+def _materialize(content, target, mode, mtime_ns, able):
+    """Put a file's content at target: clone it where possible, else copy it
+
+    `able` says whether cloning still looks possible; the first failure turns
+    it off for the rest of the restore. Objects are never hard-linked, since
+    a chmod and an in-place edit would then rewrite every snapshot holding it.
+    """
+    tmp = target.with_name(f".{target.name}.restore-{uuid.uuid4().hex[:8]}")
+    try:
+        if isinstance(content, list):
+            method = _join_chunks(content, tmp, able)
+        else:
+            source = object_path(content)
+            method = 'copied'
+            if able['clone']:
+                if _clone(source, tmp):
+                    method = 'cloned'
+                else:
+                    able['clone'] = False
+            if method == 'copied':
+                shutil.copyfile(source, tmp)
+        os.chmod(tmp, mode)
+        os.utime(tmp, ns=(mtime_ns, mtime_ns))
+        os.replace(tmp, target)
+        return method
+    finally:
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+
+def restore(snapshot_id):
+    """Make a volume match a snapshot, touching only what differs
+
+    Excluded names are left alone, everything else not in the snapshot is removed.
+    """
+    manifest = load(snapshot_id)
+    root = files.resolve(manifest['volume'])
+    entries = manifest['entries']
+    started = time.time()
+    counts = {'unchanged': 0, 'cloned': 0, 'copied': 0, 'removed': 0}
+
+    with _lock():
+        current = dict(_scan(str(root)))
+
+        # Children sort after their parent, so reversed order removes them first
+        for path in sorted(current, reverse=True):
+            entry = entries.get(path)
+            info = current[path]
+            kind = 'd' if stat.S_ISDIR(info.st_mode) else 'l' if stat.S_ISLNK(info.st_mode) else 'f'
+            if entry is None or entry[0] != kind or (kind == 'f' and not stat.S_ISREG(info.st_mode)):
+                full = root / path
+                if kind == 'd':
+                    # Holds only excluded names now; they go with it
+                    shutil.rmtree(full)
+                else:
+                    full.unlink()
+                del current[path]
+                counts['removed'] += 1
+
+        to_write = []
+        for path in sorted(entries):
+            entry = entries[path]
+            full = root / path
+            if entry[0] == 'd':
+                if path not in current:
+                    full.mkdir()
+            elif entry[0] == 'l':
+                if path in current and os.readlink(full) == entry[2]:
+                    counts['unchanged'] += 1
+                    continue
+                if path in current:
+                    full.unlink()
+                os.symlink(entry[2], full)
+            else:
+                info = current.get(path)
+                if info and info.st_size == entry[2] and info.st_mtime_ns == entry[3]:
+                    if stat.S_IMODE(info.st_mode) != entry[1]:
+                        os.chmod(full, entry[1])
+                    counts['unchanged'] += 1
+                else:
+                    to_write.append((entry[4], full, entry[1], entry[3]))
+
+        able = {'clone': True}
+        with ThreadPoolExecutor(WORKERS) as pool:
+            for method in pool.map(lambda item: _materialize(*item, able), to_write):
+                counts[method] += 1
+
+        # Directory modes last, in case one of them is read-only
+        for path in sorted((path for path, entry in entries.items() if entry[0] == 'd'), reverse=True):
+            os.chmod(root / path, entries[path][1])
+
+    result = {'id': snapshot_id, 'volume': manifest['volume'], 'seconds': round(time.time() - started, 3), **counts}
+    print(f"⏪ Restored {manifest['volume']} to {snapshot_id}: {counts}")
+    return result
+
+def _collect_garbage():
+    """Delete objects no snapshot refers to; the caller holds the lock"""
+    referenced = set()
+    for path in (SNAPSHOT_DIR / "manifests").glob('*.json'):
+        entries = load(path.stem)['entries']
+        for entry in entries.values():
+            if entry[0] == 'f':
+                referenced.update(entry[4] if isinstance(entry[4], list) else [entry[4]])
+    freed = 0
+    for path in (SNAPSHOT_DIR / "objects").glob('*/*'):
+        if path.name not in referenced:
+            freed += path.stat().st_size
+            path.unlink()
+    return freed
+
+def delete(snapshot_id):
+    with _lock():
+        load(snapshot_id)
+        _manifest_path(snapshot_id).unlink()
+        freed = _collect_garbage()
+    return {'id': snapshot_id, 'deleted': True, 'freed_bytes': freed}
+
+def stats():
+    """Size of the object store next to the data the snapshots describe"""
+    objects = list((SNAPSHOT_DIR / "objects").glob('*/*'))
+    snapshots = _manifests()
+    return {
+        'snapshot_dir': str(SNAPSHOT_DIR),
+        'snapshots': len(snapshots),
+        'objects': len(objects),
+        'stored_bytes': sum(path.stat().st_size for path in objects),
+        'snapshot_bytes': sum(manifest['bytes'] for manifest in snapshots),
+        'keep': settings['keep'],
+        'exclude': settings['exclude']
+    }
@@ -4,18 +4,46 @@ Ubuntu Sandbox Startup Server
 Keeps the container running and provides a web interface for Hugging Face Spaces
 """
 
+import argparse
+import asyncio
 import os
 import sys
 import json
-import subprocess
-import threading
 import time
 from pathlib import Path
 
-from fastapi import FastAPI, Request, BackgroundTasks
-from fastapi.responses import HTMLResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
+import boot
+
+# Bind the port and answer /health while FastAPI and the rest of the stack import
+if __name__ == "__main__":
+    boot.listen_early(boot.requested_port())
+
+from fastapi import FastAPI, Request, WebSocket
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse, Response, StreamingResponse
+from starlette.requests import ClientDisconnect
 import uvicorn
+from uvicorn.supervisors import Multiprocess
+import yaml
+
+from executor import run_command_async, stream_command, cancel_command, running_commands, get_command_slots, resolve_timeout
+from jobs import submit_job, get_job, job_info, list_jobs, read_job_output, kill_job, shutdown_jobs
+import supervisor
+import status
+import metrics
+import limits
+import executor
+import pyworkers
+import assets
+import store
+import terminal
+import pkgcache
+import tracing
+import policy
+import files
+import proxy
+import snapshots
+
+boot.record('server.imports', boot.IMPORTED_AT)
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -24,508 +52,647 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Global variables to track services
-services = {}
+# Every HTTP request gets a trace; see /api/traces
+app.add_middleware(tracing.TracingMiddleware)
+
+# Hashed, precompressed UI assets built by assets.build()
+app.mount("/static", assets.PrecompressedStaticFiles(directory=assets.BUILD_DIR, check_dir=False), name="static")
+
+# Global variables to track configuration (background jobs live in the shared store)
 sandbox_config = {}
 
+SANDBOX_HOME = Path(os.environ.get("SANDBOX_HOME", "/home/sandbox"))
+
+# Long-running watcher tasks cancelled on shutdown
+background_tasks = []
+
+# Startup work that runs after the server is already answering requests
+deferred_startup = []
+
+# Server processes; state shared between them lives in store.py
+WORKERS = int(os.environ.get("SANDBOX_WORKERS", "1"))
+
+PORT = int(os.environ.get("SANDBOX_PORT", "8000"))
+
+# Followers check this often whether the leader went away
+FOLLOW_INTERVAL = 1.0
+
+# How often the leader picks up service actions queued by other workers
+ACTION_POLL_INTERVAL = 0.2
+ACTION_TIMEOUT = 30.0
+
 def load_sandbox_config():
     """Load sandbox configuration from files"""
     global sandbox_config
     
-    # Load sandbox.yml (simplified parsing)
-    sandbox_yml_path = Path("/home/sandbox/sandbox.yml")
+    # Load sandbox.yml
+    sandbox_yml_path = SANDBOX_HOME / "sandbox.yml"
     if sandbox_yml_path.exists():
-        # For simplicity, we'll extract key info without full YAML parsing
         with open(sandbox_yml_path, 'r') as f:
             content = f.read()
             sandbox_config['yml_content'] = content
+            sandbox_config['sandbox'] = yaml.safe_load(content) or {}
     
     # Load tools.json
-    tools_json_path = Path("/home/sandbox/tools.json")
+    tools_json_path = SANDBOX_HOME / "tools.json"
     if tools_json_path.exists():
         with open(tools_json_path, 'r') as f:
             sandbox_config['tools'] = json.load(f)
     
     print("✅ Sandbox configuration loaded")
 
-def run_command(command, background=False):
-    """Run a shell command"""
-    try:
-        if background:
-            process = subprocess.Popen(
-                command,
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            return process
-        else:
-            result = subprocess.run(
-                command,
-                shell=True,
-                capture_output=True,
-                text=True,
-                timeout=30
-            )
-            return {
-                'stdout': result.stdout,
-                'stderr': result.stderr,
-                'returncode': result.returncode
-            }
-    except subprocess.TimeoutExpired:
-        return {'error': 'Command timed out'}
-    except Exception as e:
-        return {'error': str(e)}
+def is_command_allowed(command):
+    """Security: check a command line against the sandbox.yml command rules"""
+    return policy.check(command).allowed
+
+def request_user(request):
+    """Identify the sandbox user behind a request"""
+    return request.headers.get('x-sandbox-user') or (request.client.host if request.client else 'anonymous')
+
+def metric_roots():
+    """Process trees to account in metrics, as (kind, id, user, pid)"""
+    roots = [('command', command_id, entry['user'], entry['process'].pid)
+             for command_id, entry in list(running_commands.items())]
+    # Jobs come from the store so the leader accounts those of every worker
+    roots += [('job', job['job_id'], job['user'], job['pid'])
+              for job in list_jobs() if job['finished_at'] is None]
+    roots += [('terminal', session_id, session['user'], session['process'].pid)
+              for session_id, session in list(terminal.sessions.items())]
+    roots += [('service', name, None, service['pid'])
+              for name, service in supervisor.supervised.items() if service['pid']]
+    return roots
+
+def share_sample(snapshot, owners):
+    """Leader: publish each metrics sample for the other workers"""
+    store.add_sample(snapshot)
+    store.put_value('metric_owners', list(owners.values()))
+
+def load_shared_metrics():
+    """Follower: refresh the local metrics view from the leader's samples"""
+    if store.is_leader():
+        return
+    metrics.history.clear()
+    metrics.history.extend(store.recent_samples(metrics.HISTORY_SIZE))
+    metrics.owners.clear()
+    for owner in store.get_value('metric_owners', []):
+        metrics.owners[(owner['kind'], owner['id'])] = owner
+
+def publish_service(name, service):
+    """Supervisor listener, mirrors service state into the store"""
+    store.put_service(supervisor.service_info(service))
+
+async def run_service_action(name, action):
+    """Apply a service action locally, returns False if nothing changed"""
+    if action == 'start':
+        return await supervisor.start_service(name)
+    if action == 'stop':
+        await supervisor.stop_service(name)
+        return True
+    if action == 'restart':
+        return await supervisor.restart_service(name)
+    raise ValueError(f'Unknown action: {action}')
+
+async def serve_service_actions():
+    """Leader: carry out service actions queued by other workers"""
+    while True:
+        for request in store.pending_actions():
+            try:
+                changed = await run_service_action(request['name'], request['action'])
+                result = {'changed': changed, 'service': supervisor.service_info(supervisor.supervised[request['name']])}
+            except Exception as e:
+                tracing.error(e)
+                result = {'error': str(e)}
+            store.finish_action(request['id'], result)
+        if store.get_value('boot') != supervisor.boot:
+            store.put_value('boot', supervisor.boot)
+        await asyncio.sleep(ACTION_POLL_INTERVAL)
+
+async def service_action(name, action):
+    """Run a service action here if this worker leads, otherwise via the leader"""
+    if store.is_leader():
+        changed = await run_service_action(name, action)
+        return {'changed': changed, 'service': supervisor.service_info(supervisor.supervised[name])}
+
+    action_id = store.request_action(name, action)
+    deadline = time.monotonic() + ACTION_TIMEOUT
+    while time.monotonic() < deadline:
+        result = store.action_result(action_id)
+        if result is not None:
+            return result
+        await asyncio.sleep(ACTION_POLL_INTERVAL / 4)
+    return {'error': 'Timed out waiting for the supervisor'}
+
+def lead():
+    """Take on the duties only one worker may have: services and metrics"""
+    supervisor.state_listeners.append(publish_service)
+    for name, service in supervisor.supervised.items():
+        publish_service(name, service)
+    background_tasks.append(asyncio.create_task(metrics.collect(metric_roots, share_sample)))
+    background_tasks.append(asyncio.create_task(serve_service_actions()))
+    deferred_startup.append(asyncio.create_task(supervisor.start_auto_services()))
+    if WORKERS > 1:
+        print(f"✅ Worker {os.getpid()} leads (supervisor and metrics)")
+
+async def follow_leader():
+    """Follower: mirror service states and take over if the leader goes away"""
+    while not store.try_lead():
+        for info in store.list_services():
+            status.on_service_state(info['name'], dict(info, process=info['pid']))
+        await asyncio.sleep(FOLLOW_INTERVAL)
+    lead()
+
+def format_sse(event, payload):
+    """Encode one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
 
 @app.get("/", response_class=HTMLResponse)
-async def home():
+async def home(request: Request):
     """Main sandbox interface"""
-    return """
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>🐧 Ubuntu Sandbox</title>
-        <style>
-            * { margin: 0; padding: 0; box-sizing: border-box; }
-            body {
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                color: #333;
-                min-height: 100vh;
-                padding: 20px;
-            }
-            .container {
-                max-width: 1200px;
-                margin: 0 auto;
-                background: rgba(255,255,255,0.95);
-                border-radius: 15px;
-                padding: 30px;
-                box-shadow: 0 20px 40px rgba(0,0,0,0.1);
-            }
-            .header {
-                text-align: center;
-                margin-bottom: 40px;
-                padding-bottom: 20px;
-                border-bottom: 2px solid #eee;
-            }
-            .header h1 {
-                font-size: 2.5em;
-                color: #2c3e50;
-                margin-bottom: 10px;
-            }
-            .header p {
-                font-size: 1.2em;
-                color: #7f8c8d;
-            }
-            .grid {
-                display: grid;
-                grid-template-columns: repeat(auto-fit, minmax(300px, 1fr));
-                gap: 25px;
-                margin-bottom: 30px;
-            }
-            .card {
-                background: white;
-                border-radius: 10px;
-                padding: 25px;
-                box-shadow: 0 5px 15px rgba(0,0,0,0.08);
-                border-left: 4px solid #3498db;
-                transition: transform 0.2s;
-            }
-            .card:hover {
-                transform: translateY(-5px);
-            }
-            .card h3 {
-                color: #2c3e50;
-                margin-bottom: 15px;
-                font-size: 1.3em;
-            }
-            .card ul {
-                list-style: none;
-                padding-left: 0;
-            }
-            .card li {
-                padding: 8px 0;
-                border-bottom: 1px solid #ecf0f1;
-                display: flex;
-                align-items: center;
-            }
-            .card li:last-child {
-                border-bottom: none;
-            }
-            .status-badge {
-                display: inline-block;
-                padding: 4px 12px;
-                border-radius: 20px;
-                font-size: 0.8em;
-                font-weight: bold;
-                margin-left: auto;
-            }
-            .status-running { background: #2ecc71; color: white; }
-            .status-stopped { background: #95a5a6; color: white; }
-            .status-error { background: #e74c3c; color: white; }
-            .action-buttons {
-                display: flex;
-                gap: 15px;
-                flex-wrap: wrap;
-                margin-top: 30px;
-                justify-content: center;
-            }
-            .btn {
-                padding: 12px 25px;
-                border: none;
-                border-radius: 8px;
-                cursor: pointer;
-                text-decoration: none;
-                display: inline-block;
-                font-weight: bold;
-                transition: all 0.2s;
-                text-align: center;
-            }
-            .btn-primary {
-                background: #3498db;
-                color: white;
-            }
-            .btn-primary:hover {
-                background: #2980b9;
-            }
-            .btn-success {
-                background: #2ecc71;
-                color: white;
-            }
-            .btn-success:hover {
-                background: #27ae60;
-            }
-            .btn-warning {
-                background: #f39c12;
-                color: white;
-            }
-            .btn-warning:hover {
-                background: #d68910;
-            }
-            .btn-info {
-                background: #17a2b8;
-                color: white;
-            }
-            .btn-info:hover {
-                background: #138496;
-            }
-            .terminal-section {
-                margin-top: 30px;
-                background: #2c3e50;
-                border-radius: 10px;
-                padding: 20px;
-                color: #ecf0f1;
-            }
-            .terminal-header {
-                display: flex;
-                align-items: center;
-                margin-bottom: 15px;
-                padding-bottom: 10px;
-                border-bottom: 1px solid #34495e;
-            }
-            .terminal-dots {
-                display: flex;
-                gap: 8px;
-                margin-right: 15px;
-            }
-            .dot {
-                width: 12px;
-                height: 12px;
-                border-radius: 50%;
-            }
-            .dot.red { background: #e74c3c; }
-            .dot.yellow { background: #f1c40f; }
-            .dot.green { background: #2ecc71; }
-            #command-output {
-                background: #1a252f;
-                border-radius: 5px;
-                padding: 15px;
-                font-family: 'Courier New', monospace;
-                font-size: 14px;
-                line-height: 1.4;
-                max-height: 300px;
-                overflow-y: auto;
-                white-space: pre-wrap;
-            }
-            .command-input {
-                display: flex;
-                gap: 10px;
-                margin-top: 15px;
-            }
-            #command {
-                flex: 1;
-                padding: 10px;
-                border: 1px solid #34495e;
-                border-radius: 5px;
-                background: #34495e;
-                color: #ecf0f1;
-                font-family: 'Courier New', monospace;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h1>🐧 Ubuntu Sandbox</h1>
-                <p>Your containerized Ubuntu development environment</p>
-            </div>
-
-            <div class="grid">
-                <div class="card">
-                    <h3>🛠️ System Information</h3>
-                    <ul>
-                        <li>OS: Ubuntu 22.04 LTS <span class="status-badge status-running">Active</span></li>
-                        <li>Python: 3.10+ <span class="status-badge status-running">Available</span></li>
-                        <li>Node.js: 18+ <span class="status-badge status-running">Available</span></li>
-                        <li>Git: Latest <span class="status-badge status-running">Ready</span></li>
-                    </ul>
-                </div>
-
-                <div class="card">
-                    <h3>🌐 Available Ports</h3>
-                    <ul>
-                        <li>Port 8000: Web Server <span class="status-badge status-running">Active</span></li>
-                        <li>Port 8888: Jupyter Lab <span class="status-badge status-stopped" id="jupyter-status">Stopped</span></li>
-                        <li>Port 3000: Dev Server <span class="status-badge status-stopped" id="dev-status">Stopped</span></li>
-                    </ul>
-                </div>
-
-                <div class="card">
-                    <h3>📁 Project Structure</h3>
-                    <ul>
-                        <li>/app/projects <span class="status-badge status-running">Ready</span></li>
-                        <li>/app/tools <span class="status-badge status-running">Ready</span></li>
-                        <li>Sample projects <span class="status-badge status-running">Created</span></li>
-                    </ul>
-                </div>
-
-                <div class="card">
-                    <h3>⚡ Quick Actions</h3>
-                    <ul>
-                        <li>
-                            <button class="btn btn-success" onclick="startJupyter()">Start Jupyter Lab</button>
-                        </li>
-                        <li>
-                            <button class="btn btn-primary" onclick="runSampleApp()">Run Python App</button>
-                        </li>
-                        <li>
-                            <button class="btn btn-warning" onclick="runNodeServer()">Run Node.js Server</button>
-                        </li>
-                        <li>
-                            <button class="btn btn-info" onclick="runDataAnalysis()">Run Data Analysis</button>
-                        </li>
-                    </ul>
-                </div>
-            </div>
-
-            <div class="action-buttons">
-                <button class="btn btn-primary" onclick="getSystemInfo()">System Info</button>
-                <button class="btn btn-primary" onclick="listProjects()">List Projects</button>
-                <button class="btn btn-primary" onclick="checkPorts()">Check Ports</button>
-                <button class="btn btn-success" onclick="installPackage()">Install Package</button>
-            </div>
-
-            <div class="terminal-section">
-                <div class="terminal-header">
-                    <div class="terminal-dots">
-                        <div class="dot red"></div>
-                        <div class="dot yellow"></div>
-                        <div class="dot green"></div>
-                    </div>
-                    <span>sandbox@ubuntu:~$</span>
-                </div>
-                <div id="command-output">Welcome to Ubuntu Sandbox! 🐧
-System initialized and ready for development.
-
-Available commands:
-- System info, project management, package installation
-- Use the buttons above or type commands below
-
-Type 'help' for available commands.
-</div>
-                <div class="command-input">
-                    <input type="text" id="command" placeholder="Enter command..." onkeypress="handleEnter(event)">
-                    <button class="btn btn-primary" onclick="runCommand()">Run</button>
-                </div>
-            </div>
-        </div>
-
-        <script>
-            function appendOutput(text) {
-                const output = document.getElementById('command-output');
-                output.textContent += '\\n' + text;
-                output.scrollTop = output.scrollHeight;
-            }
-
-            function runCommand() {
-                const input = document.getElementById('command');
-                const command = input.value.trim();
-                if (!command) return;
-
-                appendOutput('$ ' + command);
-                input.value = '';
-
-                fetch('/api/command', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ command: command })
-                })
-                .then(response => response.json())
-                .then(data => {
-                    if (data.stdout) appendOutput(data.stdout);
-                    if (data.stderr) appendOutput('ERROR: ' + data.stderr);
-                    if (data.error) appendOutput('ERROR: ' + data.error);
-                })
-                .catch(error => appendOutput('Network error: ' + error));
-            }
-
-            function handleEnter(event) {
-                if (event.key === 'Enter') {
-                    runCommand();
-                }
-            }
-
-            function getSystemInfo() {
-                runSpecificCommand('uname -a && python3 --version && node --version && df -h');
-            }
-
-            function listProjects() {
-                runSpecificCommand('ls -la /app/projects/');
-            }
-
-            function checkPorts() {
-                runSpecificCommand('netstat -tuln | grep -E ":(8000|8888|3000)"');
-            }
-
-            function startJupyter() {
-                appendOutput('$ Starting Jupyter Lab...');
-                fetch('/api/start-jupyter', { method: 'POST' })
-                .then(response => response.json())
-                .then(data => {
-                    appendOutput(data.message);
-                    if (data.status === 'started') {
-                        document.getElementById('jupyter-status').textContent = 'Running';
-                        document.getElementById('jupyter-status').className = 'status-badge status-running';
-                    }
-                });
-            }
-
-            function runSampleApp() {
-                appendOutput('$ Starting sample Python app...');
-                runSpecificCommand('cd /app/projects/sample-project && python3 app.py &');
-            }
-
-            function runNodeServer() {
-                appendOutput('$ Starting Node.js server...');
-                runSpecificCommand('cd /app/projects/sample-project && node server.js &');
-            }
-
-            function runDataAnalysis() {
-                appendOutput('$ Running data analysis script...');
-                runSpecificCommand('python3 /app/projects/data-analysis-project/analyze_data.py');
-            }
-
-            function installPackage() {
-                const pkg = prompt('Enter package name to install (pip3 install [package]):');
-                if (pkg) {
-                    runSpecificCommand('pip3 install ' + pkg);
-                }
-            }
-
-            function runSpecificCommand(cmd) {
-                appendOutput('$ ' + cmd);
-                fetch('/api/command', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ command: cmd })
-                })
-                .then(response => response.json())
-                .then(data => {
-                    if (data.stdout) appendOutput(data.stdout);
-                    if (data.stderr) appendOutput('ERROR: ' + data.stderr);
-                    if (data.error) appendOutput('ERROR: ' + data.error);
-                })
-                .catch(error => appendOutput('Network error: ' + error));
-            }
-        </script>
-    </body>
-    </html>
-    """
+    # The page lives in static/; scripts and styles are served from /static
+    return assets.index_response(request)
 
 @app.post("/api/command")
 async def execute_command(request: Request):
     """Execute a shell command"""
     try:
-        data = await request.json()
+        with tracing.span('parse'):
+            data = await request.json()
         command = data.get('command', '')
         
         if not command:
             return JSONResponse({'error': 'No command provided'})
         
-        # Security: block some dangerous commands
-        dangerous_commands = ['rm -rf', 'sudo rm', 'mkfs', 'dd if=', 'shutdown', 'reboot']
-        if any(dangerous in command.lower() for dangerous in dangerous_commands):
+        with tracing.span('policy'):
+            allowed = is_command_allowed(command)
+        if not allowed:
             return JSONResponse({'error': 'Command not allowed for security reasons'})
         
-        result = run_command(command)
-        return JSONResponse(result)
+        result = await run_command_async(
+            command,
+            timeout=data.get('timeout'),
+            command_id=data.get('command_id'),
+            user=request_user(request)
+        )
+        tracing.annotate(command_id=result.get('command_id'), returncode=result.get('returncode'),
+                         error=result.get('error'))
+        with tracing.span('serialize'):
+            return JSONResponse(result)
     
     except Exception as e:
+        tracing.error(e)
+        return JSONResponse({'error': str(e)})
+
+@app.post("/api/command/stream")
+async def stream_command_output(request: Request):
+    """Execute a shell command and stream its output as server-sent events"""
+    try:
+        with tracing.span('parse'):
+            data = await request.json()
+    except Exception as e:
+        tracing.error(e)
+        return JSONResponse({'error': str(e)})
+
+    command = data.get('command', '')
+    if not command:
+        return JSONResponse({'error': 'No command provided'})
+    with tracing.span('policy'):
+        allowed = is_command_allowed(command)
+    if not allowed:
+        return JSONResponse({'error': 'Command not allowed for security reasons'})
+
+    # Checked here: once the stream has started, errors can no longer be a JSON response
+    try:
+        timeout = resolve_timeout(data.get('timeout'))
+        max_bytes = data.get('max_bytes')
+        max_bytes = None if max_bytes is None else int(max_bytes)
+    except (TypeError, ValueError):
+        return JSONResponse({'error': 'timeout and max_bytes must be numbers'}, status_code=400)
+    if max_bytes is not None and max_bytes < 0:
+        return JSONResponse({'error': 'max_bytes must not be negative'}, status_code=400)
+
+    async def events():
+        async for event, payload in stream_command(
+            command,
+            timeout=timeout,
+            command_id=data.get('command_id'),
+            max_bytes=max_bytes,
+            user=request_user(request)
+        ):
+            if isinstance(payload, str):
+                payload = {'data': payload}
+            yield format_sse(event, payload)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.post("/api/command/{command_id}/cancel")
+async def cancel_running_command(command_id: str):
+    """Cancel a running command"""
+    if not cancel_command(command_id):
+        return JSONResponse({'error': 'Command not found'}, status_code=404)
+    return JSONResponse({'command_id': command_id, 'status': 'cancelling'})
+
+@app.post("/api/jobs")
+async def create_job(request: Request):
+    """Start a command as a managed background job"""
+    try:
+        data = await request.json()
+        command = data.get('command', '')
+
+        if not command:
+            return JSONResponse({'error': 'No command provided'})
+        if not is_command_allowed(command):
+            return JSONResponse({'error': 'Command not allowed for security reasons'})
+
+        job = await submit_job(command, name=data.get('name'), cwd=data.get('cwd'), user=request_user(request))
+        return JSONResponse(job_info(job))
+
+    except Exception as e:
+        tracing.error(e)
+        return JSONResponse({'error': str(e)})
+
+@app.get("/api/jobs")
+async def get_jobs():
+    """List background jobs"""
+    return JSONResponse({'jobs': list_jobs()})
+
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """Get the status of a background job"""
+    job = get_job(job_id)
+    if job is None:
+        return JSONResponse({'error': 'Job not found'}, status_code=404)
+    return JSONResponse(job_info(job))
+
+@app.get("/api/jobs/{job_id}/output")
+async def get_job_output(job_id: str, since: int = None, limit: int = 65536):
+    """Tail the spooled output of a background job"""
+    job = get_job(job_id)
+    if job is None:
+        return JSONResponse({'error': 'Job not found'}, status_code=404)
+    return JSONResponse(read_job_output(job, since=since, limit=max(1, min(limit, 1024 * 1024))))
+
+@app.post("/api/jobs/{job_id}/kill")
+async def kill_background_job(job_id: str):
+    """Stop a background job"""
+    job = await kill_job(job_id)
+    if job is None:
+        return JSONResponse({'error': 'Job not found'}, status_code=404)
+    return JSONResponse(job_info(job))
+
+@app.websocket("/ws/terminal")
+async def terminal_socket(websocket: WebSocket, session: str = None):
+    """Interactive shell on a pty; pass ?session=<id> to reattach"""
+    cwd = SANDBOX_HOME if SANDBOX_HOME.is_dir() else None
+    await terminal.serve(websocket, request_user(websocket), session, cwd=cwd)
+
+@app.get("/api/terminals")
+async def get_terminals():
+    """List open terminal sessions"""
+    return JSONResponse({'sessions': [terminal.session_info(s) for s in terminal.sessions.values()]})
+
+@app.post("/api/terminals/{session_id}/close")
+async def close_terminal(session_id: str):
+    """Close a terminal session and kill its processes"""
+    if not terminal.close_session(session_id):
+        return JSONResponse({'error': 'Session not found'}, status_code=404)
+    return JSONResponse({'session_id': session_id, 'status': 'closed'})
+
+def file_error(e):
+    """JSON error response for a failed file transfer"""
+    if isinstance(e, files.UploadOffsetError):
+        return JSONResponse({'error': str(e), 'received': e.received}, status_code=409)
+    if isinstance(e, (LookupError, FileNotFoundError)):
+        status_code = 404
+    elif isinstance(e, PermissionError):
+        status_code = 403
+    elif isinstance(e, (ValueError, IsADirectoryError, NotADirectoryError, ClientDisconnect)):
+        status_code = 400
+    else:
+        tracing.error(e)
+        status_code = 500
+    return JSONResponse({'error': str(e)}, status_code=status_code)
+
+@app.get("/api/files")
+async def get_volumes():
+    """Volumes from sandbox.yml that files can be moved in and out of"""
+    return JSONResponse({'volumes': files.list_volumes()})
+
+@app.api_route("/api/files/{volume}/{path:path}", methods=["GET", "HEAD"])
+async def download_file(volume: str, path: str, request: Request, archive: str = None):
+    """Download a file (Range/resume supported), list a directory, or stream it with ?archive=tar|zip"""
+    try:
+        if archive:
+            return files.archive(volume, path, archive)
+        if files.resolve(volume, path).is_dir():
+            return JSONResponse(await asyncio.to_thread(files.list_directory, volume, path))
+        return files.download(volume, path, request.headers)
+    except Exception as e:
+        return file_error(e)
+
+@app.put("/api/files/{volume}/{path:path}")
+async def upload_file(volume: str, path: str, request: Request):
+    """Stream the request body to a file; send Content-Range to upload in resumable chunks"""
+    try:
+        result = await files.upload(volume, path, request.stream(), request.headers.get('content-range'))
+    except Exception as e:
+        return file_error(e)
+    return JSONResponse(result, status_code=201 if result['complete'] else 200)
+
+@app.get("/api/snapshots")
+async def get_snapshots(volume: str = None):
+    """Snapshots, oldest first, and how much the shared object store holds"""
+    return JSONResponse({
+        'snapshots': await asyncio.to_thread(snapshots.list_snapshots, volume),
+        'store': await asyncio.to_thread(snapshots.stats)
+    })
+
+@app.post("/api/snapshots")
+async def create_snapshot(request: Request):
+    """Snapshot a volume (projects by default); only changed files are read"""
+    data = await request.json() if await request.body() else {}
+    try:
+        summary = await asyncio.to_thread(snapshots.take, data.get('volume', 'projects'), data.get('name'))
+    except Exception as e:
+        return file_error(e)
+    return JSONResponse(summary)
+
+@app.post("/api/snapshots/{snapshot_id}/restore")
+async def restore_snapshot(snapshot_id: str):
+    """Bring the snapshot's volume back to the snapshot, rewriting only what differs"""
+    try:
+        return JSONResponse(await asyncio.to_thread(snapshots.restore, snapshot_id))
+    except Exception as e:
+        return file_error(e)
+
+@app.delete("/api/snapshots/{snapshot_id}")
+async def delete_snapshot(snapshot_id: str):
+    """Drop a snapshot and the stored files no other snapshot uses"""
+    try:
+        return JSONResponse(await asyncio.to_thread(snapshots.delete, snapshot_id))
+    except LookupError as e:
+        return JSONResponse({'error': str(e)}, status_code=404)
+
+@app.get("/api/proxy")
+async def get_proxy():
+    """Proxied ports and their upstream connection pools"""
+    return JSONResponse({'ports': sorted(proxy.ports), 'pools': proxy.stats()})
+
+@app.api_route("/proxy/{port}/{path:path}", methods=["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"])
+async def proxy_request(port: int, path: str, request: Request):
+    """Forward a request to a service on a port declared in sandbox.yml"""
+    try:
+        return await proxy.forward(request, port)
+    except LookupError as e:
+        return JSONResponse({'error': str(e)}, status_code=404)
+    except ConnectionRefusedError:
+        return JSONResponse({'error': f'Nothing is listening on port {port}'}, status_code=502)
+    except asyncio.TimeoutError:
+        return JSONResponse({'error': f'Port {port} did not answer in time'}, status_code=504)
+    except OSError as e:
+        tracing.error(e)
+        return JSONResponse({'error': f'Proxy to port {port} failed: {e}'}, status_code=502)
+
+@app.api_route("/proxy/{port}", methods=["GET", "HEAD"])
+async def proxy_root(port: int, request: Request):
+    """Relative links in the proxied app only resolve below the trailing slash"""
+    query = f"?{request.url.query}" if request.url.query else ""
+    return RedirectResponse(f"/proxy/{port}/{query}", status_code=308)
+
+@app.websocket("/proxy/{port}/{path:path}")
+async def proxy_socket(websocket: WebSocket, port: int, path: str):
+    """WebSocket passthrough, e.g. for Jupyter kernels"""
+    await proxy.relay_websocket(websocket, port)
+
+@app.get("/pkg/pypi/simple/", response_class=HTMLResponse)
+async def pypi_simple_root():
+    """PEP 503 index of the projects in the package cache"""
+    return HTMLResponse(pkgcache.simple_root_page())
+
+@app.get("/pkg/pypi/simple/{project}/", response_class=HTMLResponse)
+async def pypi_simple_project(project: str):
+    """PEP 503 project page: cached files plus upstream ones when online"""
+    normalized = pkgcache.normalize(project)
+    dists = await pkgcache.python_files(normalized)
+    if not dists:
+        return JSONResponse({'error': f'No files for {project}'}, status_code=404)
+    return HTMLResponse(pkgcache.simple_project_page(normalized, dists))
+
+@app.get("/pkg/pypi/files/{project}/{filename}")
+async def pypi_file(project: str, filename: str):
+    """A wheel or sdist from the cache, fetched from upstream on a miss"""
+    try:
+        path = await pkgcache.python_file(project, filename)
+    except (OSError, ValueError) as e:
+        return JSONResponse({'error': str(e)}, status_code=502)
+    if path is None:
+        return JSONResponse({'error': f'{filename} is not available'}, status_code=404)
+    return FileResponse(path, filename=filename, headers={'Cache-Control': assets.IMMUTABLE})
+
+@app.get("/pkg/npm/{name:path}/-/{filename}")
+async def npm_tarball(name: str, filename: str):
+    """A package tarball from the cache, fetched from the registry on a miss"""
+    try:
+        path = await pkgcache.npm_tarball(name, filename)
+    except (OSError, ValueError) as e:
+        return JSONResponse({'error': str(e)}, status_code=502)
+    if path is None:
+        return JSONResponse({'error': f'{filename} is not available'}, status_code=404)
+    return FileResponse(path, media_type="application/octet-stream", headers={'Cache-Control': assets.IMMUTABLE})
+
+@app.get("/pkg/npm/{name:path}")
+async def npm_packument(name: str, request: Request):
+    """npm registry document with tarball URLs pointing at the cache"""
+    packument = await pkgcache.npm_packument(name, str(request.base_url).rstrip('/'))
+    if packument is None:
+        return JSONResponse({'error': 'Not found'}, status_code=404)
+    return JSONResponse(packument)
+
+@app.get("/api/packages")
+async def get_package_cache():
+    """Size of the package cache, its upstream URLs and downloads in flight"""
+    return JSONResponse(await asyncio.to_thread(pkgcache.stats))
+
+@app.post("/api/packages/install")
+async def prepare_package_install(request: Request):
+    """Put wheels for a pip spec into the shared cache and return the install command
+
+    Concurrent requests for the same spec wait on one download/build.
+    """
+    data = await request.json()
+    try:
+        result = await pkgcache.build_wheels(data.get('package', ''))
+        command = pkgcache.pip_install_command(data.get('package', ''))
+    except ValueError as e:
         return JSONResponse({'error': str(e)})
+    return JSONResponse({**result, 'command': command})
 
 @app.post("/api/start-jupyter")
 async def start_jupyter():
     """Start Jupyter Lab service"""
     try:
-        # Check if Jupyter is already running
-        check_cmd = "pgrep -f 'jupyter-lab'"
-        check_result = run_command(check_cmd)
-        
-        if check_result.get('returncode') == 0:
+        if 'jupyter' not in supervisor.supervised:
+            return JSONResponse({
+                'status': 'error',
+                'message': 'Jupyter Lab is not configured in sandbox.yml'
+            })
+
+        result = await service_action('jupyter', 'start')
+        if 'error' in result:
+            return JSONResponse({'status': 'error', 'message': result['error']})
+        if not result['changed']:
             return JSONResponse({
                 'status': 'already_running',
-                'message': 'Jupyter Lab is already running on port 8888'
+                'message': 'Jupyter Lab is already running on port 8888, open /proxy/8888/'
             })
         
-        # Start Jupyter Lab in background
-        jupyter_cmd = "cd /home/sandbox && nohup jupyter lab --ip=0.0.0.0 --port=8888 --no-browser --allow-root > jupyter.log 2>&1 &"
-        result = run_command(jupyter_cmd)
-        
         return JSONResponse({
             'status': 'started',
-            'message': 'Jupyter Lab started on port 8888'
+            'message': 'Jupyter Lab started on port 8888, open /proxy/8888/'
         })
     
     except Exception as e:
+        tracing.error(e)
         return JSONResponse({
             'status': 'error',
             'message': f'Failed to start Jupyter: {str(e)}'
         })
 
+@app.get("/api/services")
+async def get_services():
+    """List supervised services and the cold start timing"""
+    if store.is_leader():
+        return JSONResponse({
+            'services': [supervisor.service_info(service) for service in supervisor.supervised.values()],
+            'boot': supervisor.boot
+        })
+    return JSONResponse({'services': store.list_services(), 'boot': store.get_value('boot', supervisor.boot)})
+
+@app.post("/api/services/{name}/{action}")
+async def control_service(name: str, action: str):
+    """Start, stop or restart a supervised service"""
+    if name not in supervisor.supervised:
+        return JSONResponse({'error': 'Service not found'}, status_code=404)
+
+    if action not in ('start', 'stop', 'restart'):
+        return JSONResponse({'error': f'Unknown action: {action}'}, status_code=400)
+
+    result = await service_action(name, action)
+    if 'error' in result:
+        return JSONResponse({'error': result['error']}, status_code=503)
+    return JSONResponse(result['service'])
+
 @app.get("/api/status")
-async def get_status():
+async def get_status(request: Request):
     """Get sandbox status"""
-    status = {
-        'sandbox': 'running',
-        'python': 'available',
-        'nodejs': 'available',
-        'git': 'available',
-        'ports': {
-            '8000': 'active',
-            '8888': 'inactive',
-            '3000': 'inactive'
-        }
-    }
-    
-    # Check if services are running
-    jupyter_check = run_command("pgrep -f 'jupyter-lab'")
-    if jupyter_check.get('returncode') == 0:
-        status['ports']['8888'] = 'active'
-    
-    return JSONResponse(status)
+    # Served from the snapshot maintained by status.watch_ports and the supervisor
+    headers = {'ETag': status.snapshot['etag'], 'Cache-Control': 'no-cache'}
+    if status.etag_matches(request.headers.get('if-none-match')):
+        return Response(status_code=304, headers=headers)
+    return Response(status.snapshot['body'], media_type="application/json", headers=headers)
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Latest resource sample with per-command and per-user accounting"""
+    load_shared_metrics()
+    owners = list(metrics.owners.values())
+    return JSONResponse({
+        'limits': metrics.limits,
+        'latest': metrics.history[-1] if metrics.history else None,
+        'owners': owners,
+        'users': metrics.per_user(owners),
+        'command_limits': limits.command_limits,
+        'scheduler': get_command_slots().stats(),
+        'python_pool': executor.python_pool.stats() if executor.python_pool else None
+    })
+
+@app.get("/api/metrics/history")
+async def get_metrics_history(limit: int = 60):
+    """Recent resource samples from the ring buffer"""
+    load_shared_metrics()
+    samples = list(metrics.history)[-max(1, limit):]
+    return JSONResponse({'interval': metrics.SAMPLE_INTERVAL, 'samples': samples})
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus scrape endpoint"""
+    load_shared_metrics()
+    return PlainTextResponse(metrics.prometheus() + tracing.prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/policy")
+async def get_command_policy():
+    """Command rule counts and decision cache statistics"""
+    return JSONResponse(policy.get_policy().stats())
+
+@app.get("/api/traces")
+async def get_traces(limit: int = 50, route: str = None, errors: bool = False):
+    """Recent request traces of this worker, newest first"""
+    return JSONResponse({'traces': tracing.recent(max(1, limit), route, errors)})
+
+@app.get("/api/traces/latency")
+async def get_latency():
+    """Latency percentiles per endpoint"""
+    return JSONResponse({'window': tracing.LATENCY_WINDOW, 'endpoints': tracing.latency()})
+
+@app.on_event("startup")
+async def on_startup():
+    """Register services from sandbox.yml and start the auto_start ones"""
+    started = time.time()
+    if not sandbox_config:
+        load_sandbox_config()
+    with boot.phase('server.assets'):
+        assets.build()
+    supervisor.configure(sandbox_config.get('sandbox'))
+    status.configure(sandbox_config.get('sandbox'), server_port=PORT)
+    pkgcache.configure(PORT)
+    supervisor.state_listeners.append(status.on_service_state)
+    for name, service in supervisor.supervised.items():
+        status.on_service_state(name, service)
+    background_tasks.append(asyncio.create_task(status.watch_ports()))
+    background_tasks.append(asyncio.create_task(terminal.reap_idle_sessions()))
+    metrics.configure(sandbox_config.get('sandbox'))
+    limits.configure(sandbox_config.get('sandbox'))
+    policy.configure(sandbox_config.get('sandbox'))
+    files.configure(sandbox_config.get('sandbox'))
+    proxy.configure(sandbox_config.get('sandbox'), server_port=PORT)
+    snapshots.configure(sandbox_config.get('sandbox'))
+    if pyworkers.POOL_SIZE > 0:
+        executor.python_pool = pyworkers.PythonWorkerPool()
+        deferred_startup.append(asyncio.create_task(executor.python_pool.start()))
+    deferred_startup.append(asyncio.create_task(asyncio.to_thread(pkgcache.seed)))
+
+    # With several workers exactly one runs the supervisor and the sampler
+    if store.try_lead():
+        lead()
+    else:
+        background_tasks.append(asyncio.create_task(follow_leader()))
+
+    # Worker pool and auto-started services come up after requests are served
+    asyncio.create_task(finish_startup())
+    boot.record('server.startup', started)
+    boot.stop_early_listener()
+
+async def finish_startup():
+    """Wait for the deferred startup work and record it on the timeline"""
+    started = time.time()
+    await asyncio.gather(*deferred_startup, return_exceptions=True)
+    boot.record('server.deferred', started)
+    boot.mark_ready()
+    print(f"✅ Startup finished in {boot.report()['ready_after']:.2f}s")
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """Stop background jobs and services so they do not outlive the server"""
+    for task in background_tasks:
+        task.cancel()
+    terminal.shutdown_sessions()
+    await asyncio.gather(shutdown_jobs(), supervisor.shutdown_services())
+    if executor.python_pool:
+        executor.python_pool.shutdown()
+    await proxy.close()
 
 @app.get("/health")
 async def health_check():
@@ -533,31 +700,59 @@ async def health_check():
     return JSONResponse({
         'status': 'healthy',
         'message': 'Ubuntu Sandbox is running',
+        'ready': boot.ready_at is not None,
         'timestamp': time.time()
     })
 
+@app.get("/api/startup-timeline")
+async def startup_timeline():
+    """How long each startup phase took, init.sh steps included"""
+    return JSONResponse(boot.report())
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ubuntu Sandbox server")
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help="server processes sharing state through SQLite (SANDBOX_WORKERS)")
+    parser.add_argument('--port', type=int, default=PORT, help="port to listen on (SANDBOX_PORT)")
+    return parser.parse_args()
+
 def main():
     """Main application entry point"""
+    global PORT
+    args = parse_args()
+    PORT = args.port
     print("🐧 Starting Ubuntu Sandbox...")
     
-    # Load configuration
-    load_sandbox_config()
-    
-    # Create necessary directories
-    os.makedirs("/home/sandbox/projects", exist_ok=True)
-    os.makedirs("/home/sandbox/tools", exist_ok=True)
+    with boot.phase('server.config'):
+        # Load configuration
+        load_sandbox_config()
+
+        # Jobs and services from a previous run are gone
+        store.reset()
+
+        # Create necessary directories
+        os.makedirs(SANDBOX_HOME / "projects", exist_ok=True)
+        os.makedirs(SANDBOX_HOME / "tools", exist_ok=True)
     
-    print(f"✅ Sandbox server starting on port 8000")
+    print(f"✅ Sandbox server starting on port {args.port}")
     print(f"🌐 Open your browser to access the sandbox interface")
     print(f"📝 API documentation available at /docs")
     
-    # Start the server
-    uvicorn.run(
-        app,
-        host="0.0.0.0",
-        port=8000,
-        log_level="info"
-    )
+    # Start the server on the socket bound before the imports, if any
+    sock = boot.early_socket()
+    if args.workers > 1:
+        # Workers import the app themselves and read their settings from the environment
+        os.environ["SANDBOX_WORKERS"] = str(args.workers)
+        os.environ["SANDBOX_PORT"] = str(args.port)
+        print(f"⚙️ Running {args.workers} workers")
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        config = uvicorn.Config("startup:app", host="0.0.0.0", port=args.port, log_level="info",
+                                workers=args.workers)
+        boot.stop_early_listener()
+        Multiprocess(config, target=uvicorn.Server(config).run, sockets=[sock or config.bind_socket()]).run()
+    else:
+        config = uvicorn.Config(app, host="0.0.0.0", port=args.port, log_level="info")
+        uvicorn.Server(config).run(sockets=[sock] if sock else None)
 
 if __name__ == "__main__":
     main()
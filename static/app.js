@@ -0,0 +1,264 @@
+function appendOutput(text) {
+    const output = document.getElementById('command-output');
+    output.textContent += '\n' + text;
+    output.scrollTop = output.scrollHeight;
+}
+
+function appendRaw(text) {
+    const output = document.getElementById('command-output');
+    output.textContent += text;
+    output.scrollTop = output.scrollHeight;
+}
+
+function handleStreamEvent(event, payload) {
+    if (event === 'stdout' || event === 'stderr') {
+        appendRaw(payload.data);
+    } else if (event === 'start') {
+        appendRaw('\n');
+    } else if (event === 'exit' && payload.returncode !== 0) {
+        appendOutput('[exit ' + payload.returncode + ']');
+    } else if (event === 'truncated') {
+        appendOutput('[output truncated after ' + payload.bytes + ' bytes]');
+    } else if (event === 'error') {
+        appendOutput('ERROR: ' + payload.error);
+    }
+}
+
+async function streamCommand(cmd) {
+    const response = await fetch('/api/command/stream', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ command: cmd })
+    });
+    if (!response.headers.get('Content-Type').startsWith('text/event-stream')) {
+        const data = await response.json();
+        if (data.error) appendOutput('ERROR: ' + data.error);
+        return;
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const frame = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            let event = 'message', data = '';
+            for (const line of frame.split('\n')) {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            }
+            handleStreamEvent(event, JSON.parse(data));
+        }
+    }
+}
+
+function runCommand() {
+    const input = document.getElementById('command');
+    const command = input.value.trim();
+    if (!command) return;
+
+    input.value = '';
+    runSpecificCommand(command);
+}
+
+function setBadge(id, active) {
+    const badge = document.getElementById(id);
+    badge.textContent = active ? 'Running' : 'Stopped';
+    badge.className = 'status-badge ' + (active ? 'status-running' : 'status-stopped');
+}
+
+function refreshStatus() {
+    // The browser revalidates with If-None-Match, unchanged status costs a 304
+    fetch('/api/status')
+    .then(response => response.json())
+    .then(data => {
+        setBadge('jupyter-status', data.ports['8888'] === 'active');
+        setBadge('dev-status', data.ports['3000'] === 'active');
+    })
+    .catch(() => {});
+}
+
+refreshStatus();
+setInterval(refreshStatus, 5000);
+
+function handleEnter(event) {
+    if (event.key === 'Enter') {
+        runCommand();
+    }
+}
+
+function getSystemInfo() {
+    runSpecificCommand('uname -a && python3 --version && node --version && df -h');
+}
+
+function listProjects() {
+    runSpecificCommand('ls -la /app/projects/');
+}
+
+function checkPorts() {
+    runSpecificCommand('netstat -tuln | grep -E ":(8000|8888|3000)"');
+}
+
+function startJupyter() {
+    appendOutput('$ Starting Jupyter Lab...');
+    fetch('/api/start-jupyter', { method: 'POST' })
+    .then(response => response.json())
+    .then(data => {
+        appendOutput(data.message);
+        if (data.status === 'started') {
+            document.getElementById('jupyter-status').textContent = 'Running';
+            document.getElementById('jupyter-status').className = 'status-badge status-running';
+        }
+    });
+}
+
+function runSampleApp() {
+    appendOutput('$ Starting sample Python app...');
+    startJob('sample-app', 'cd /app/projects/sample-project && python3 app.py');
+}
+
+function runNodeServer() {
+    appendOutput('$ Starting Node.js server...');
+    startJob('node-server', 'cd /app/projects/sample-project && node server.js');
+}
+
+function startJob(name, cmd) {
+    fetch('/api/jobs', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ command: cmd, name: name })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.error) appendOutput('ERROR: ' + data.error);
+        else appendOutput('Started job ' + data.job_id + ' (pid ' + data.pid + ')');
+    })
+    .catch(error => appendOutput('Network error: ' + error));
+}
+
+function listJobs() {
+    fetch('/api/jobs')
+    .then(response => response.json())
+    .then(data => {
+        if (!data.jobs.length) {
+            appendOutput('No background jobs');
+            return;
+        }
+        for (const job of data.jobs) {
+            appendOutput(job.job_id + '  ' + job.status.padEnd(8) + '  ' + job.name + '  ' + job.command);
+        }
+    })
+    .catch(error => appendOutput('Network error: ' + error));
+}
+
+function runDataAnalysis() {
+    appendOutput('$ Running data analysis script...');
+    runSpecificCommand('python3 /app/projects/data-analysis-project/analyze_data.py');
+}
+
+function installPackage() {
+    const pkg = prompt('Enter package name to install (pip3 install [package]):');
+    if (!pkg) {
+        return;
+    }
+    // Wheels are fetched or built once into the shared cache, then installed from it
+    appendOutput('$ Preparing ' + pkg + ' in the package cache...');
+    fetch('/api/packages/install', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({package: pkg})
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.error) {
+            appendOutput('Error: ' + data.error);
+            return;
+        }
+        if (data.returncode !== 0) {
+            appendOutput(data.output);
+        }
+        runSpecificCommand(data.command);
+    })
+    .catch(error => appendOutput('Network error: ' + error));
+}
+
+function runSpecificCommand(cmd) {
+    appendOutput('$ ' + cmd);
+    streamCommand(cmd).catch(error => appendOutput('Network error: ' + error));
+}
+
+let shell = null;
+
+function openTerminal() {
+    // One pty-backed bash per browser tab; reconnects reattach to it
+    const section = document.getElementById('shell-section');
+    section.hidden = false;
+    if (shell) {
+        if (shell.ended) connectTerminal();
+        shell.term.focus();
+        return;
+    }
+    if (typeof Terminal === 'undefined') {
+        appendOutput('ERROR: terminal library failed to load');
+        return;
+    }
+
+    const term = new Terminal({ cursorBlink: true, fontFamily: "'Courier New', monospace", fontSize: 14 });
+    const fit = new FitAddon.FitAddon();
+    term.loadAddon(fit);
+    term.open(document.getElementById('shell'));
+    fit.fit();
+    shell = { term: term, fit: fit, socket: null, ended: false };
+
+    term.onData(data => send({ type: 'input', data: data }));
+    term.onResize(size => send({ type: 'resize', cols: size.cols, rows: size.rows }));
+    window.addEventListener('resize', () => fit.fit());
+    connectTerminal();
+    term.focus();
+}
+
+function send(message) {
+    if (shell.socket && shell.socket.readyState === WebSocket.OPEN) {
+        shell.socket.send(JSON.stringify(message));
+    }
+}
+
+function connectTerminal() {
+    const scheme = location.protocol === 'https:' ? 'wss://' : 'ws://';
+    const previous = sessionStorage.getItem('terminal-session');
+    const url = scheme + location.host + '/ws/terminal' + (previous ? '?session=' + previous : '');
+    const socket = new WebSocket(url);
+    socket.binaryType = 'arraybuffer';
+    shell.socket = socket;
+    shell.ended = false;
+
+    socket.onopen = () => send({ type: 'resize', cols: shell.term.cols, rows: shell.term.rows });
+    socket.onmessage = event => {
+        if (typeof event.data !== 'string') {
+            shell.term.write(new Uint8Array(event.data));
+            return;
+        }
+        const message = JSON.parse(event.data);
+        if (message.type === 'session') {
+            if (message.session_id !== previous) shell.term.reset();
+            sessionStorage.setItem('terminal-session', message.session_id);
+            document.getElementById('shell-title').textContent = 'bash (' + message.session_id + ')';
+        } else if (message.type === 'exit') {
+            sessionStorage.removeItem('terminal-session');
+            shell.ended = true;
+            shell.term.write('\r\n[session closed, Open Terminal starts a new one]\r\n');
+        } else if (message.type === 'error') {
+            shell.ended = true;
+            shell.term.write('\r\nERROR: ' + message.error + '\r\n');
+        }
+    };
+    socket.onclose = event => {
+        // Reattach after network blips
+        if (!shell.ended) setTimeout(connectTerminal, 2000);
+    };
+}
@@ -0,0 +1,98 @@
+"""
+Sandbox status snapshot
+Kept up to date by a background watcher so /api/status is served from memory
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+
+from supervisor import probe_port
+
+# Seconds between socket probes of the configured ports
+PROBE_INTERVAL = float(os.environ.get("SANDBOX_STATUS_PROBE_INTERVAL", "5"))
+
+# Port the sandbox server itself listens on
+SERVER_PORT = 8000
+
+# Current status document plus its pre-encoded body and ETag
+snapshot = {'data': {}, 'body': b'{}', 'etag': '""'}
+
+_ports = []
+
+def _tool_status(command):
+    return 'available' if shutil.which(command) else 'missing'
+
+def configure(config, server_port=SERVER_PORT):
+    """Build the initial snapshot from a parsed sandbox.yml"""
+    global SERVER_PORT
+    SERVER_PORT = server_port
+
+    config = config or {}
+    _ports[:] = sorted({
+        int(entry['port'])
+        for entry in (config.get('network') or {}).get('ports') or []
+        if entry.get('port')
+    } | {server_port})
+
+    snapshot['data'] = {
+        'sandbox': 'running',
+        'python': _tool_status('python3'),
+        'nodejs': _tool_status('node'),
+        'git': _tool_status('git'),
+        'ports': {str(port): 'active' if port == server_port else 'inactive' for port in _ports},
+        'services': {}
+    }
+    _publish()
+
+def _publish():
+    """Re-encode the snapshot and derive its ETag"""
+    body = json.dumps(snapshot['data'], sort_keys=True).encode()
+    snapshot['body'] = body
+    snapshot['etag'] = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+
+def set_port_state(port, active):
+    """Record whether a port is accepting connections"""
+    state = 'active' if active else 'inactive'
+    ports = snapshot['data'].get('ports', {})
+    if ports.get(str(port)) != state:
+        ports[str(port)] = state
+        _publish()
+
+def on_service_state(name, service):
+    """Supervisor listener, reflects service state changes immediately"""
+    data = snapshot['data']
+    services = data.setdefault('services', {})
+    changed = services.get(name) != service['state']
+    services[name] = service['state']
+
+    port = str(service['port'])
+    if service['port'] and service['port'] != SERVER_PORT and port in data.get('ports', {}):
+        state = data['ports'][port]
+        if service['state'] == 'ready':
+            state = 'active'
+        elif service['process'] is None:
+            state = 'inactive'
+        changed = changed or data['ports'][port] != state
+        data['ports'][port] = state
+
+    if changed:
+        _publish()
+
+def etag_matches(if_none_match):
+    """True if an If-None-Match header covers the current ETag"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or snapshot['etag'] in tags or f"W/{snapshot['etag']}" in tags
+
+async def watch_ports():
+    """Periodically probe the configured ports"""
+    while True:
+        others = [port for port in _ports if port != SERVER_PORT]
+        results = await asyncio.gather(*(probe_port(port) for port in others))
+        for port, active in zip(others, results):
+            set_port_state(port, active)
+        await asyncio.sleep(PROBE_INTERVAL)
@@ -0,0 +1,183 @@
+"""
+Shared server state
+SQLite (WAL mode) store that lets several uvicorn workers see the same jobs,
+service states and metrics, plus the file lock that elects the one worker
+allowed to run the supervisor
+"""
+
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+SANDBOX_HOME = Path(os.environ.get("SANDBOX_HOME", "/home/sandbox"))
+
+DB_PATH = Path(os.environ.get("SANDBOX_STATE_DB", str(SANDBOX_HOME / ".state" / "sandbox.db")))
+
+# Samples kept for /api/metrics/history in followers
+MAX_SAMPLES = int(os.environ.get("SANDBOX_METRICS_HISTORY", "300"))
+
+JOB_FIELDS = ('job_id', 'name', 'command', 'user', 'status', 'pid', 'returncode', 'started_at',
+              'finished_at', 'output_bytes', 'log_path', 'log_base', 'worker')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    name TEXT,
+    command TEXT,
+    user TEXT,
+    status TEXT,
+    pid INTEGER,
+    returncode INTEGER,
+    started_at REAL,
+    finished_at REAL,
+    output_bytes INTEGER,
+    log_path TEXT,
+    log_base INTEGER,
+    worker INTEGER
+);
+CREATE TABLE IF NOT EXISTS services (name TEXT PRIMARY KEY, info TEXT);
+CREATE TABLE IF NOT EXISTS actions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT,
+    action TEXT,
+    result TEXT,
+    created_at REAL
+);
+CREATE TABLE IF NOT EXISTS samples (id INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT);
+CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+_local = threading.local()
+
+# Held open by the leader; the kernel drops the lock if the worker dies
+_leader_lock = None
+
+def connect():
+    """Per-thread connection in autocommit mode"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+    return conn
+
+def reset():
+    """Forget state left by a previous server run"""
+    conn = connect()
+    for table in ('jobs', 'services', 'actions', 'samples', 'kv'):
+        conn.execute(f"DELETE FROM {table}")
+
+def try_lead():
+    """Take the leader lock if no other worker holds it"""
+    global _leader_lock
+    if _leader_lock is not None:
+        return True
+    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(str(DB_PATH) + ".leader", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    _leader_lock = fd
+    return True
+
+def is_leader():
+    return _leader_lock is not None
+
+# Jobs
+
+def _job_row(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job['log_path'] = Path(job['log_path'])
+    job['process'] = None
+    return job
+
+def put_job(job):
+    values = [str(job[field]) if field == 'log_path' else job[field] for field in JOB_FIELDS]
+    connect().execute(
+        f"INSERT OR REPLACE INTO jobs ({', '.join(JOB_FIELDS)}) VALUES ({', '.join('?' * len(JOB_FIELDS))})",
+        values
+    )
+
+def update_job(job_id, **fields):
+    assignments = ', '.join(f"{field} = ?" for field in fields)
+    connect().execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?", [*fields.values(), job_id])
+
+def get_job(job_id):
+    return _job_row(connect().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone())
+
+def list_jobs():
+    return [_job_row(row) for row in connect().execute("SELECT * FROM jobs ORDER BY started_at DESC")]
+
+def finished_jobs_beyond(keep):
+    """Finished jobs other than the `keep` most recent ones"""
+    rows = connect().execute(
+        "SELECT * FROM jobs WHERE finished_at IS NOT NULL ORDER BY finished_at DESC LIMIT -1 OFFSET ?", (keep,)
+    )
+    return [_job_row(row) for row in rows]
+
+def delete_job(job_id):
+    connect().execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+# Services
+
+def put_service(info):
+    connect().execute("INSERT OR REPLACE INTO services (name, info) VALUES (?, ?)", (info['name'], json.dumps(info)))
+
+def list_services():
+    return [json.loads(row['info']) for row in connect().execute("SELECT info FROM services ORDER BY name")]
+
+def get_service(name):
+    row = connect().execute("SELECT info FROM services WHERE name = ?", (name,)).fetchone()
+    return json.loads(row['info']) if row else None
+
+def request_action(name, action):
+    """Queue a service action for the leader, returning its id"""
+    cursor = connect().execute(
+        "INSERT INTO actions (name, action, created_at) VALUES (?, ?, ?)", (name, action, time.time())
+    )
+    return cursor.lastrowid
+
+def pending_actions():
+    return [dict(row) for row in connect().execute("SELECT id, name, action FROM actions WHERE result IS NULL ORDER BY id")]
+
+def finish_action(action_id, result):
+    connect().execute("UPDATE actions SET result = ? WHERE id = ?", (json.dumps(result), action_id))
+
+def action_result(action_id):
+    """Result of a finished action (removing it), or None while pending"""
+    conn = connect()
+    row = conn.execute("SELECT result FROM actions WHERE id = ?", (action_id,)).fetchone()
+    if row is None or row['result'] is None:
+        return None
+    conn.execute("DELETE FROM actions WHERE id = ?", (action_id,))
+    return json.loads(row['result'])
+
+# Metrics and other small documents
+
+def add_sample(sample):
+    conn = connect()
+    cursor = conn.execute("INSERT INTO samples (data) VALUES (?)", (json.dumps(sample),))
+    conn.execute("DELETE FROM samples WHERE id <= ?", (cursor.lastrowid - MAX_SAMPLES,))
+
+def recent_samples(limit=MAX_SAMPLES):
+    rows = connect().execute("SELECT data FROM samples ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+    return [json.loads(row['data']) for row in reversed(rows)]
+
+def put_value(key, value):
+    connect().execute("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+def get_value(key, default=None):
+    row = connect().execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+    return json.loads(row['value']) if row else default
@@ -0,0 +1,263 @@
+"""
+Service supervisor
+Starts the services declared in sandbox.yml `startup.services`, restarts
+them with backoff when they exit and probes their ports for readiness
+"""
+
+import asyncio
+import os
+import signal
+import time
+from pathlib import Path
+
+from executor import kill_process_group
+
+# Where service output is written
+LOG_DIR = Path(os.environ.get("SANDBOX_SERVICE_LOG_DIR", "/home/sandbox/logs"))
+SANDBOX_HOME = os.environ.get("SANDBOX_HOME", "/home/sandbox")
+
+# Restart backoff, reset once a service stays up for STABLE_SECONDS
+RESTART_BACKOFF_INITIAL = 1.0
+RESTART_BACKOFF_MAX = 60.0
+STABLE_SECONDS = 30.0
+
+# Readiness probing
+READY_TIMEOUT = float(os.environ.get("SANDBOX_SERVICE_READY_TIMEOUT", "120"))
+PROBE_INTERVAL = 0.1
+
+# Seconds between SIGTERM and SIGKILL when stopping a service
+STOP_GRACE_SECONDS = 5.0
+
+# Used when sandbox.yml does not declare any services
+DEFAULT_SERVICES = [
+    {
+        'name': 'jupyter',
+        'command': 'jupyter lab --ip=0.0.0.0 --port=8888 --no-browser --allow-root',
+        'auto_start': False
+    }
+]
+
+# Supervised services keyed by name
+supervised = {}
+
+# Cold start bookkeeping for auto_start services
+boot = {'started_at': None, 'ready_at': None, 'cold_start_seconds': None}
+
+# Callbacks invoked as listener(name, service) whenever a service changes state
+state_listeners = []
+
+def parse_services(config):
+    """Build service definitions from a parsed sandbox.yml"""
+    config = config or {}
+    ports = {
+        entry.get('name'): entry.get('port')
+        for entry in (config.get('network') or {}).get('ports') or []
+    }
+    env = {key: str(value) for key, value in (config.get('env_vars') or {}).items()}
+    entries = (config.get('startup') or {}).get('services') or DEFAULT_SERVICES
+
+    definitions = {}
+    for entry in entries:
+        name = entry.get('name')
+        command = entry.get('command')
+        if not name or not command:
+            continue
+        definitions[name] = {
+            'name': name,
+            'command': command,
+            'auto_start': bool(entry.get('auto_start', False)),
+            'restart': bool(entry.get('restart', True)),
+            'port': entry.get('port', ports.get(name)),
+            'cwd': entry.get('cwd', SANDBOX_HOME),
+            'env': env
+        }
+    return definitions
+
+def configure(config):
+    """Register the services declared in sandbox.yml"""
+    for name, definition in parse_services(config).items():
+        if name in supervised:
+            supervised[name].update(definition)
+            continue
+        supervised[name] = dict(
+            definition,
+            state='stopped',
+            desired=False,
+            pid=None,
+            restarts=0,
+            started_at=None,
+            ready_at=None,
+            last_exit=None,
+            process=None,
+            task=None,
+            ready=asyncio.Event()
+        )
+
+def service_info(service):
+    """Public view of a service record"""
+    return {
+        'name': service['name'],
+        'command': service['command'],
+        'port': service['port'],
+        'auto_start': service['auto_start'],
+        'state': service['state'],
+        'pid': service['pid'],
+        'restarts': service['restarts'],
+        'started_at': service['started_at'],
+        'ready_at': service['ready_at'],
+        'last_exit': service['last_exit']
+    }
+
+def is_running(name):
+    """True if the service has a live process"""
+    service = supervised.get(name)
+    return service is not None and service['process'] is not None
+
+def _set_state(service, state):
+    service['state'] = state
+    for listener in state_listeners:
+        listener(service['name'], service)
+
+async def probe_port(port, host="127.0.0.1", timeout=0.5):
+    """Return True if something accepts TCP connections on the port"""
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return True
+
+async def _wait_ready(service, started):
+    """Mark a service ready once its port accepts connections"""
+    if service['port']:
+        deadline = time.monotonic() + READY_TIMEOUT
+        while not await probe_port(service['port']):
+            if time.monotonic() > deadline:
+                print(f"⚠️ Service {service['name']} not listening on port {service['port']} after {READY_TIMEOUT:.0f}s")
+                return
+            await asyncio.sleep(PROBE_INTERVAL)
+    service['ready_at'] = time.time()
+    _set_state(service, 'ready')
+    service['ready'].set()
+    print(f"✅ Service {service['name']} ready in {time.monotonic() - started:.2f}s")
+
+async def _spawn(service):
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+    with open(LOG_DIR / f"{service['name']}.log", 'ab') as log:
+        return await asyncio.create_subprocess_shell(
+            service['command'],
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=log,
+            stderr=asyncio.subprocess.STDOUT,
+            cwd=service['cwd'] if os.path.isdir(service['cwd']) else None,
+            env=dict(os.environ, **service['env']),
+            start_new_session=True
+        )
+
+async def _supervise(service):
+    """Run a service, restarting it with exponential backoff when it exits"""
+    backoff = RESTART_BACKOFF_INITIAL
+    try:
+        while service['desired']:
+            started = time.monotonic()
+            service['ready'].clear()
+            service['ready_at'] = None
+            try:
+                process = await _spawn(service)
+            except Exception as e:
+                print(f"❌ Failed to start service {service['name']}: {e}")
+                service['last_exit'] = {'error': str(e), 'at': time.time()}
+                _set_state(service, 'failed')
+                return
+
+            service['process'] = process
+            service['pid'] = process.pid
+            service['started_at'] = time.time()
+            _set_state(service, 'starting')
+            readiness = asyncio.create_task(_wait_ready(service, started))
+
+            # asyncio's child watcher reaps the process for us, no polling needed
+            try:
+                returncode = await process.wait()
+            finally:
+                readiness.cancel()
+            service['process'] = None
+            service['pid'] = None
+            service['last_exit'] = {'returncode': returncode, 'at': time.time()}
+
+            if not service['desired'] or not service['restart']:
+                break
+            if time.monotonic() - started >= STABLE_SECONDS:
+                backoff = RESTART_BACKOFF_INITIAL
+            service['restarts'] += 1
+            _set_state(service, 'backoff')
+            print(f"⚠️ Service {service['name']} exited with {returncode}, restarting in {backoff:.0f}s")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, RESTART_BACKOFF_MAX)
+    finally:
+        service['desired'] = False
+        if service['state'] != 'failed':
+            _set_state(service, 'stopped')
+
+async def start_service(name):
+    """Start a service, returns False if it is already running"""
+    service = supervised[name]
+    if service['desired']:
+        return False
+    service['desired'] = True
+    _set_state(service, 'starting')
+    service['task'] = asyncio.create_task(_supervise(service))
+    return True
+
+async def stop_service(name):
+    """Stop a service and wait for it to exit"""
+    service = supervised[name]
+    service['desired'] = False
+    task = service['task']
+    if task is None or task.done():
+        return
+    if service['process'] is None:
+        # Waiting out a restart backoff, nothing to kill
+        task.cancel()
+    else:
+        kill_process_group(service['process'], signal.SIGTERM)
+    try:
+        await asyncio.wait_for(asyncio.shield(task), STOP_GRACE_SECONDS)
+    except asyncio.TimeoutError:
+        if service['process'] is not None:
+            kill_process_group(service['process'])
+        await task
+    except asyncio.CancelledError:
+        pass
+
+async def restart_service(name):
+    """Stop and start a service again"""
+    await stop_service(name)
+    return await start_service(name)
+
+async def start_auto_services():
+    """Start every auto_start service in parallel and time the cold start"""
+    names = [name for name, service in supervised.items() if service['auto_start']]
+    boot['started_at'] = time.time()
+    started = time.monotonic()
+    await asyncio.gather(*(start_service(name) for name in names))
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(*(supervised[name]['ready'].wait() for name in names)),
+            READY_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        pending = [name for name in names if not supervised[name]['ready'].is_set()]
+        print(f"⚠️ Services not ready after {READY_TIMEOUT:.0f}s: {', '.join(pending)}")
+        return
+    boot['cold_start_seconds'] = round(time.monotonic() - started, 3)
+    boot['ready_at'] = time.time()
+    print(f"✅ All services ready in {boot['cold_start_seconds']:.2f}s ({len(names)} auto-started)")
+
+async def shutdown_services():
+    """Stop every supervised service"""
+    await asyncio.gather(*(stop_service(name) for name in supervised))
@@ -0,0 +1,283 @@
+"""
+Interactive terminal sessions
+Long-lived shells on pseudo-terminals, attached to browser terminals over a
+WebSocket, so `cd`, exported variables and full-screen tools (htop, vim)
+behave as they would over ssh
+"""
+
+import asyncio
+import fcntl
+import functools
+import json
+import os
+import signal
+import struct
+import subprocess
+import termios
+import time
+import uuid
+
+import limits
+
+SHELL = os.environ.get("SANDBOX_TERMINAL_SHELL", "/bin/bash")
+
+# Session caps, overall and per user
+MAX_SESSIONS = int(os.environ.get("SANDBOX_MAX_TERMINALS", "8"))
+MAX_SESSIONS_PER_USER = int(os.environ.get("SANDBOX_MAX_TERMINALS_PER_USER", "2"))
+
+# Detached sessions are closed after this many idle seconds
+IDLE_TIMEOUT = float(os.environ.get("SANDBOX_TERMINAL_IDLE_TIMEOUT", "900"))
+REAP_INTERVAL = 30.0
+
+# Output kept per session and replayed when a browser reattaches
+SCROLLBACK_BYTES = 64 * 1024
+
+# Output frames queued per attached client before it is dropped as too slow
+CLIENT_QUEUE_SIZE = 256
+
+READ_CHUNK_SIZE = 65536
+
+# Sessions keyed by id
+sessions = {}
+
+def session_info(session):
+    """Public view of a session"""
+    return {
+        'session_id': session['session_id'],
+        'user': session['user'],
+        'pid': session['process'].pid,
+        'clients': len(session['clients']),
+        'created_at': session['created_at'],
+        'last_active': session['last_active'],
+        'cols': session['cols'],
+        'rows': session['rows']
+    }
+
+def _child_setup(limit_args):
+    """Make the pty the controlling terminal, then apply the command limits"""
+    fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+    limits.apply_limits(*limit_args)
+
+def _set_size(fd, cols, rows):
+    fcntl.ioctl(fd, termios.TIOCSWINSZ, struct.pack('HHHH', rows, cols, 0, 0))
+
+def open_session(user, cwd=None, cols=80, rows=24):
+    """Start a shell on a new pty, or return an error message if over the caps"""
+    if len(sessions) >= MAX_SESSIONS:
+        return None, 'Too many terminal sessions'
+    if sum(1 for s in sessions.values() if s['user'] == user) >= MAX_SESSIONS_PER_USER:
+        return None, f'At most {MAX_SESSIONS_PER_USER} terminal sessions per user'
+
+    session_id = uuid.uuid4().hex[:12]
+    master, slave = os.openpty()
+    _set_size(master, cols, rows)
+    env = dict(os.environ, TERM='xterm-256color', COLORTERM='truecolor', SANDBOX_TERMINAL=session_id)
+    try:
+        process = subprocess.Popen(
+            [SHELL, '-l'],
+            stdin=slave,
+            stdout=slave,
+            stderr=slave,
+            cwd=cwd,
+            env=env,
+            start_new_session=True,
+            preexec_fn=functools.partial(_child_setup, limits.limit_args(f"term-{session_id}", user))
+        )
+    finally:
+        os.close(slave)
+    os.set_blocking(master, False)
+
+    now = time.time()
+    session = {
+        'session_id': session_id,
+        'user': user,
+        'process': process,
+        'fd': master,
+        'clients': set(),
+        'scrollback': bytearray(),
+        'pending': bytearray(),
+        'created_at': now,
+        'last_active': now,
+        'cols': cols,
+        'rows': rows
+    }
+    sessions[session_id] = session
+    asyncio.get_running_loop().add_reader(master, _on_output, session)
+    return session, None
+
+def _hang_up(queue):
+    """Tell a client's sender to stop, discarding what it has not sent"""
+    while not queue.empty():
+        queue.get_nowait()
+    queue.put_nowait(None)
+
+def _broadcast(session, message):
+    for queue in list(session['clients']):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # A client that cannot keep up is detached; it can reattach and
+            # pick up from the scrollback
+            session['clients'].discard(queue)
+            _hang_up(queue)
+
+def _on_output(session):
+    try:
+        data = os.read(session['fd'], READ_CHUNK_SIZE)
+    except BlockingIOError:
+        return
+    except OSError:
+        data = b''
+    if not data:
+        # EIO once the shell and everything on the pty has exited
+        close_session(session['session_id'])
+        return
+    session['last_active'] = time.time()
+    scrollback = session['scrollback']
+    scrollback += data
+    if len(scrollback) > SCROLLBACK_BYTES:
+        del scrollback[:len(scrollback) - SCROLLBACK_BYTES]
+    _broadcast(session, data)
+
+def _flush_input(session):
+    pending = session['pending']
+    try:
+        written = os.write(session['fd'], pending)
+    except BlockingIOError:
+        written = 0
+    except OSError:
+        pending.clear()
+        written = 0
+    del pending[:written]
+    loop = asyncio.get_running_loop()
+    if pending:
+        loop.add_writer(session['fd'], _flush_input, session)
+    else:
+        loop.remove_writer(session['fd'])
+
+def write_input(session, data):
+    """Queue keystrokes for the shell without blocking on a full pty"""
+    session['last_active'] = time.time()
+    session['pending'] += data
+    _flush_input(session)
+
+def resize(session, cols, rows):
+    session['cols'], session['rows'] = cols, rows
+    _set_size(session['fd'], cols, rows)
+
+def close_session(session_id):
+    """Hang up a session and kill everything started from it"""
+    session = sessions.pop(session_id, None)
+    if session is None:
+        return False
+    loop = asyncio.get_running_loop()
+    loop.remove_reader(session['fd'])
+    loop.remove_writer(session['fd'])
+    os.close(session['fd'])
+    process = session['process']
+    for sig in (signal.SIGHUP, signal.SIGKILL):
+        try:
+            os.killpg(process.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+    # Reap without blocking the loop; the group was just SIGKILLed
+    loop.run_in_executor(None, process.wait)
+    limits.release(f"term-{session_id}", session['user'])
+    _broadcast(session, {'type': 'exit'})
+    for queue in session['clients']:
+        try:
+            queue.put_nowait(None)
+        except asyncio.QueueFull:
+            _hang_up(queue)
+    return True
+
+def attach(session):
+    """Register a client; returns its output queue, primed with the scrollback"""
+    queue = asyncio.Queue(CLIENT_QUEUE_SIZE)
+    if session['scrollback']:
+        queue.put_nowait(bytes(session['scrollback']))
+    session['clients'].add(queue)
+    return queue
+
+def detach(session, queue):
+    session['clients'].discard(queue)
+    session['last_active'] = time.time()
+
+async def reap_idle_sessions():
+    """Close detached sessions idle for longer than IDLE_TIMEOUT"""
+    while True:
+        await asyncio.sleep(REAP_INTERVAL)
+        now = time.time()
+        for session in list(sessions.values()):
+            if not session['clients'] and now - session['last_active'] > IDLE_TIMEOUT:
+                close_session(session['session_id'])
+
+def shutdown_sessions():
+    for session_id in list(sessions):
+        close_session(session_id)
+
+async def serve(websocket, user, session_id=None, cwd=None):
+    """Bridge one WebSocket to a session, creating the session if needed
+
+    Client frames are JSON text: {"type": "input", "data": "..."} or
+    {"type": "resize", "cols": 120, "rows": 40}. Terminal output is sent as
+    binary frames; control messages ({"type": "session" | "exit" | "error"})
+    as JSON text.
+    """
+    await websocket.accept()
+    session = sessions.get(session_id)
+    if session is not None and session['user'] != user:
+        session = None
+    if session is None:
+        session, error = open_session(user, cwd)
+        if session is None:
+            await websocket.send_text(json.dumps({'type': 'error', 'error': error}))
+            await websocket.close(code=1008)
+            return
+    await websocket.send_text(json.dumps({'type': 'session', **session_info(session)}))
+
+    queue = attach(session)
+
+    async def pump_output():
+        while True:
+            message = await queue.get()
+            if message is None:
+                return
+            if isinstance(message, bytes):
+                await websocket.send_bytes(message)
+            else:
+                await websocket.send_text(json.dumps(message))
+
+    sender = asyncio.create_task(pump_output())
+    try:
+        while not sender.done():
+            receive = asyncio.ensure_future(websocket.receive())
+            done, _ = await asyncio.wait({receive, sender}, return_when=asyncio.FIRST_COMPLETED)
+            if receive not in done:
+                receive.cancel()
+                break
+            frame = receive.result()
+            if frame['type'] == 'websocket.disconnect':
+                break
+            text = frame.get('text')
+            if text is None:
+                if frame.get('bytes') and session['session_id'] in sessions:
+                    write_input(session, frame['bytes'])
+                continue
+            try:
+                message = json.loads(text)
+            except ValueError:
+                continue
+            if session['session_id'] not in sessions:
+                break
+            if message.get('type') == 'input':
+                write_input(session, message.get('data', '').encode())
+            elif message.get('type') == 'resize':
+                resize(session, max(1, int(message.get('cols', 80))), max(1, int(message.get('rows', 24))))
+    finally:
+        detach(session, queue)
+        sender.cancel()
+        try:
+            await websocket.close()
+        except RuntimeError:
+            pass
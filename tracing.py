@@ -0,0 +1,230 @@
+"""
+Request tracing
+Per-request traces made of timed spans (JSON parsing, policy check, slot
+wait, spawn, run, serialization), kept in a ring buffer, with per-endpoint
+latency percentiles and optional export as JSON lines
+"""
+
+import contextvars
+import json
+import os
+import sys
+import time
+import traceback
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+# Finished traces kept for /api/traces
+TRACE_BUFFER = int(os.environ.get("SANDBOX_TRACE_BUFFER", "1000"))
+
+# Append every finished trace to this file as one JSON line, if set
+TRACE_FILE = os.environ.get("SANDBOX_TRACE_FILE")
+
+# Latencies per endpoint used for the percentiles
+LATENCY_WINDOW = 2048
+
+# Upper bounds (ms) of the Prometheus latency histogram buckets
+BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+traces = deque(maxlen=TRACE_BUFFER)
+
+# Latency statistics keyed by (method, route template)
+endpoints = {}
+
+# Route template per endpoint, filled in as requests come in
+_templates = {}
+
+_current = contextvars.ContextVar('trace', default=None)
+_export = {'file': None}
+
+def current():
+    """Trace of the request being handled, or None outside a request"""
+    return _current.get()
+
+def _offset_ms(trace, start):
+    return round((start - trace['_t0']) * 1000, 3)
+
+def record_span(name, start, **attrs):
+    """Add a span that began at perf_counter() value `start` and ends now"""
+    trace = _current.get()
+    if trace is None:
+        return
+    trace['spans'].append({
+        'name': name,
+        'offset_ms': _offset_ms(trace, start),
+        'duration_ms': round((time.perf_counter() - start) * 1000, 3),
+        **attrs
+    })
+
+@contextmanager
+def span(name, **attrs):
+    """Time a block; attributes can be added to the yielded dict"""
+    start = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        record_span(name, start, **attrs)
+
+def annotate(**attrs):
+    trace = _current.get()
+    if trace is not None:
+        trace['attrs'].update(attrs)
+
+def error(exc):
+    """Record and log an exception that is turned into an error response"""
+    trace = _current.get()
+    where = f"{trace['method']} {trace['path']}" if trace else "background task"
+    if trace is not None:
+        trace['error'] = f"{type(exc).__name__}: {exc}"
+    print(f"❌ {where} failed: {type(exc).__name__}: {exc}", file=sys.stderr)
+    traceback.print_exception(type(exc), exc, exc.__traceback__, file=sys.stderr)
+
+def _route_template(scope):
+    """Route path such as /api/jobs/{job_id}, so ids do not split the stats"""
+    endpoint = scope.get('endpoint')
+    app = scope.get('app')
+    if endpoint is None or app is None:
+        return '<unmatched>'
+    template = _templates.get(endpoint)
+    if template is None:
+        template = next((route.path for route in app.routes
+                         if getattr(route, 'endpoint', None) is endpoint or getattr(route, 'app', None) is endpoint),
+                        '<unmatched>')
+        _templates[endpoint] = template
+    return template
+
+def _stats(key):
+    stats = endpoints.get(key)
+    if stats is None:
+        stats = endpoints[key] = {
+            'count': 0,
+            'errors': 0,
+            'sum_ms': 0.0,
+            'buckets': [0] * (len(BUCKETS_MS) + 1),
+            'recent': deque(maxlen=LATENCY_WINDOW)
+        }
+    return stats
+
+def _finish(trace, scope):
+    trace['duration_ms'] = _offset_ms(trace, time.perf_counter())
+    trace['route'] = _route_template(scope)
+    del trace['_t0']
+
+    stats = _stats((trace['method'], trace['route']))
+    stats['count'] += 1
+    if trace['error'] or (trace['status'] or 500) >= 500:
+        stats['errors'] += 1
+    stats['sum_ms'] += trace['duration_ms']
+    bucket = next((i for i, bound in enumerate(BUCKETS_MS) if trace['duration_ms'] <= bound), len(BUCKETS_MS))
+    stats['buckets'][bucket] += 1
+    stats['recent'].append(trace['duration_ms'])
+
+    traces.append(trace)
+    if TRACE_FILE:
+        _write(trace)
+
+def _write(trace):
+    try:
+        if _export['file'] is None:
+            _export['file'] = open(TRACE_FILE, 'a', buffering=1)
+        _export['file'].write(json.dumps(trace) + '\n')
+    except OSError as e:
+        print(f"⚠️ Could not write trace to {TRACE_FILE}: {e}", file=sys.stderr)
+
+class TracingMiddleware:
+    """ASGI middleware that opens a trace for every HTTP request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        trace = {
+            'trace_id': uuid.uuid4().hex[:16],
+            'method': scope['method'],
+            'path': scope['path'],
+            'start': time.time(),
+            '_t0': time.perf_counter(),
+            'status': None,
+            'first_byte_ms': None,
+            'response_bytes': 0,
+            'error': None,
+            'attrs': {},
+            'spans': []
+        }
+        token = _current.set(trace)
+
+        async def traced_send(message):
+            if message['type'] == 'http.response.start':
+                trace['status'] = message['status']
+                trace['first_byte_ms'] = _offset_ms(trace, time.perf_counter())
+            elif message['type'] == 'http.response.body':
+                trace['response_bytes'] += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, traced_send)
+        except Exception as e:
+            trace['status'] = trace['status'] or 500
+            trace['error'] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current.reset(token)
+            _finish(trace, scope)
+
+def _percentile(ordered, q):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def latency():
+    """p50/p95/p99 per endpoint over the last LATENCY_WINDOW requests"""
+    summary = []
+    for (method, route), stats in sorted(endpoints.items(), key=lambda item: item[0][1]):
+        ordered = sorted(stats['recent'])
+        summary.append({
+            'method': method,
+            'route': route,
+            'count': stats['count'],
+            'errors': stats['errors'],
+            'mean_ms': round(stats['sum_ms'] / stats['count'], 3),
+            'p50_ms': _percentile(ordered, 0.50),
+            'p95_ms': _percentile(ordered, 0.95),
+            'p99_ms': _percentile(ordered, 0.99),
+            'max_ms': ordered[-1] if ordered else None
+        })
+    return summary
+
+def recent(limit=50, route=None, errors_only=False):
+    """Newest traces first"""
+    selected = []
+    for trace in reversed(traces):
+        if route and trace['route'] != route:
+            continue
+        if errors_only and not trace['error'] and (trace['status'] or 500) < 500:
+            continue
+        selected.append(trace)
+        if len(selected) >= limit:
+            break
+    return selected
+
+def prometheus():
+    """Request latency histograms in the Prometheus text exposition format"""
+    if not endpoints:
+        return ''
+    name = 'sandbox_http_request_duration_seconds'
+    lines = [f"# HELP {name} Time to handle an HTTP request", f"# TYPE {name} histogram"]
+    for (method, route), stats in sorted(endpoints.items(), key=lambda item: item[0][1]):
+        labels = f'method="{method}",route="{route}"'
+        cumulative = 0
+        for bound, count in zip(BUCKETS_MS, stats['buckets']):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound / 1000:g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {stats["count"]}')
+        lines.append(f'{name}_sum{{{labels}}} {stats["sum_ms"] / 1000:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {stats["count"]}')
+    return '\n'.join(lines) + '\n'